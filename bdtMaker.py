@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 import logging
 import argparse
 import ROOT as r
@@ -9,6 +10,9 @@ import xgboost as xgb
 import matplotlib as plt
 from array    import array
 from optparse import OptionParser
+import mods.ROOTmanager as manager
+from mods import featureCache, featureStore, flatTrees
+from mods.features import bdt_features
 
 
 mpl_logger = logging.getLogger('matplotlib')
@@ -16,453 +20,295 @@ mpl_logger.setLevel(logging.WARNING)
 plt.use('Agg')
 
 class sampleContainer:
-    def __init__(self,filename,maxEvts,isSig):
+    def __init__(self,filename,maxEvts,isSig,cacheDir=None,cacheSize=featureCache.default_size):
 
         print("Initializing Container!")
-        self.tree = r.TChain("EcalVeto")
-        self.tree.Add(filename)
+        self.filename = filename
         self.maxEvts = maxEvts
         self.isSig   = isSig
 
-    def root2PyEvents(self):
-        self.events =  []
-        for event in self.tree:
-            if len(self.events) >= self.maxEvts:
-                continue
-
-            evt = [
-                    # Base variables
-                    event.nReadoutHits              ,
-                    event.summedDet                 ,
-                    event.summedTightIso            ,
-                    event.maxCellDep                ,
-                    event.showerRMS                 ,
-                    event.xStd                      ,
-                    event.yStd                      ,
-                    event.avgLayerHit               ,
-                    event.stdLayerHit               ,
-                    event.deepestLayerHit           ,
-                    event.ecalBackEnergy            ,
-                    # MIP Tracking variables
-                    event.straight4                 ,
-                    event.firstNearPhLayer          ,
-                    event.nNearPhHits               ,
-                    event.fullElectronTerritoryHits ,
-                    event.fullPhotonTerritoryHits   ,
-                    event.fullTerritoryRatio        ,
-                    event.electronTerritoryHits     ,
-                    event.photonTerritoryHits       ,
-                    event.TerritoryRatio            ,
-                    # Longitudinal segment variables
-                    event.energy_s1                 ,
-                    event.nHits_s1                  ,
-                    event.xMean_s1                  ,
-                    event.yMean_s1                  ,
-                    event.layerMean_s1              ,
-                    event.xStd_s1                   ,
-                    event.yStd_s1                   ,
-                    event.layerStd_s1               ,
-                    event.energy_s2                 ,
-                    event.nHits_s2                  ,
-                    event.xMean_s2                  ,
-                    event.yMean_s2                  ,
-                    event.layerMean_s2              ,
-                    event.xStd_s2                   ,
-                    event.yStd_s2                   ,
-                    event.layerStd_s2               ,
-                    event.energy_s3                 ,
-                    event.nHits_s3                  ,
-                    event.xMean_s3                  ,
-                    event.yMean_s3                  ,
-                    event.layerMean_s3              ,
-                    event.xStd_s3                   ,
-                    event.yStd_s3                   ,
-                    event.layerStd_s3               ,
-                    # Electron RoC variables
-                    event.eContEnergy_x1_s1         ,
-                    event.eContEnergy_x2_s1         ,
-                    event.eContEnergy_x3_s1         ,
-                    event.eContEnergy_x4_s1         ,
-                    event.eContEnergy_x5_s1         ,
-                    event.eContNHits_x1_s1          ,
-                    event.eContNHits_x2_s1          ,
-                    event.eContNHits_x3_s1          ,
-                    event.eContNHits_x4_s1          ,
-                    event.eContNHits_x5_s1          ,
-                    event.eContXMean_x1_s1          ,
-                    event.eContXMean_x2_s1          ,
-                    event.eContXMean_x3_s1          ,
-                    event.eContXMean_x4_s1          ,
-                    event.eContXMean_x5_s1          ,
-                    event.eContYMean_x1_s1          ,
-                    event.eContYMean_x2_s1          ,
-                    event.eContYMean_x3_s1          ,
-                    event.eContYMean_x4_s1          ,
-                    event.eContYMean_x5_s1          ,
-                    event.eContLayerMean_x1_s1      ,
-                    event.eContLayerMean_x2_s1      ,
-                    event.eContLayerMean_x3_s1      ,
-                    event.eContLayerMean_x4_s1      ,
-                    event.eContLayerMean_x5_s1      ,
-                    event.eContXStd_x1_s1           ,
-                    event.eContXStd_x2_s1           ,
-                    event.eContXStd_x3_s1           ,
-                    event.eContXStd_x4_s1           ,
-                    event.eContXStd_x5_s1           ,
-                    event.eContYStd_x1_s1           ,
-                    event.eContYStd_x2_s1           ,
-                    event.eContYStd_x3_s1           ,
-                    event.eContYStd_x4_s1           ,
-                    event.eContYStd_x5_s1           ,
-                    event.eContLayerStd_x1_s1       ,
-                    event.eContLayerStd_x2_s1       ,
-                    event.eContLayerStd_x3_s1       ,
-                    event.eContLayerStd_x4_s1       ,
-                    event.eContLayerStd_x5_s1       ,
-                    event.eContEnergy_x1_s2         ,
-                    event.eContEnergy_x2_s2         ,
-                    event.eContEnergy_x3_s2         ,
-                    event.eContEnergy_x4_s2         ,
-                    event.eContEnergy_x5_s2         ,
-                    event.eContNHits_x1_s2          ,
-                    event.eContNHits_x2_s2          ,
-                    event.eContNHits_x3_s2          ,
-                    event.eContNHits_x4_s2          ,
-                    event.eContNHits_x5_s2          ,
-                    event.eContXMean_x1_s2          ,
-                    event.eContXMean_x2_s2          ,
-                    event.eContXMean_x3_s2          ,
-                    event.eContXMean_x4_s2          ,
-                    event.eContXMean_x5_s2          ,
-                    event.eContYMean_x1_s2          ,
-                    event.eContYMean_x2_s2          ,
-                    event.eContYMean_x3_s2          ,
-                    event.eContYMean_x4_s2          ,
-                    event.eContYMean_x5_s2          ,
-                    event.eContLayerMean_x1_s2      ,
-                    event.eContLayerMean_x2_s2      ,
-                    event.eContLayerMean_x3_s2      ,
-                    event.eContLayerMean_x4_s2      ,
-                    event.eContLayerMean_x5_s2      ,
-                    event.eContXStd_x1_s2           ,
-                    event.eContXStd_x2_s2           ,
-                    event.eContXStd_x3_s2           ,
-                    event.eContXStd_x4_s2           ,
-                    event.eContXStd_x5_s2           ,
-                    event.eContYStd_x1_s2           ,
-                    event.eContYStd_x2_s2           ,
-                    event.eContYStd_x3_s2           ,
-                    event.eContYStd_x4_s2           ,
-                    event.eContYStd_x5_s2           ,
-                    event.eContLayerStd_x1_s2       ,
-                    event.eContLayerStd_x2_s2       ,
-                    event.eContLayerStd_x3_s2       ,
-                    event.eContLayerStd_x4_s2       ,
-                    event.eContLayerStd_x5_s2       ,
-                    event.eContEnergy_x1_s3         ,
-                    event.eContEnergy_x2_s3         ,
-                    event.eContEnergy_x3_s3         ,
-                    event.eContEnergy_x4_s3         ,
-                    event.eContEnergy_x5_s3         ,
-                    event.eContNHits_x1_s3          ,
-                    event.eContNHits_x2_s3          ,
-                    event.eContNHits_x3_s3          ,
-                    event.eContNHits_x4_s3          ,
-                    event.eContNHits_x5_s3          ,
-                    event.eContXMean_x1_s3          ,
-                    event.eContXMean_x2_s3          ,
-                    event.eContXMean_x3_s3          ,
-                    event.eContXMean_x4_s3          ,
-                    event.eContXMean_x5_s3          ,
-                    event.eContYMean_x1_s3          ,
-                    event.eContYMean_x2_s3          ,
-                    event.eContYMean_x3_s3          ,
-                    event.eContYMean_x4_s3          ,
-                    event.eContYMean_x5_s3          ,
-                    event.eContLayerMean_x1_s3      ,
-                    event.eContLayerMean_x2_s3      ,
-                    event.eContLayerMean_x3_s3      ,
-                    event.eContLayerMean_x4_s3      ,
-                    event.eContLayerMean_x5_s3      ,
-                    event.eContXStd_x1_s3           ,
-                    event.eContXStd_x2_s3           ,
-                    event.eContXStd_x3_s3           ,
-                    event.eContXStd_x4_s3           ,
-                    event.eContXStd_x5_s3           ,
-                    event.eContYStd_x1_s3           ,
-                    event.eContYStd_x2_s3           ,
-                    event.eContYStd_x3_s3           ,
-                    event.eContYStd_x4_s3           ,
-                    event.eContYStd_x5_s3           ,
-                    event.eContLayerStd_x1_s3       ,
-                    event.eContLayerStd_x2_s3       ,
-                    event.eContLayerStd_x3_s3       ,
-                    event.eContLayerStd_x4_s3       ,
-                    event.eContLayerStd_x5_s3       ,
-                    # Photon RoC variables
-                    event.gContEnergy_x1_s1         ,
-                    event.gContEnergy_x2_s1         ,
-                    event.gContEnergy_x3_s1         ,
-                    event.gContEnergy_x4_s1         ,
-                    event.gContEnergy_x5_s1         ,
-                    event.gContNHits_x1_s1          ,
-                    event.gContNHits_x2_s1          ,
-                    event.gContNHits_x3_s1          ,
-                    event.gContNHits_x4_s1          ,
-                    event.gContNHits_x5_s1          ,
-                    event.gContXMean_x1_s1          ,
-                    event.gContXMean_x2_s1          ,
-                    event.gContXMean_x3_s1          ,
-                    event.gContXMean_x4_s1          ,
-                    event.gContXMean_x5_s1          ,
-                    event.gContYMean_x1_s1          ,
-                    event.gContYMean_x2_s1          ,
-                    event.gContYMean_x3_s1          ,
-                    event.gContYMean_x4_s1          ,
-                    event.gContYMean_x5_s1          ,
-                    event.gContLayerMean_x1_s1      ,
-                    event.gContLayerMean_x2_s1      ,
-                    event.gContLayerMean_x3_s1      ,
-                    event.gContLayerMean_x4_s1      ,
-                    event.gContLayerMean_x5_s1      ,
-                    event.gContXStd_x1_s1           ,
-                    event.gContXStd_x2_s1           ,
-                    event.gContXStd_x3_s1           ,
-                    event.gContXStd_x4_s1           ,
-                    event.gContXStd_x5_s1           ,
-                    event.gContYStd_x1_s1           ,
-                    event.gContYStd_x2_s1           ,
-                    event.gContYStd_x3_s1           ,
-                    event.gContYStd_x4_s1           ,
-                    event.gContYStd_x5_s1           ,
-                    event.gContLayerStd_x1_s1       ,
-                    event.gContLayerStd_x2_s1       ,
-                    event.gContLayerStd_x3_s1       ,
-                    event.gContLayerStd_x4_s1       ,
-                    event.gContLayerStd_x5_s1       ,
-                    event.gContEnergy_x1_s2         ,
-                    event.gContEnergy_x2_s2         ,
-                    event.gContEnergy_x3_s2         ,
-                    event.gContEnergy_x4_s2         ,
-                    event.gContEnergy_x5_s2         ,
-                    event.gContNHits_x1_s2          ,
-                    event.gContNHits_x2_s2          ,
-                    event.gContNHits_x3_s2          ,
-                    event.gContNHits_x4_s2          ,
-                    event.gContNHits_x5_s2          ,
-                    event.gContXMean_x1_s2          ,
-                    event.gContXMean_x2_s2          ,
-                    event.gContXMean_x3_s2          ,
-                    event.gContXMean_x4_s2          ,
-                    event.gContXMean_x5_s2          ,
-                    event.gContYMean_x1_s2          ,
-                    event.gContYMean_x2_s2          ,
-                    event.gContYMean_x3_s2          ,
-                    event.gContYMean_x4_s2          ,
-                    event.gContYMean_x5_s2          ,
-                    event.gContLayerMean_x1_s2      ,
-                    event.gContLayerMean_x2_s2      ,
-                    event.gContLayerMean_x3_s2      ,
-                    event.gContLayerMean_x4_s2      ,
-                    event.gContLayerMean_x5_s2      ,
-                    event.gContXStd_x1_s2           ,
-                    event.gContXStd_x2_s2           ,
-                    event.gContXStd_x3_s2           ,
-                    event.gContXStd_x4_s2           ,
-                    event.gContXStd_x5_s2           ,
-                    event.gContYStd_x1_s2           ,
-                    event.gContYStd_x2_s2           ,
-                    event.gContYStd_x3_s2           ,
-                    event.gContYStd_x4_s2           ,
-                    event.gContYStd_x5_s2           ,
-                    event.gContLayerStd_x1_s2       ,
-                    event.gContLayerStd_x2_s2       ,
-                    event.gContLayerStd_x3_s2       ,
-                    event.gContLayerStd_x4_s2       ,
-                    event.gContLayerStd_x5_s2       ,
-                    event.gContEnergy_x1_s3         ,
-                    event.gContEnergy_x2_s3         ,
-                    event.gContEnergy_x3_s3         ,
-                    event.gContEnergy_x4_s3         ,
-                    event.gContEnergy_x5_s3         ,
-                    event.gContNHits_x1_s3          ,
-                    event.gContNHits_x2_s3          ,
-                    event.gContNHits_x3_s3          ,
-                    event.gContNHits_x4_s3          ,
-                    event.gContNHits_x5_s3          ,
-                    event.gContXMean_x1_s3          ,
-                    event.gContXMean_x2_s3          ,
-                    event.gContXMean_x3_s3          ,
-                    event.gContXMean_x4_s3          ,
-                    event.gContXMean_x5_s3          ,
-                    event.gContYMean_x1_s3          ,
-                    event.gContYMean_x2_s3          ,
-                    event.gContYMean_x3_s3          ,
-                    event.gContYMean_x4_s3          ,
-                    event.gContYMean_x5_s3          ,
-                    event.gContLayerMean_x1_s3      ,
-                    event.gContLayerMean_x2_s3      ,
-                    event.gContLayerMean_x3_s3      ,
-                    event.gContLayerMean_x4_s3      ,
-                    event.gContLayerMean_x5_s3      ,
-                    event.gContXStd_x1_s3           ,
-                    event.gContXStd_x2_s3           ,
-                    event.gContXStd_x3_s3           ,
-                    event.gContXStd_x4_s3           ,
-                    event.gContXStd_x5_s3           ,
-                    event.gContYStd_x1_s3           ,
-                    event.gContYStd_x2_s3           ,
-                    event.gContYStd_x3_s3           ,
-                    event.gContYStd_x4_s3           ,
-                    event.gContYStd_x5_s3           ,
-                    event.gContLayerStd_x1_s3       ,
-                    event.gContLayerStd_x2_s3       ,
-                    event.gContLayerStd_x3_s3       ,
-                    event.gContLayerStd_x4_s3       ,
-                    event.gContLayerStd_x5_s3       ,
-                    # Outside RoC variables
-                    event.oContEnergy_x1_s1         ,
-                    event.oContEnergy_x2_s1         ,
-                    event.oContEnergy_x3_s1         ,
-                    event.oContEnergy_x4_s1         ,
-                    event.oContEnergy_x5_s1         ,
-                    event.oContNHits_x1_s1          ,
-                    event.oContNHits_x2_s1          ,
-                    event.oContNHits_x3_s1          ,
-                    event.oContNHits_x4_s1          ,
-                    event.oContNHits_x5_s1          ,
-                    event.oContXMean_x1_s1          ,
-                    event.oContXMean_x2_s1          ,
-                    event.oContXMean_x3_s1          ,
-                    event.oContXMean_x4_s1          ,
-                    event.oContXMean_x5_s1          ,
-                    event.oContYMean_x1_s1          ,
-                    event.oContYMean_x2_s1          ,
-                    event.oContYMean_x3_s1          ,
-                    event.oContYMean_x4_s1          ,
-                    event.oContYMean_x5_s1          ,
-                    event.oContLayerMean_x1_s1      ,
-                    event.oContLayerMean_x2_s1      ,
-                    event.oContLayerMean_x3_s1      ,
-                    event.oContLayerMean_x4_s1      ,
-                    event.oContLayerMean_x5_s1      ,
-                    event.oContXStd_x1_s1           ,
-                    event.oContXStd_x2_s1           ,
-                    event.oContXStd_x3_s1           ,
-                    event.oContXStd_x4_s1           ,
-                    event.oContXStd_x5_s1           ,
-                    event.oContYStd_x1_s1           ,
-                    event.oContYStd_x2_s1           ,
-                    event.oContYStd_x3_s1           ,
-                    event.oContYStd_x4_s1           ,
-                    event.oContYStd_x5_s1           ,
-                    event.oContLayerStd_x1_s1       ,
-                    event.oContLayerStd_x2_s1       ,
-                    event.oContLayerStd_x3_s1       ,
-                    event.oContLayerStd_x4_s1       ,
-                    event.oContLayerStd_x5_s1       ,
-                    event.oContEnergy_x1_s2         ,
-                    event.oContEnergy_x2_s2         ,
-                    event.oContEnergy_x3_s2         ,
-                    event.oContEnergy_x4_s2         ,
-                    event.oContEnergy_x5_s2         ,
-                    event.oContNHits_x1_s2          ,
-                    event.oContNHits_x2_s2          ,
-                    event.oContNHits_x3_s2          ,
-                    event.oContNHits_x4_s2          ,
-                    event.oContNHits_x5_s2          ,
-                    event.oContXMean_x1_s2          ,
-                    event.oContXMean_x2_s2          ,
-                    event.oContXMean_x3_s2          ,
-                    event.oContXMean_x4_s2          ,
-                    event.oContXMean_x5_s2          ,
-                    event.oContYMean_x1_s2          ,
-                    event.oContYMean_x2_s2          ,
-                    event.oContYMean_x3_s2          ,
-                    event.oContYMean_x4_s2          ,
-                    event.oContYMean_x5_s2          ,
-                    event.oContLayerMean_x1_s2      ,
-                    event.oContLayerMean_x2_s2      ,
-                    event.oContLayerMean_x3_s2      ,
-                    event.oContLayerMean_x4_s2      ,
-                    event.oContLayerMean_x5_s2      ,
-                    event.oContXStd_x1_s2           ,
-                    event.oContXStd_x2_s2           ,
-                    event.oContXStd_x3_s2           ,
-                    event.oContXStd_x4_s2           ,
-                    event.oContXStd_x5_s2           ,
-                    event.oContYStd_x1_s2           ,
-                    event.oContYStd_x2_s2           ,
-                    event.oContYStd_x3_s2           ,
-                    event.oContYStd_x4_s2           ,
-                    event.oContYStd_x5_s2           ,
-                    event.oContLayerStd_x1_s2       ,
-                    event.oContLayerStd_x2_s2       ,
-                    event.oContLayerStd_x3_s2       ,
-                    event.oContLayerStd_x4_s2       ,
-                    event.oContLayerStd_x5_s2       ,
-                    event.oContEnergy_x1_s3         ,
-                    event.oContEnergy_x2_s3         ,
-                    event.oContEnergy_x3_s3         ,
-                    event.oContEnergy_x4_s3         ,
-                    event.oContEnergy_x5_s3         ,
-                    event.oContNHits_x1_s3          ,
-                    event.oContNHits_x2_s3          ,
-                    event.oContNHits_x3_s3          ,
-                    event.oContNHits_x4_s3          ,
-                    event.oContNHits_x5_s3          ,
-                    event.oContXMean_x1_s3          ,
-                    event.oContXMean_x2_s3          ,
-                    event.oContXMean_x3_s3          ,
-                    event.oContXMean_x4_s3          ,
-                    event.oContXMean_x5_s3          ,
-                    event.oContYMean_x1_s3          ,
-                    event.oContYMean_x2_s3          ,
-                    event.oContYMean_x3_s3          ,
-                    event.oContYMean_x4_s3          ,
-                    event.oContYMean_x5_s3          ,
-                    event.oContLayerMean_x1_s3      ,
-                    event.oContLayerMean_x2_s3      ,
-                    event.oContLayerMean_x3_s3      ,
-                    event.oContLayerMean_x4_s3      ,
-                    event.oContLayerMean_x5_s3      ,
-                    event.oContXStd_x1_s3           ,
-                    event.oContXStd_x2_s3           ,
-                    event.oContXStd_x3_s3           ,
-                    event.oContXStd_x4_s3           ,
-                    event.oContXStd_x5_s3           ,
-                    event.oContYStd_x1_s3           ,
-                    event.oContYStd_x2_s3           ,
-                    event.oContYStd_x3_s3           ,
-                    event.oContYStd_x4_s3           ,
-                    event.oContYStd_x5_s3           ,
-                    event.oContLayerStd_x1_s3       ,
-                    event.oContLayerStd_x2_s3       ,
-                    event.oContLayerStd_x3_s3       ,
-                    event.oContLayerStd_x4_s3       ,
-                    event.oContLayerStd_x5_s3       ,
-                    ]
-
-            self.events.append(evt)
-
-        new_idx=np.random.permutation(np.arange(np.shape(self.events)[0]))
-        self.events = np.array(self.events)
-        np.take(self.events, new_idx, axis=0, out=self.events)
-        print("Final Event Shape" + str(np.shape(self.events)))
-
-    def constructTrainAndTest(self):
-        self.train_x = self.events
-        self.train_y = np.zeros(len(self.train_x)) + (self.isSig == True)
+        # Events come from the feature cache (memory-mapped) or straight from the tree
+        self.cached = None
+        if cacheDir != None:
+            self.cached = featureCache.load(filename, bdt_features, manager.readFeatures,
+                                            maxEvts, cacheDir, cacheSize)
+            self.nEvents = len(self.cached)
+        else:
+            self.tree = manager.load([filename], 'EcalVeto')
+            self.nEvents = min(self.tree.GetEntries(), maxEvts)
+
+    def root2PyEvents(self, out, order, chunkSize=100000):
+
+        # Fill out (this sample's rows of the merged matrix) chunk by chunk, event i
+        # going to row order[i] and NaNs replaced in each chunk
+        if self.cached is not None:
+            chunks = (np.array(self.cached[start:start + chunkSize])\
+                      for start in range(0, self.nEvents, chunkSize))
+        else:
+            chunks = manager.featureChunks(self.tree, bdt_features, self.nEvents, chunkSize)
+
+        start = 0
+        for chunk in chunks:
+            chunk[np.isnan(chunk)] = 0.000
+            out[order[start:start + len(chunk)]] = chunk
+            start += len(chunk)
+        print("Final Event Shape" + str(np.shape(out)))
 
 class mergedContainer:
     def __init__(self, sigContainer,bkgContainer):
-        self.train_x = np.vstack((sigContainer.train_x,bkgContainer.train_x))
-        self.train_y = np.append(sigContainer.train_y,bkgContainer.train_y)
-        
-        self.train_x[np.isnan(self.train_x)] = 0.000
-        self.train_y[np.isnan(self.train_y)] = 0.000
-        
+
+        # One float32 matrix for signal then background events
+        # Each sample is shuffled by filling its rows in a random order, which puts
+        # every event where permuting the loaded rows would have
+        # train_evt is the index of each row's event in its own sample
+        nSig, nBkg = sigContainer.nEvents, bkgContainer.nEvents
+        self.train_x = np.empty((nSig + nBkg, len(bdt_features)), dtype=np.float32)
+        self.train_y = np.zeros(nSig + nBkg, dtype=np.float32)
+        self.train_y[:nSig] = 1
+        self.train_evt = np.empty(nSig + nBkg, dtype=np.int64)
+
+        for container, rows, evts in ((sigContainer, self.train_x[:nSig], self.train_evt[:nSig]),
+                                      (bkgContainer, self.train_x[nSig:], self.train_evt[nSig:])):
+            new_idx = np.random.permutation(np.arange(container.nEvents))
+            order = np.empty_like(new_idx)
+            order[new_idx] = np.arange(container.nEvents)
+            container.root2PyEvents(rows, order)
+            evts[:] = new_idx
+
         self.dtrain = xgb.DMatrix(self.train_x,self.train_y)
+
+# Feature matrix of the first maxEvts events of filename (a file, pattern or feature
+# store, see featureStore) chunkSize events at a time
+def featureChunks(filename, maxEvts, chunkSize):
+    files = featureCache.expand(filename)
+    if all(featureStore.isStore(f) for f in files):
+        for f in files:
+            for chunk in featureStore.storeChunks(f, bdt_features, maxEvts, chunkSize):
+                maxEvts -= len(chunk)
+                yield chunk
+            if maxEvts <= 0: return
+    else:
+        tree = manager.load(files, 'EcalVeto')
+        for chunk in manager.featureChunks(tree, bdt_features,
+                                           min(tree.GetEntries(), maxEvts), chunkSize):
+            yield chunk
+
+# Streams signal and background chunks into xgboost (DataIter needs xgboost >= 1.5)
+# so a quantile or external memory DMatrix can be built without every event in memory
+# NaNs are replaced like in mergedContainer
+class chunkIter(getattr(xgb, 'DataIter', object)):
+    def __init__(self, sources, maxEvts, chunkSize, cache_prefix=None):
+        self.sources = sources # [(filename, isSig)]
+        self.maxEvts = maxEvts
+        self.chunkSize = chunkSize
+        self.chunks = None
+        super(chunkIter, self).__init__(cache_prefix=cache_prefix)
+
+    def generate(self):
+        for filename, isSig in self.sources:
+            for chunk in featureChunks(filename, self.maxEvts, self.chunkSize):
+                chunk[np.isnan(chunk)] = 0.000
+                yield chunk, np.zeros(len(chunk), dtype=np.float32) + (isSig == True)
+
+    def reset(self):
+        self.chunks = None
+
+    def next(self, input_data):
+        if self.chunks is None:
+            self.chunks = self.generate()
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            return False
+        input_data(data=chunk[0], label=chunk[1])
+        return True
+
+# Wall time of every boosting round (callbacks need xgboost >= 1.3; older versions
+# only get the total)
+class roundTimer(getattr(xgb.callback, 'TrainingCallback', object)):
+    def __init__(self, pfreq=100):
+        self.pfreq = pfreq
+        self.times = []
+        self.start = time.time()
+
+    def before_iteration(self, model, epoch, evals_log):
+        self.roundStart = time.time()
+        return False
+
+    def after_iteration(self, model, epoch, evals_log):
+        self.times.append(time.time() - self.roundStart)
+        if (epoch + 1)%self.pfreq == 0:
+            print('Round {}: {:.3f} s ({:.1f} s so far)'.format(epoch + 1, self.times[-1],
+                                                               time.time() - self.start))
+        return False
+
+    def summary(self, outfile=None):
+        total = time.time() - self.start
+        if self.times == []:
+            print('Training took {:.1f} s'.format(total))
+            return
+        times = np.array(self.times)
+        print('Training took {:.1f} s for {} rounds: {:.3f} s/round '\
+              '(median {:.3f}, min {:.3f}, max {:.3f})'.format(total, len(times),
+                    times.mean(), np.median(times), times.min(), times.max()))
+        if outfile != None:
+            np.savetxt(outfile, times, fmt='%.6f', header='seconds per boosting round')
+
+# Merged matrix rows held out for validation: the last fraction of the (shuffled)
+# signal rows and of the background rows, so both samples keep their share
+def validationSplit(nSig, nBkg, fraction):
+    nSigValid, nBkgValid = int(round(nSig*fraction)), int(round(nBkg*fraction))
+    train = np.concatenate((np.arange(nSig - nSigValid),
+                            np.arange(nSig, nSig + nBkg - nBkgValid)))
+    valid = np.concatenate((np.arange(nSig - nSigValid, nSig),
+                            np.arange(nSig + nBkg - nBkgValid, nSig + nBkg)))
+    return train, valid
+
+# Metrics where higher is better (the rest are losses)
+maximized_metrics = ['auc', 'aucpr', 'map', 'ndcg', 'pre']
+
+# Sort key putting the best scores (and failed trials last) first
+def rankKey(score, metric):
+    if score != score: return np.inf
+    return -score if metric.split('@')[0] in maximized_metrics else score
+
+# Train one search trial on binary DMatrix files up to the largest of rounds and score
+# the model's first n trees for every n in rounds (so each tree number doesn't need
+# its own training); returns ([validation metric], [seconds to grow n trees])
+# Slicing boosters and the round timer need xgboost >= 1.3
+def searchTrial(trainPath, validPath, params, rounds):
+    dtrain, dvalid = xgb.DMatrix(trainPath), xgb.DMatrix(validPath)
+    timer = roundTimer(pfreq=max(rounds) + 1)
+    bst = xgb.train(params, dtrain, max(rounds), callbacks=[timer])
+    scores = [float(bst[:n].eval(dvalid).split(':')[-1]) for n in rounds]
+    return scores, [sum(timer.times[:n]) for n in rounds]
+
+# Grid or successive halving search over eta, depth and tree number
+# The split DMatrices are saved once as binary files that every trial loads, trials
+# run search_jobs at a time with nthread/search_jobs threads each, and the ranked
+# results go to outfile; returns the best (eta, depth, tree number)
+def runSearch(options, params, dtrain, nSig, nBkg, outdir, outfile):
+
+    etas   = [float(x) for x in options.search_eta.split(',')]
+    depths = [int(x) for x in options.search_depth.split(',')]
+    trees  = [int(x) for x in options.search_trees.split(',')]
+    metric = options.search_metric
+
+    train, valid = validationSplit(nSig, nBkg, options.search_valid)
+    trainPath = os.path.join(outdir, 'search_train.buffer')
+    validPath = os.path.join(outdir, 'search_valid.buffer')
+    dtrain.slice(train).save_binary(trainPath)
+    dtrain.slice(valid).save_binary(validPath)
+
+    trialParams = dict(params, eval_metric=metric,
+                       nthread=max(1, options.nthread//options.search_jobs))
+    for key in ['silent', 'early_stopping_rounds']:
+        trialParams.pop(key, None)
+
+    # Grid: every combination in one rung, each (eta, depth) trained once up to the
+    # largest tree number and scored at every tree number
+    # Halving: every (eta, depth) left gets a third of the trees of the next rung and
+    # the best third of them go on, up to the largest tree number
+    configs = [(eta, depth) for eta in etas for depth in depths]
+    if options.search == 'grid':
+        nRungs = 1
+    else:
+        nRungs = 1 + int(np.ceil(np.log(len(configs))/np.log(3)))
+
+    results = []
+    for k in range(nRungs):
+        if options.search == 'grid':
+            trials = [(eta, depth, sorted(trees)) for eta, depth in configs]
+        else:
+            trials = [(eta, depth, [max(1, max(trees)//3**(nRungs - 1 - k))])\
+                      for eta, depth in configs]
+        print( 'Search rung {}: {} trials'.format(k, len(trials)) )
+
+        out = manager.poolRun(searchTrial,
+                              [(trainPath, validPath,
+                                dict(trialParams, eta=eta, max_depth=depth), rounds)\
+                               for eta, depth, rounds in trials], options.search_jobs)
+        rung = []
+        for (eta, depth, rounds), (code, result) in zip(trials, out):
+            if code != 0:
+                result = ([np.nan]*len(rounds), [np.nan]*len(rounds))
+            for n, score, seconds in zip(rounds, *result):
+                rung.append({'rung': k, 'eta': eta, 'depth': depth, 'trees': n,
+                             metric: score, 'seconds': seconds})
+                print( 'eta {} depth {} trees {}: {} {:.5f} ({:.1f} s)'.format(eta, depth,
+                                                            n, metric, score, seconds) )
+        results += rung
+
+        rung.sort(key=lambda row: rankKey(row[metric], metric))
+        configs = [(row['eta'], row['depth']) for row in rung[:int(np.ceil(len(rung)/3.))]]
+
+    os.remove(trainPath)
+    os.remove(validPath)
+
+    # Trials of the last rung first, by metric
+    results.sort(key=lambda row: (-row['rung'], rankKey(row[metric], metric)))
+    columns = ['rank', 'eta', 'depth', 'trees', metric, 'seconds', 'rung']
+    with open(outfile, 'w') as f:
+        f.write(' '.join('{:>10}'.format(column) for column in columns) + '\n')
+        for rank, row in enumerate(results):
+            row['rank'] = rank + 1
+            f.write(' '.join('{:>10.5g}'.format(row[column]) if isinstance(row[column], float)\
+                             else '{:>10}'.format(row[column]) for column in columns) + '\n')
+    print( 'Search results in {}'.format(outfile) )
+
+    best = results[0]
+    return best['eta'], best['depth'], best['trees']
+
+# K-fold cross-validation on the merged events, folds training kfold_jobs at a time in
+# threads (xgboost releases the GIL) in one process, with no copy of the events per
+# worker; each running fold does hold a DMatrix slice with (K-1)/K of the rows, freed
+# as soon as it's trained, so memory grows with kfold_jobs
+# Folds are stratified: every K-th (shuffled) row of each sample
+# Prints the spread of the fold metrics and saves the out-of-fold predictions with
+# each row's label, fold and event index in its sample to outfile (.npz)
+def runKFold(options, params, eventContainer, nSig, nBkg, outfile):
+
+    from threading import Lock
+    from concurrent.futures import ThreadPoolExecutor
+
+    K = options.kfold
+    dtrain = eventContainer.dtrain
+    fold = np.concatenate((np.arange(nSig)%K, np.arange(nBkg)%K))
+    foldParams = dict(params, nthread=max(1, options.nthread//options.kfold_jobs))
+    lock = Lock()
+
+    def trainFold(k):
+        train, valid = np.flatnonzero(fold != k), np.flatnonzero(fold == k)
+        with lock:
+            dfit, dvalid = dtrain.slice(train), dtrain.slice(valid)
+        start = time.time()
+        bst = xgb.train(foldParams, dfit, options.tree_number)
+        del dfit
+        score = float(bst.eval(dvalid).split(':')[-1])
+        prediction = bst.predict(dvalid)
+        del dvalid, bst
+        return valid, score, prediction, time.time() - start
+
+    with ThreadPoolExecutor(options.kfold_jobs) as pool:
+        results = list(pool.map(trainFold, range(K)))
+
+    oof = np.empty(nSig + nBkg, dtype=np.float32)
+    scores = []
+    for k, (valid, score, prediction, seconds) in enumerate(results):
+        oof[valid] = prediction
+        scores.append(score)
+        print( 'Fold {}: {} {:.5f} ({:.1f} s)'.format(k, options.metric, score, seconds) )
+    scores = np.array(scores)
+    print( '{}-fold {}: {:.5f} +- {:.5f} (min {:.5f}, max {:.5f})'.format(K, options.metric,
+            scores.mean(), scores.std(), scores.min(), scores.max()) )
+
+    np.savez(outfile, prediction=oof, label=eventContainer.train_y,
+             event=eventContainer.train_evt, fold=fold, scores=scores)
+    print( 'Out-of-fold predictions in {}'.format(outfile) )
+
+def availableCores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
     
 
 if __name__ == "__main__":
@@ -477,6 +323,25 @@ if __name__ == "__main__":
     parser.add_option('-b', dest='bkg_file', default='./bdt_0/bkg_train.root', help='name of background file')
     parser.add_option('-s', dest='sig_file', default='./bdt_0/sig_train.root', help='name of signal file')
     parser.add_option('-o', dest='out_name',  default='bdt_test', help='Output Pickle Name')
+    parser.add_option('--cache_dir', dest='cache_dir', default=None, help='Feature matrix cache directory (no cache if not given)')
+    parser.add_option('--cache_size', dest='cache_size',type="float", default=featureCache.default_size, help='Feature matrix cache size cap (GB)')
+    parser.add_option('--nthread', dest='nthread',type="int", default=availableCores(), help='Training threads (default: available cores)')
+    parser.add_option('--tree_method', dest='tree_method', default='exact', choices=['exact','approx','hist'], help='xgboost tree method: exact, approx or hist')
+    parser.add_option('--max_bin', dest='max_bin',type="int", default=256, help='Feature bins for approx/hist')
+    parser.add_option('--stream', dest='stream', default=None, choices=['quantile','external'], help='Stream the events in chunks into a quantile DMatrix or an external memory (on-disk) DMatrix instead of loading them all')
+    parser.add_option('--chunk', dest='chunk',type="int", default=100000, help='Events per chunk when streaming')
+    parser.add_option('--valid', dest='valid',type="float", default=0.1, help='Fraction of each sample held out for early stopping (0 to train on everything)')
+    parser.add_option('--metric', dest='metric', default='error', help='Validation metric for early stopping')
+    parser.add_option('--early_stop', dest='early_stop',type="int", default=10, help='Stop after this many rounds without the validation metric improving')
+    parser.add_option('--kfold', dest='kfold',type="int", default=0, help='Also cross-validate with this many folds, reporting their metric spread and out-of-fold predictions')
+    parser.add_option('--kfold_jobs', dest='kfold_jobs',type="int", default=2, help='Folds trained at once (sharing --nthread), each holding a (K-1)/K slice of the events [Default: 2]')
+    parser.add_option('--search', dest='search', default=None, choices=['grid','halving'], help='Search eta, depth and tree number (grid or successive halving) before training the best')
+    parser.add_option('--search_eta', dest='search_eta', default='0.01,0.023,0.05', help='Comma separated etas to search')
+    parser.add_option('--search_depth', dest='search_depth', default='6,8,10', help='Comma separated max depths to search')
+    parser.add_option('--search_trees', dest='search_trees', default='250,500,1000', help='Comma separated tree numbers to search (halving goes up to the largest)')
+    parser.add_option('--search_metric', dest='search_metric', default='auc', help='Validation metric the search ranks by')
+    parser.add_option('--search_valid', dest='search_valid',type="float", default=0.2, help='Fraction of each sample held out to score the search')
+    parser.add_option('--search_jobs', dest='search_jobs',type="int", default=4, help='Search trials run at once (sharing --nthread)')
     (options, args) = parser.parse_args()
 
     # Seed numpy's randomness
@@ -495,27 +360,26 @@ if __name__ == "__main__":
         else:
             bdt_num+=1
 
+    if options.search != None and options.stream != None:
+        sys.exit('The search needs the events in memory (no --stream)')
+    if options.stream != None and options.valid > 0:
+        print( 'No validation split when streaming; training all --tree_number rounds' )
+
+    # Streamed DMatrices are built from histogram bins, which the exact method doesn't use
+    if options.stream != None and options.tree_method == 'exact':
+        print( 'Streaming needs approx or hist trees; using hist' )
+        options.tree_method = 'hist'
+
     # Print run info
     print( 'Random seed is = {}'.format(options.seed)             )
     print( 'You set max_evt = {}'.format(options.max_evt)         )
     print( 'You set tree number = {}'.format(options.tree_number) )
     print( 'You set max tree depth = {}'.format(options.depth)    )
     print( 'You set eta = {}'.format(options.eta)                 )
-
-    # Make Signal Container
-    print( 'Loading sig_file = {}'.format(options.sig_file) )
-    sigContainer = sampleContainer(options.sig_file,options.max_evt,True)
-    sigContainer.root2PyEvents()
-    sigContainer.constructTrainAndTest()
-
-    # Make Background Container
-    print( 'Loading bkg_file = {}'.format(options.bkg_file) )
-    bkgContainer = sampleContainer(options.bkg_file,options.max_evt,False)
-    bkgContainer.root2PyEvents()
-    bkgContainer.constructTrainAndTest()
-
-    # Merge
-    eventContainer = mergedContainer(sigContainer,bkgContainer)
+    print( 'You set nthread = {}'.format(options.nthread)         )
+    print( 'You set tree method = {}'.format(options.tree_method) )
+    if options.tree_method != 'exact':
+        print( 'You set max_bin = {}'.format(options.max_bin)     )
 
     params     = {'objective': 'binary:logistic',
                   'eta': options.eta,
@@ -525,20 +389,108 @@ if __name__ == "__main__":
                   'subsample':.9,
                   'colsample_bytree': .85,
                   #'eval_metric': 'auc',
-                  'eval_metric': 'error',
+                  'eval_metric': options.metric,
                   'seed': 1,
-                  'nthread': 1,
-                  'verbosity': 1,
-                  'early_stopping_rounds' : 10}
+                  'nthread': options.nthread,
+                  'tree_method': options.tree_method,
+                  'verbosity': 1}
+    if options.tree_method != 'exact':
+        params['max_bin'] = options.max_bin
+
+    if options.stream != None:
+
+        # Stream chunks of the signal and background files (read once per pass)
+        if not hasattr(xgb, 'DataIter'):
+            sys.exit('Streaming needs xgboost >= 1.5')
+        if options.stream == 'quantile' and not hasattr(xgb, 'QuantileDMatrix'):
+            sys.exit('--stream quantile needs xgboost >= 1.7 (--stream external needs 1.5)')
+        print( 'Streaming sig_file = {} and bkg_file = {} in chunks of {}'.format(
+                options.sig_file, options.bkg_file, options.chunk) )
+        sources = [(options.sig_file, True), (options.bkg_file, False)]
+        if options.stream == 'quantile':
+            dtrain = xgb.QuantileDMatrix(chunkIter(sources, options.max_evt, options.chunk),
+                                         max_bin=options.max_bin)
+        else:
+            dtrain = xgb.DMatrix(chunkIter(sources, options.max_evt, options.chunk,
+                                 cache_prefix=os.path.join(options.out_name+'_'+str(bdt_num),
+                                                           'dmatrix_cache')))
+        print( 'Streamed {} events'.format(dtrain.num_row()) )
+
+    else:
+
+        # Make Signal Container
+        print( 'Loading sig_file = {}'.format(options.sig_file) )
+        sigContainer = sampleContainer(options.sig_file,options.max_evt,True,options.cache_dir,options.cache_size)
+
+        # Make Background Container
+        print( 'Loading bkg_file = {}'.format(options.bkg_file) )
+        bkgContainer = sampleContainer(options.bkg_file,options.max_evt,False,options.cache_dir,options.cache_size)
+
+        # Load both into one matrix
+        eventContainer = mergedContainer(sigContainer,bkgContainer)
+        dtrain = eventContainer.dtrain
+
+        # Search, then train the best settings on all events
+        if options.search != None:
+            options.eta, options.depth, options.tree_number = runSearch(options, params,
+                    dtrain, sigContainer.nEvents, bkgContainer.nEvents,
+                    options.out_name+'_'+str(bdt_num),
+                    options.out_name+'_'+str(bdt_num)+'_search.txt')
+            print( 'Training with eta = {}, depth = {}, tree number = {}'.format(
+                    options.eta, options.depth, options.tree_number) )
+            params['eta'], params['max_depth'] = options.eta, options.depth
+
+        # Cross-validate (all --tree_number trees per fold, so every fold's
+        # predictions are of events it never saw in any way)
+        if options.kfold > 1:
+            options.kfold_jobs = max(1, min(options.kfold_jobs, options.kfold))
+            runKFold(options, params, eventContainer,
+                     sigContainer.nEvents, bkgContainer.nEvents,
+                     options.out_name+'_'+str(bdt_num)+'/' + \
+                     options.out_name+'_'+str(bdt_num)+'_oof.npz')
+
+        # Hold out validation events for early stopping
+        if options.valid > 0:
+            train, valid = validationSplit(sigContainer.nEvents, bkgContainer.nEvents,
+                                           options.valid)
+            dvalid = dtrain.slice(valid)
+            dtrain = dtrain.slice(train)
+            print( 'Early stopping on {} of {} validation events after {} rounds'.format(
+                    options.metric, len(valid), options.early_stop) )
 
     # Actual training
-    gbm = xgb.train(params, eventContainer.dtrain, options.tree_number)
+    timer = roundTimer()
+    kwargs = {}
+    if hasattr(xgb.callback, 'TrainingCallback'):
+        kwargs['callbacks'] = [timer]
+    if options.stream == None and options.valid > 0:
+        kwargs.update(evals=[(dvalid, 'valid')], early_stopping_rounds=options.early_stop,
+                      verbose_eval=100)
+    gbm = xgb.train(params, dtrain, options.tree_number, **kwargs)
+    timer.summary(options.out_name+'_'+str(bdt_num)+'/' + \
+            options.out_name+'_'+str(bdt_num)+'_round_times.txt')
+
+    # Keep the trees up to the best validation round, which is recorded in the model
+    if options.stream == None and options.valid > 0:
+        best_iteration, best_score = gbm.best_iteration, gbm.best_score
+        print( 'Best iteration {} of {}: valid {} = {}'.format(best_iteration,
+                gbm.num_boosted_rounds(), options.metric, best_score) )
+        gbm = gbm[:best_iteration + 1]
+        gbm.set_attr(best_iteration=str(best_iteration), best_score=str(best_score))
 
     # Store BDT
     output = open(options.out_name+'_'+str(bdt_num)+'/' + \
             options.out_name+'_'+str(bdt_num)+'_weights.pkl', 'wb')
     pkl.dump(gbm, output)
 
+    # Also in xgboost's own format, which later xgboost versions can read
+    gbm.save_model(options.out_name+'_'+str(bdt_num)+'/' + \
+            options.out_name+'_'+str(bdt_num)+'_weights.ubj')
+
+    # And flattened for evaluation without xgboost (see mods/flatTrees)
+    flatTrees.save(flatTrees.flatten(gbm), options.out_name+'_'+str(bdt_num)+'/' + \
+            options.out_name+'_'+str(bdt_num)+'_weights.npz')
+
     # Plot feature importances
     xgb.plot_importance(gbm)
     plt.pyplot.savefig(options.out_name+'_'+str(bdt_num)+"/" + \
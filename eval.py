@@ -1,486 +1,126 @@
 import os
 import sys
 import numpy as np
-import pickle as pkl
-import xgboost as xgb
 import mods.ROOTmanager as manager
+from mods import featureCache, models
+from mods.features import bdt_features
 from treeMaker import branches_info
 
-pkl_file   = os.getcwd()+'/dummy_0/dummy_0_weights.pkl'
-model = pkl.load(open(pkl_file,'rb'))
+# Model evaluated unless set with --model (relative to where eval is run from)
+default_model = 'dummy_0/dummy_0_weights.pkl'
+
+# Events scored per predict call unless set with --chunk
+default_batch = 10000
+
+# Events written to each output part file unless set with --buffer (every part is
+# merged into the output tree at the end, so parts hold many batches)
+default_buffer = 100000
 
 def main():
 
     # Inputs and their trees and stuff
     pdict = manager.parse()
-    inlist = pdict['inlist']
-    outlist = pdict['outlist']
-    group_labels = pdict['groupls']
-    maxEvent = pdict['maxEvent']
-
-    branches_info['discValue_EcalVeto'] = {'rtype': float, 'default': 0.5}
-
-    # Construct tree processes
-    procs = []
-    for gl, group in zip(group_labels, inlist):
-        procs.append( manager.TreeProcess(event_process, group, ID=gl, tree_name='EcalVeto',
-            pfreq=100) )
-
-    # Process jobs
-    for proc in procs:
-
-        print('\nRunning %s'%(proc.ID))
-        
-        # Move into appropriate scratch dir
-        os.chdir(proc.tmp_dir)
-
-        # Make an output file and new tree (copied from input + discValue)
-        proc.tfMaker = manager.TreeMaker(group_labels[procs.index(proc)]+'.root',\
-                                         "EcalVeto",\
-                                         branches_info,\
-                                         outlist[procs.index(proc)]
-                                         )
-
-        # RUN
-        proc.extrafs = [ proc.tfMaker.wq ] # Gets executed at the end of run()
-        proc.run(maxEvents=maxEvent)
+    if pdict['model'] == None:
+        pdict['model'] = os.path.abspath(default_model)
+
+    # Process jobs (in parallel and/or split into shards if asked)
+    failed = manager.runJobs(runGroup, pdict, ['.root'], treeName='EcalVeto')
 
     # Remove scratch directory if there is one
     manager.rmScratch()
 
+    if failed:
+        sys.exit('\nFailed: {}\n'.format(', '.join(failed)))
+
     print('\nDone!\n')
 
 
+# Build and run the tree process for one group; returns the number of events processed
+def runGroup(gl, group, outdir, pdict):
+
+    out_info = dict(branches_info, discValue_EcalVeto={'rtype': float, 'default': 0.5})
+
+    proc = manager.TreeProcess(event_process, group, ID=gl, tree_name='EcalVeto',
+            pfreq=100, stage=pdict['stage'], copiers=pdict['copiers'],
+            cacheSize=pdict['cacheSize'], pruneBranches=pdict['prune'])
+
+    print('\nRunning %s'%(proc.ID))
+
+    # Events are scored batchSize at a time
+    batchSize = pdict['chunkSize'] if pdict['chunkSize'] > 0 else default_batch
+
+    # Features come from the feature cache (read in one pass over the group on a miss)
+    # as float32, the precision the BDT uses, whole batches at a time, and then nothing
+    # is read from the tree
+    # Otherwise only the features are read from the input tree, one event at a time
+    proc.features = None
+    if pdict['featureCache'] != None:
+        stop = -1 if pdict['maxEvents'] == -1 else pdict['startEvent'] + pdict['maxEvents']
+        proc.features = featureCache.load(group, bdt_features, manager.readFeatures, stop,
+                                          pdict['featureCache'], pdict['featureCacheSize'])
+        proc.readBranches([])
+    else:
+        proc.readBranches(bdt_features)
+        proc.featBatch = np.empty((batchSize, len(bdt_features)))
+        proc.nBatch = 0
+
+    # Load the model (or reuse it if this process already has)
+    proc.model = models.load(pdict['model'])
+
+    # Move into appropriate scratch dir
+    os.chdir(proc.tmp_dir)
+
+    # Make an output file and new tree (copied from input + discValue), written in bulk
+    proc.tfMaker = manager.TreeMaker(gl+'.root',\
+                                     "EcalVeto",\
+                                     out_info,\
+                                     outdir,\
+                                     bufferSize=pdict['bufferSize'] if pdict['bufferSize'] > 0\
+                                                else default_buffer
+                                     )
+    proc.feat_slots = proc.tfMaker.layout.slot(bdt_features)
+    proc.disc_slot = proc.tfMaker.layout.slots['discValue_EcalVeto']
+
+    # RUN
+    proc.extrafs = [ lambda: flushBatch(proc), proc.tfMaker.wq ] # Executed at the end of run()
+    proc.run(strEvent=pdict['startEvent'], maxEvents=pdict['maxEvents'],
+             chunkSize=batchSize if proc.features is not None else 0)
+
+    return proc.maxEvents
+
+
 def event_process(self):
 
-    # Feature list from input tree
-    # Exp: feats = [ feat_value for feat_value in self.tree~ ]
-    # Put all segmentation variables in for now (Take out the ones we won't need once
-    # we make sure that all the python bdt stuff works)
-    feats = [
-            # Base variables
-            self.tree.nReadoutHits              ,
-            self.tree.summedDet                 ,
-            self.tree.summedTightIso            ,
-            self.tree.maxCellDep                ,
-            self.tree.showerRMS                 ,
-            self.tree.xStd                      ,
-            self.tree.yStd                      ,
-            self.tree.avgLayerHit               ,
-            self.tree.stdLayerHit               ,
-            self.tree.deepestLayerHit           ,
-            self.tree.ecalBackEnergy            ,
-            # MIP Tracking variables
-            self.tree.straight4                 ,
-            self.tree.firstNearPhLayer          ,
-            self.tree.nNearPhHits               ,
-            self.tree.fullElectronTerritoryHits ,
-            self.tree.fullPhotonTerritoryHits   ,
-            self.tree.fullTerritoryRatio        ,
-            self.tree.electronTerritoryHits     ,
-            self.tree.photonTerritoryHits       ,
-            self.tree.TerritoryRatio            ,
-            # Longitudinal segment variables
-            self.tree.energy_s1                 ,
-            self.tree.nHits_s1                  ,
-            self.tree.xMean_s1                  ,
-            self.tree.yMean_s1                  ,
-            self.tree.layerMean_s1              ,
-            self.tree.xStd_s1                   ,
-            self.tree.yStd_s1                   ,
-            self.tree.layerStd_s1               ,
-            self.tree.energy_s2                 ,
-            self.tree.nHits_s2                  ,
-            self.tree.xMean_s2                  ,
-            self.tree.yMean_s2                  ,
-            self.tree.layerMean_s2              ,
-            self.tree.xStd_s2                   ,
-            self.tree.yStd_s2                   ,
-            self.tree.layerStd_s2               ,
-            self.tree.energy_s3                 ,
-            self.tree.nHits_s3                  ,
-            self.tree.xMean_s3                  ,
-            self.tree.yMean_s3                  ,
-            self.tree.layerMean_s3              ,
-            self.tree.xStd_s3                   ,
-            self.tree.yStd_s3                   ,
-            self.tree.layerStd_s3               ,
-            # Electron RoC variables
-            self.tree.eContEnergy_x1_s1         ,
-            self.tree.eContEnergy_x2_s1         ,
-            self.tree.eContEnergy_x3_s1         ,
-            self.tree.eContEnergy_x4_s1         ,
-            self.tree.eContEnergy_x5_s1         ,
-            self.tree.eContNHits_x1_s1          ,
-            self.tree.eContNHits_x2_s1          ,
-            self.tree.eContNHits_x3_s1          ,
-            self.tree.eContNHits_x4_s1          ,
-            self.tree.eContNHits_x5_s1          ,
-            self.tree.eContXMean_x1_s1          ,
-            self.tree.eContXMean_x2_s1          ,
-            self.tree.eContXMean_x3_s1          ,
-            self.tree.eContXMean_x4_s1          ,
-            self.tree.eContXMean_x5_s1          ,
-            self.tree.eContYMean_x1_s1          ,
-            self.tree.eContYMean_x2_s1          ,
-            self.tree.eContYMean_x3_s1          ,
-            self.tree.eContYMean_x4_s1          ,
-            self.tree.eContYMean_x5_s1          ,
-            self.tree.eContLayerMean_x1_s1      ,
-            self.tree.eContLayerMean_x2_s1      ,
-            self.tree.eContLayerMean_x3_s1      ,
-            self.tree.eContLayerMean_x4_s1      ,
-            self.tree.eContLayerMean_x5_s1      ,
-            self.tree.eContXStd_x1_s1           ,
-            self.tree.eContXStd_x2_s1           ,
-            self.tree.eContXStd_x3_s1           ,
-            self.tree.eContXStd_x4_s1           ,
-            self.tree.eContXStd_x5_s1           ,
-            self.tree.eContYStd_x1_s1           ,
-            self.tree.eContYStd_x2_s1           ,
-            self.tree.eContYStd_x3_s1           ,
-            self.tree.eContYStd_x4_s1           ,
-            self.tree.eContYStd_x5_s1           ,
-            self.tree.eContLayerStd_x1_s1       ,
-            self.tree.eContLayerStd_x2_s1       ,
-            self.tree.eContLayerStd_x3_s1       ,
-            self.tree.eContLayerStd_x4_s1       ,
-            self.tree.eContLayerStd_x5_s1       ,
-            self.tree.eContEnergy_x1_s2         ,
-            self.tree.eContEnergy_x2_s2         ,
-            self.tree.eContEnergy_x3_s2         ,
-            self.tree.eContEnergy_x4_s2         ,
-            self.tree.eContEnergy_x5_s2         ,
-            self.tree.eContNHits_x1_s2          ,
-            self.tree.eContNHits_x2_s2          ,
-            self.tree.eContNHits_x3_s2          ,
-            self.tree.eContNHits_x4_s2          ,
-            self.tree.eContNHits_x5_s2          ,
-            self.tree.eContXMean_x1_s2          ,
-            self.tree.eContXMean_x2_s2          ,
-            self.tree.eContXMean_x3_s2          ,
-            self.tree.eContXMean_x4_s2          ,
-            self.tree.eContXMean_x5_s2          ,
-            self.tree.eContYMean_x1_s2          ,
-            self.tree.eContYMean_x2_s2          ,
-            self.tree.eContYMean_x3_s2          ,
-            self.tree.eContYMean_x4_s2          ,
-            self.tree.eContYMean_x5_s2          ,
-            self.tree.eContLayerMean_x1_s2      ,
-            self.tree.eContLayerMean_x2_s2      ,
-            self.tree.eContLayerMean_x3_s2      ,
-            self.tree.eContLayerMean_x4_s2      ,
-            self.tree.eContLayerMean_x5_s2      ,
-            self.tree.eContXStd_x1_s2           ,
-            self.tree.eContXStd_x2_s2           ,
-            self.tree.eContXStd_x3_s2           ,
-            self.tree.eContXStd_x4_s2           ,
-            self.tree.eContXStd_x5_s2           ,
-            self.tree.eContYStd_x1_s2           ,
-            self.tree.eContYStd_x2_s2           ,
-            self.tree.eContYStd_x3_s2           ,
-            self.tree.eContYStd_x4_s2           ,
-            self.tree.eContYStd_x5_s2           ,
-            self.tree.eContLayerStd_x1_s2       ,
-            self.tree.eContLayerStd_x2_s2       ,
-            self.tree.eContLayerStd_x3_s2       ,
-            self.tree.eContLayerStd_x4_s2       ,
-            self.tree.eContLayerStd_x5_s2       ,
-            self.tree.eContEnergy_x1_s3         ,
-            self.tree.eContEnergy_x2_s3         ,
-            self.tree.eContEnergy_x3_s3         ,
-            self.tree.eContEnergy_x4_s3         ,
-            self.tree.eContEnergy_x5_s3         ,
-            self.tree.eContNHits_x1_s3          ,
-            self.tree.eContNHits_x2_s3          ,
-            self.tree.eContNHits_x3_s3          ,
-            self.tree.eContNHits_x4_s3          ,
-            self.tree.eContNHits_x5_s3          ,
-            self.tree.eContXMean_x1_s3          ,
-            self.tree.eContXMean_x2_s3          ,
-            self.tree.eContXMean_x3_s3          ,
-            self.tree.eContXMean_x4_s3          ,
-            self.tree.eContXMean_x5_s3          ,
-            self.tree.eContYMean_x1_s3          ,
-            self.tree.eContYMean_x2_s3          ,
-            self.tree.eContYMean_x3_s3          ,
-            self.tree.eContYMean_x4_s3          ,
-            self.tree.eContYMean_x5_s3          ,
-            self.tree.eContLayerMean_x1_s3      ,
-            self.tree.eContLayerMean_x2_s3      ,
-            self.tree.eContLayerMean_x3_s3      ,
-            self.tree.eContLayerMean_x4_s3      ,
-            self.tree.eContLayerMean_x5_s3      ,
-            self.tree.eContXStd_x1_s3           ,
-            self.tree.eContXStd_x2_s3           ,
-            self.tree.eContXStd_x3_s3           ,
-            self.tree.eContXStd_x4_s3           ,
-            self.tree.eContXStd_x5_s3           ,
-            self.tree.eContYStd_x1_s3           ,
-            self.tree.eContYStd_x2_s3           ,
-            self.tree.eContYStd_x3_s3           ,
-            self.tree.eContYStd_x4_s3           ,
-            self.tree.eContYStd_x5_s3           ,
-            self.tree.eContLayerStd_x1_s3       ,
-            self.tree.eContLayerStd_x2_s3       ,
-            self.tree.eContLayerStd_x3_s3       ,
-            self.tree.eContLayerStd_x4_s3       ,
-            self.tree.eContLayerStd_x5_s3       ,
-            # Photon RoC variables
-            self.tree.gContEnergy_x1_s1         ,
-            self.tree.gContEnergy_x2_s1         ,
-            self.tree.gContEnergy_x3_s1         ,
-            self.tree.gContEnergy_x4_s1         ,
-            self.tree.gContEnergy_x5_s1         ,
-            self.tree.gContNHits_x1_s1          ,
-            self.tree.gContNHits_x2_s1          ,
-            self.tree.gContNHits_x3_s1          ,
-            self.tree.gContNHits_x4_s1          ,
-            self.tree.gContNHits_x5_s1          ,
-            self.tree.gContXMean_x1_s1          ,
-            self.tree.gContXMean_x2_s1          ,
-            self.tree.gContXMean_x3_s1          ,
-            self.tree.gContXMean_x4_s1          ,
-            self.tree.gContXMean_x5_s1          ,
-            self.tree.gContYMean_x1_s1          ,
-            self.tree.gContYMean_x2_s1          ,
-            self.tree.gContYMean_x3_s1          ,
-            self.tree.gContYMean_x4_s1          ,
-            self.tree.gContYMean_x5_s1          ,
-            self.tree.gContLayerMean_x1_s1      ,
-            self.tree.gContLayerMean_x2_s1      ,
-            self.tree.gContLayerMean_x3_s1      ,
-            self.tree.gContLayerMean_x4_s1      ,
-            self.tree.gContLayerMean_x5_s1      ,
-            self.tree.gContXStd_x1_s1           ,
-            self.tree.gContXStd_x2_s1           ,
-            self.tree.gContXStd_x3_s1           ,
-            self.tree.gContXStd_x4_s1           ,
-            self.tree.gContXStd_x5_s1           ,
-            self.tree.gContYStd_x1_s1           ,
-            self.tree.gContYStd_x2_s1           ,
-            self.tree.gContYStd_x3_s1           ,
-            self.tree.gContYStd_x4_s1           ,
-            self.tree.gContYStd_x5_s1           ,
-            self.tree.gContLayerStd_x1_s1       ,
-            self.tree.gContLayerStd_x2_s1       ,
-            self.tree.gContLayerStd_x3_s1       ,
-            self.tree.gContLayerStd_x4_s1       ,
-            self.tree.gContLayerStd_x5_s1       ,
-            self.tree.gContEnergy_x1_s2         ,
-            self.tree.gContEnergy_x2_s2         ,
-            self.tree.gContEnergy_x3_s2         ,
-            self.tree.gContEnergy_x4_s2         ,
-            self.tree.gContEnergy_x5_s2         ,
-            self.tree.gContNHits_x1_s2          ,
-            self.tree.gContNHits_x2_s2          ,
-            self.tree.gContNHits_x3_s2          ,
-            self.tree.gContNHits_x4_s2          ,
-            self.tree.gContNHits_x5_s2          ,
-            self.tree.gContXMean_x1_s2          ,
-            self.tree.gContXMean_x2_s2          ,
-            self.tree.gContXMean_x3_s2          ,
-            self.tree.gContXMean_x4_s2          ,
-            self.tree.gContXMean_x5_s2          ,
-            self.tree.gContYMean_x1_s2          ,
-            self.tree.gContYMean_x2_s2          ,
-            self.tree.gContYMean_x3_s2          ,
-            self.tree.gContYMean_x4_s2          ,
-            self.tree.gContYMean_x5_s2          ,
-            self.tree.gContLayerMean_x1_s2      ,
-            self.tree.gContLayerMean_x2_s2      ,
-            self.tree.gContLayerMean_x3_s2      ,
-            self.tree.gContLayerMean_x4_s2      ,
-            self.tree.gContLayerMean_x5_s2      ,
-            self.tree.gContXStd_x1_s2           ,
-            self.tree.gContXStd_x2_s2           ,
-            self.tree.gContXStd_x3_s2           ,
-            self.tree.gContXStd_x4_s2           ,
-            self.tree.gContXStd_x5_s2           ,
-            self.tree.gContYStd_x1_s2           ,
-            self.tree.gContYStd_x2_s2           ,
-            self.tree.gContYStd_x3_s2           ,
-            self.tree.gContYStd_x4_s2           ,
-            self.tree.gContYStd_x5_s2           ,
-            self.tree.gContLayerStd_x1_s2       ,
-            self.tree.gContLayerStd_x2_s2       ,
-            self.tree.gContLayerStd_x3_s2       ,
-            self.tree.gContLayerStd_x4_s2       ,
-            self.tree.gContLayerStd_x5_s2       ,
-            self.tree.gContEnergy_x1_s3         ,
-            self.tree.gContEnergy_x2_s3         ,
-            self.tree.gContEnergy_x3_s3         ,
-            self.tree.gContEnergy_x4_s3         ,
-            self.tree.gContEnergy_x5_s3         ,
-            self.tree.gContNHits_x1_s3          ,
-            self.tree.gContNHits_x2_s3          ,
-            self.tree.gContNHits_x3_s3          ,
-            self.tree.gContNHits_x4_s3          ,
-            self.tree.gContNHits_x5_s3          ,
-            self.tree.gContXMean_x1_s3          ,
-            self.tree.gContXMean_x2_s3          ,
-            self.tree.gContXMean_x3_s3          ,
-            self.tree.gContXMean_x4_s3          ,
-            self.tree.gContXMean_x5_s3          ,
-            self.tree.gContYMean_x1_s3          ,
-            self.tree.gContYMean_x2_s3          ,
-            self.tree.gContYMean_x3_s3          ,
-            self.tree.gContYMean_x4_s3          ,
-            self.tree.gContYMean_x5_s3          ,
-            self.tree.gContLayerMean_x1_s3      ,
-            self.tree.gContLayerMean_x2_s3      ,
-            self.tree.gContLayerMean_x3_s3      ,
-            self.tree.gContLayerMean_x4_s3      ,
-            self.tree.gContLayerMean_x5_s3      ,
-            self.tree.gContXStd_x1_s3           ,
-            self.tree.gContXStd_x2_s3           ,
-            self.tree.gContXStd_x3_s3           ,
-            self.tree.gContXStd_x4_s3           ,
-            self.tree.gContXStd_x5_s3           ,
-            self.tree.gContYStd_x1_s3           ,
-            self.tree.gContYStd_x2_s3           ,
-            self.tree.gContYStd_x3_s3           ,
-            self.tree.gContYStd_x4_s3           ,
-            self.tree.gContYStd_x5_s3           ,
-            self.tree.gContLayerStd_x1_s3       ,
-            self.tree.gContLayerStd_x2_s3       ,
-            self.tree.gContLayerStd_x3_s3       ,
-            self.tree.gContLayerStd_x4_s3       ,
-            self.tree.gContLayerStd_x5_s3       ,
-            # Outside RoC variables
-            self.tree.oContEnergy_x1_s1         ,
-            self.tree.oContEnergy_x2_s1         ,
-            self.tree.oContEnergy_x3_s1         ,
-            self.tree.oContEnergy_x4_s1         ,
-            self.tree.oContEnergy_x5_s1         ,
-            self.tree.oContNHits_x1_s1          ,
-            self.tree.oContNHits_x2_s1          ,
-            self.tree.oContNHits_x3_s1          ,
-            self.tree.oContNHits_x4_s1          ,
-            self.tree.oContNHits_x5_s1          ,
-            self.tree.oContXMean_x1_s1          ,
-            self.tree.oContXMean_x2_s1          ,
-            self.tree.oContXMean_x3_s1          ,
-            self.tree.oContXMean_x4_s1          ,
-            self.tree.oContXMean_x5_s1          ,
-            self.tree.oContYMean_x1_s1          ,
-            self.tree.oContYMean_x2_s1          ,
-            self.tree.oContYMean_x3_s1          ,
-            self.tree.oContYMean_x4_s1          ,
-            self.tree.oContYMean_x5_s1          ,
-            self.tree.oContLayerMean_x1_s1      ,
-            self.tree.oContLayerMean_x2_s1      ,
-            self.tree.oContLayerMean_x3_s1      ,
-            self.tree.oContLayerMean_x4_s1      ,
-            self.tree.oContLayerMean_x5_s1      ,
-            self.tree.oContXStd_x1_s1           ,
-            self.tree.oContXStd_x2_s1           ,
-            self.tree.oContXStd_x3_s1           ,
-            self.tree.oContXStd_x4_s1           ,
-            self.tree.oContXStd_x5_s1           ,
-            self.tree.oContYStd_x1_s1           ,
-            self.tree.oContYStd_x2_s1           ,
-            self.tree.oContYStd_x3_s1           ,
-            self.tree.oContYStd_x4_s1           ,
-            self.tree.oContYStd_x5_s1           ,
-            self.tree.oContLayerStd_x1_s1       ,
-            self.tree.oContLayerStd_x2_s1       ,
-            self.tree.oContLayerStd_x3_s1       ,
-            self.tree.oContLayerStd_x4_s1       ,
-            self.tree.oContLayerStd_x5_s1       ,
-            self.tree.oContEnergy_x1_s2         ,
-            self.tree.oContEnergy_x2_s2         ,
-            self.tree.oContEnergy_x3_s2         ,
-            self.tree.oContEnergy_x4_s2         ,
-            self.tree.oContEnergy_x5_s2         ,
-            self.tree.oContNHits_x1_s2          ,
-            self.tree.oContNHits_x2_s2          ,
-            self.tree.oContNHits_x3_s2          ,
-            self.tree.oContNHits_x4_s2          ,
-            self.tree.oContNHits_x5_s2          ,
-            self.tree.oContXMean_x1_s2          ,
-            self.tree.oContXMean_x2_s2          ,
-            self.tree.oContXMean_x3_s2          ,
-            self.tree.oContXMean_x4_s2          ,
-            self.tree.oContXMean_x5_s2          ,
-            self.tree.oContYMean_x1_s2          ,
-            self.tree.oContYMean_x2_s2          ,
-            self.tree.oContYMean_x3_s2          ,
-            self.tree.oContYMean_x4_s2          ,
-            self.tree.oContYMean_x5_s2          ,
-            self.tree.oContLayerMean_x1_s2      ,
-            self.tree.oContLayerMean_x2_s2      ,
-            self.tree.oContLayerMean_x3_s2      ,
-            self.tree.oContLayerMean_x4_s2      ,
-            self.tree.oContLayerMean_x5_s2      ,
-            self.tree.oContXStd_x1_s2           ,
-            self.tree.oContXStd_x2_s2           ,
-            self.tree.oContXStd_x3_s2           ,
-            self.tree.oContXStd_x4_s2           ,
-            self.tree.oContXStd_x5_s2           ,
-            self.tree.oContYStd_x1_s2           ,
-            self.tree.oContYStd_x2_s2           ,
-            self.tree.oContYStd_x3_s2           ,
-            self.tree.oContYStd_x4_s2           ,
-            self.tree.oContYStd_x5_s2           ,
-            self.tree.oContLayerStd_x1_s2       ,
-            self.tree.oContLayerStd_x2_s2       ,
-            self.tree.oContLayerStd_x3_s2       ,
-            self.tree.oContLayerStd_x4_s2       ,
-            self.tree.oContLayerStd_x5_s2       ,
-            self.tree.oContEnergy_x1_s3         ,
-            self.tree.oContEnergy_x2_s3         ,
-            self.tree.oContEnergy_x3_s3         ,
-            self.tree.oContEnergy_x4_s3         ,
-            self.tree.oContEnergy_x5_s3         ,
-            self.tree.oContNHits_x1_s3          ,
-            self.tree.oContNHits_x2_s3          ,
-            self.tree.oContNHits_x3_s3          ,
-            self.tree.oContNHits_x4_s3          ,
-            self.tree.oContNHits_x5_s3          ,
-            self.tree.oContXMean_x1_s3          ,
-            self.tree.oContXMean_x2_s3          ,
-            self.tree.oContXMean_x3_s3          ,
-            self.tree.oContXMean_x4_s3          ,
-            self.tree.oContXMean_x5_s3          ,
-            self.tree.oContYMean_x1_s3          ,
-            self.tree.oContYMean_x2_s3          ,
-            self.tree.oContYMean_x3_s3          ,
-            self.tree.oContYMean_x4_s3          ,
-            self.tree.oContYMean_x5_s3          ,
-            self.tree.oContLayerMean_x1_s3      ,
-            self.tree.oContLayerMean_x2_s3      ,
-            self.tree.oContLayerMean_x3_s3      ,
-            self.tree.oContLayerMean_x4_s3      ,
-            self.tree.oContLayerMean_x5_s3      ,
-            self.tree.oContXStd_x1_s3           ,
-            self.tree.oContXStd_x2_s3           ,
-            self.tree.oContXStd_x3_s3           ,
-            self.tree.oContXStd_x4_s3           ,
-            self.tree.oContXStd_x5_s3           ,
-            self.tree.oContYStd_x1_s3           ,
-            self.tree.oContYStd_x2_s3           ,
-            self.tree.oContYStd_x3_s3           ,
-            self.tree.oContYStd_x4_s3           ,
-            self.tree.oContYStd_x5_s3           ,
-            self.tree.oContLayerStd_x1_s3       ,
-            self.tree.oContLayerStd_x2_s3       ,
-            self.tree.oContLayerStd_x3_s3       ,
-            self.tree.oContLayerStd_x4_s3       ,
-            self.tree.oContLayerStd_x5_s3       ,
-            ]
-
-    # Copy input tree feats to new tree
-    for feat_name, feat_value in zip(self.tfMaker.branches_info, feats):
-        self.tfMaker.branches[feat_name][0] = feat_value
-
-    # Add prediction to new tree
-    evtarray = np.array([feats])
-    pred = float(model.predict(xgb.DMatrix(evtarray))[0])
-    self.tfMaker.branches['discValue_EcalVeto'][0] = pred
-
-    # Fill new tree with current event values
-    self.tfMaker.tree.Fill()
+    # A whole batch of cached features
+    if self.features is not None:
+        scoreBatch(self, self.features[self.event_count:self.chunk_stop])
+        return
+
+    # Or the features of this event, added to the batch
+    self.featBatch[self.nBatch] = [getattr(self.tree, name) for name in bdt_features]
+    self.nBatch += 1
+    if self.nBatch == len(self.featBatch):
+        flushBatch(self)
+
+def flushBatch(self):
+
+    # Score the events collected so far
+
+    if self.features is None and self.nBatch > 0:
+        scoreBatch(self, self.featBatch[:self.nBatch])
+        self.nBatch = 0
+
+def scoreBatch(self, feats):
+
+    # Predict a batch of events with one call and write them with their features
+    # (copied to their branches by name)
+
+    preds = models.predict(self.model, feats)
+
+    rows = np.empty((len(feats), len(self.tfMaker.layout.names)))
+    rows[:, self.feat_slots] = feats
+    rows[:, self.disc_slot] = preds
+    self.tfMaker.fillRows(rows)
 
 if __name__ == "__main__":
     main()
@@ -38,6 +38,51 @@ lineStyles = {
 # For easier loops
 lineStyle_list = [i for i in range(1,11)]
 
+# Accessors (and C++ value types) used to read ldmx objects into numpy columns
+# Collections are flattened over events; scalars give one value per event
+column_accessors = {
+        'EcalHit': {
+            'energy':    ('getEnergy()',    'double'),
+            'amplitude': ('getAmplitude()', 'double'),
+            'x':         ('getXPos()',      'double'),
+            'y':         ('getYPos()',      'double'),
+            'z':         ('getZPos()',      'double'),
+            'id':        ('getID()',        'int'   )
+            },
+        'SimTrackerHit': {
+            'x':       ('getPosition()[0]', 'double'),
+            'y':       ('getPosition()[1]', 'double'),
+            'z':       ('getPosition()[2]', 'double'),
+            'px':      ('getMomentum()[0]', 'double'),
+            'py':      ('getMomentum()[1]', 'double'),
+            'pz':      ('getMomentum()[2]', 'double'),
+            'trackID': ('getTrackID()',     'int'   ),
+            'pdgID':   ('getPdgID()',       'int'   )
+            },
+        'EcalVetoResult': {
+            'nReadoutHits':    ('getNReadoutHits()',    'int'   ),
+            'summedDet':       ('getSummedDet()',       'double'),
+            'summedTightIso':  ('getSummedTightIso()',  'double'),
+            'maxCellDep':      ('getMaxCellDep()',      'double'),
+            'showerRMS':       ('getShowerRMS()',       'double'),
+            'xStd':            ('getXStd()',            'double'),
+            'yStd':            ('getYStd()',            'double'),
+            'avgLayerHit':     ('getAvgLayerHit()',     'double'),
+            'stdLayerHit':     ('getStdLayerHit()',     'double'),
+            'deepestLayerHit': ('getDeepestLayerHit()', 'int'   ),
+            'ecalBackEnergy':  ('getEcalBackEnergy()',  'double')
+            }
+        }
+
+# Ways of getting input files to TreeProcess (see stageFiles)
+staging_modes = ['local', 'link', 'copy', 'prefetch']
+
+# Classes stored once per event rather than in a std::vector
+scalar_classes = ['EventHeader', 'EcalVetoResult', 'HcalVetoResult', 'TriggerResult']
+
+# Events per block when a TreeMaker writes a feature store without a bufferSize
+storeBufferSize = 10000
+
 
 ###################################
 # Classes
@@ -48,7 +93,8 @@ class TreeProcess:
     # For analysing .root samples
 
     def __init__(self, event_process, group=[], tree=None, tree_name = None, ID = '',\
-            color=1, strEvent=0, maxEvents=-1, pfreq=1000, batch=False, extrafs=None):
+            color=1, strEvent=0, maxEvents=-1, pfreq=1000, batch=False, extrafs=None,\
+            chunkSize=0, stage='local', copiers=4, cacheSize=0, pruneBranches=True):
 
         print('\nPreparing {}'.format(ID))
 
@@ -63,6 +109,16 @@ class TreeProcess:
         self.pfreq = pfreq
         self.batch = batch
         self.extrafs = extrafs
+        self.chunkSize = chunkSize
+        self.stage = stage
+        self.copiers = copiers
+        self.cacheSize = cacheSize
+        self.pruneBranches = pruneBranches
+        self.activeBranches = []
+        self.pruned = False # Set once every branch not in activeBranches is off
+        self.columns = {}
+        self.reader = None
+        self.prefetcher = None
         self.cwd = os.getcwd()
         
         # Build tree amd move operations to a scratch directory
@@ -76,40 +132,39 @@ class TreeProcess:
             scratch_dir = self.cwd + '/scratch'
             print( 'Using scratch path %s' % scratch_dir )
             if not os.path.exists(scratch_dir):
-                os.makedirs(scratch_dir)
-
-            # Get tmp num
-            num=0; check = True
-            while check:
-                if os.path.exists( scratch_dir+'/tmp_'+str(num) ):
+                try:
+                    os.makedirs(scratch_dir)
+                except OSError:
+                    pass # Made by a parallel job in the meantime
+
+            # Create a tmp directory that can be used to copy files into
+            # (makedirs fails if another process took the name first, so just try the next)
+            prefix = os.environ['LSB_JOBID'] if self.batch else 'tmp'
+            num = 0
+            while True:
+                self.tmp_dir = '%s/%s_%s' % (scratch_dir, prefix, num)
+                try:
+                    os.makedirs(self.tmp_dir)
+                    break
+                except OSError:
                     num += 1
-                else:
-                    check = False 
-
-            # Create and mv into tmp directory that can be used to copy files into
-            if self.batch:
-                self.tmp_dir='%s/%s' % (scratch_dir, os.environ['LSB_JOBID'])
-            else:
-                self.tmp_dir = '%s/%s' % (scratch_dir, 'tmp_'+str(num))
-            if not os.path.exists(self.tmp_dir):
-                print( 'Creating tmp directory %s' % self.tmp_dir )
-            os.makedirs(self.tmp_dir)
+            print( 'Created tmp directory %s' % self.tmp_dir )
             os.chdir(self.tmp_dir)
     
-            # Copy input files to the tmp directory
-            print( 'Copying input files into tmp directory' )
-            for rfilename in self.group_files:
-                os.system("cp %s ." % rfilename )
-            os.system("ls .")
-    
-            # Just get the file names without the full path
-            tmpfiles = [f.split('/')[-1] for f in self.group_files]
+            # Stage input files (read in place, link or copy into the tmp directory)
+            # Prefetching starts from the files in place and copies them during run()
+            tmpfiles = stageFiles(self.group_files, self.tmp_dir,
+                                  'local' if self.stage == 'prefetch' else self.stage,
+                                  self.copiers, self.cwd)
     
             # Load'em
-            if self.tree_name != None:
-                self.tree = load(tmpfiles, self.tree_name)
+            treeName = self.tree_name if self.tree_name != None else 'LDMX_Events'
+            if self.stage == 'prefetch':
+                entries = fileEntries(tmpfiles, treeName)
+                self.prefetcher = Prefetcher(tmpfiles, self.tmp_dir, entries)
+                self.tree = load(self.prefetcher.tmpfiles, treeName, entries)
             else:
-                self.tree = load(tmpfiles)
+                self.tree = load(tmpfiles, treeName)
 
             # Move back to cwd in case running multiple procs
             os.chdir(self.cwd)
@@ -129,12 +184,100 @@ class TreeProcess:
         else: branch = r.std.vector('ldmx::'+ldmx_class)()
 
         self.tree.SetBranchAddress(branch_name,r.AddressOf(branch))
+        self.readBranches([branch_name])
 
         return branch
+
+    def readBranches(self, branch_names):
+
+        # Mark branches as needed (e.g. ones read straight from self.tree)
+        # Unless pruneBranches is off, every branch not marked is switched off,
+        # so GetEntry only reads and decompresses what's used
+
+        if self.tree == None:
+            sys.exit('Set tree')
+
+        if not self.pruneBranches:
+            return
+
+        if not self.pruned:
+            self.tree.SetBranchStatus('*', 0)
+            self.pruned = True
+
+        for branch_name in branch_names:
+            if branch_name in self.activeBranches: continue
+            # Wildcard picks up the sub-branches of split ldmx objects too
+            self.tree.SetBranchStatus(branch_name + '*', 1)
+            self.activeBranches.append(branch_name)
+
+    def setupCache(self):
+
+        # TTreeCache of cacheSize bytes, filled with just the active branches
+
+        self.tree.LoadTree(self.strEvent)
+        self.tree.SetCacheSize(int(self.cacheSize))
+        if not self.pruned:
+            self.tree.AddBranchToCache('*', True)
+        for branch_name in self.activeBranches:
+            self.tree.AddBranchToCache(branch_name + '*', True)
+        self.tree.StopCacheLearningPhase()
+
+    def addColumns(self, ldmx_class, branch_name, names=None):
+
+        # Add a branch to read into numpy columns when running in chunks
+        # names picks a subset of column_accessors[ldmx_class] (all by default)
+
+        if self.tree == None:
+            sys.exit('Set tree')
+
+        if not ldmx_class in column_accessors:
+            sys.exit('No column accessors for {}'.format(ldmx_class))
+
+        if names == None:
+            names = list(column_accessors[ldmx_class])
+
+        self.columns[branch_name] = {'ldmx_class': ldmx_class, 'names': names}
+        self.readBranches([branch_name])
+
+    def readChunk(self, start, stop):
+
+        # Read events [start, stop) into numpy arrays
+        # Collections come back flattened with per-event offsets so that
+        # chunk[branch][name][offsets[i]:offsets[i+1]] belongs to event start + i
+
+        # Nothing to read if no columns were added (the process reads its own data)
+        if self.columns == {}:
+            return {}
+
+        # Compiled once (see columnReader), then only reads the entries of each chunk
+        if self.reader == None:
+            self.reader = columnReader(self.columns)
+        self.reader.read(self.tree, start, stop)
+
+        chunk = {}
+        for j, branch_name in enumerate(self.columns):
+            ldmx_class = self.columns[branch_name]['ldmx_class']
+            chunk[branch_name] = {}
+
+            if not ldmx_class in scalar_classes:
+                offsets = np.zeros(stop - start + 1, dtype=np.int64)
+                np.cumsum(vectorArray(getattr(self.reader, 'n{}'.format(j)), np.int64),
+                          out=offsets[1:])
+                chunk[branch_name]['offsets'] = offsets
+
+            for k, name in enumerate(self.columns[branch_name]['names']):
+                dtype = np.int64\
+                        if column_accessors[ldmx_class][name][1] == 'int' else np.float64
+                chunk[branch_name][name] = vectorArray(
+                                getattr(self.reader, 'c{}_{}'.format(j, k)), dtype)
+
+        return chunk
  
-    def run(self, strEvent=0, maxEvents=-1, pfreq=1000):
+    def run(self, strEvent=0, maxEvents=-1, pfreq=1000, chunkSize=0):
    
         # Process events
+        # With chunkSize > 0, event_process is called once per chunk of events
+        # with the columns registered by addColumns in self.chunk
 
         if strEvent != 0: self.strEvent = strEvent
         if maxEvents != -1: self.maxEvents = maxEvents
@@ -142,14 +285,48 @@ class TreeProcess:
             self.maxEvents = self.tree.GetEntries() - self.strEvent
         maxEvent = self.strEvent + self.maxEvents
         if pfreq != 1000: self.pfreq = pfreq
+        if chunkSize != 0: self.chunkSize = chunkSize
+
+        # Don't let the prefetcher fetch past the last file needed
+        staged_stop = -1
+        if self.prefetcher != None and self.maxEvents > 0:
+            self.prefetcher.limit(maxEvent)
+
+        # Read cache (needs the first file in place)
+        if self.cacheSize > 0 and self.maxEvents > 0:
+            if self.prefetcher != None:
+                staged_stop = self.prefetcher.require(self.strEvent, self.strEvent + 1)
+            self.setupCache()
+
+        bytesRead = r.TFile.GetFileBytesRead()
 
         self.event_count = self.strEvent
-        while self.event_count < maxEvent:
-            self.tree.GetEntry(self.event_count)
-            if self.event_count%self.pfreq == 0:
-                print('Processing Event: %s'%(self.event_count))
-            self.event_process(self)
-            self.event_count += 1
+        if self.chunkSize > 0:
+            while self.event_count < maxEvent:
+                self.chunk_stop = min(self.event_count + self.chunkSize, maxEvent)
+                print('Processing Events: {} - {}'.format(self.event_count,
+                                                          self.chunk_stop - 1))
+                if self.prefetcher != None:
+                    self.prefetcher.require(self.event_count, self.chunk_stop)
+                self.chunk = self.readChunk(self.event_count, self.chunk_stop)
+                self.event_process(self)
+                self.event_count = self.chunk_stop
+        else:
+            while self.event_count < maxEvent:
+                if self.prefetcher != None and self.event_count >= staged_stop:
+                    staged_stop = self.prefetcher.require(self.event_count,
+                                                          self.event_count + 1)
+                self.tree.GetEntry(self.event_count)
+                if self.event_count%self.pfreq == 0:
+                    print('Processing Event: %s'%(self.event_count))
+                self.event_process(self)
+                self.event_count += 1
+
+        # Report how much had to be read from disk
+        bytesRead = r.TFile.GetFileBytesRead() - bytesRead
+        print('Read {:.0f} bytes/event ({} branches active)'.format(
+                    float(bytesRead)/max(self.maxEvents, 1),
+                    len(self.activeBranches) if self.pruned else 'all'))
 
         # Execute any closing function(s) (might impliment *args, **kwargs later)
         if self.extrafs != None:
@@ -159,16 +336,137 @@ class TreeProcess:
         # Move back to cwd in case running multiple procs
         os.chdir(self.cwd)
 
+        # Stop any copies still running
+        if self.prefetcher != None:
+            self.prefetcher.finish()
+
         # Remove tmp directory if created in move
         if self.mvd:
             print( 'Removing tmp directory %s' % self.tmp_dir )
             os.system('rm -rf %s' % self.tmp_dir)
 
+class Prefetcher:
+
+    # Copies the input files of a TChain into tmp_dir one file ahead of the one being
+    # read, removing files once the reading has moved past them, so copy time hides
+    # behind processing and only a couple of files sit in scratch at once
+
+    def __init__(self, files, tmp_dir, entries):
+
+        import threading
+
+        self.files = files
+        self.tmpfiles = [os.path.join(tmp_dir, os.path.basename(f)) for f in files]
+        self.offsets = np.concatenate(([0], np.cumsum(entries)))
+        self.stop = len(files)   # Don't fetch files from here on
+        self.lock = threading.Lock()
+        self.threads = {}
+        self.errors = {}
+        self.removed = set()
+
+    def fileOf(self, entry):
+
+        # Index of the file holding a given chain entry
+
+        return int(np.searchsorted(self.offsets, entry, side='right')) - 1
+
+    def limit(self, maxEvent):
+
+        # Only files up to the one holding entry maxEvent - 1 will be needed
+
+        self.stop = self.fileOf(maxEvent - 1) + 1
+
+    def copy(self, k):
+
+        # Runs in a background thread
+
+        try:
+            copyFile(self.files[k], self.tmpfiles[k])
+        except Exception as e:
+            with self.lock:
+                self.errors[k] = e
+
+    def fetch(self, k):
+
+        # Start copying file k in the background if it isn't already
+
+        import threading
+
+        if k >= self.stop or k in self.threads:
+            return
+
+        self.threads[k] = threading.Thread(target=self.copy, args=(k,))
+        self.threads[k].daemon = True
+        self.threads[k].start()
+
+    def require(self, start, stop):
+
+        # Make sure the files holding entries [start, stop) are in tmp_dir, start
+        # fetching the next one and remove the ones before
+        # Returns the first entry past the staged files
+
+        first, last = self.fileOf(start), self.fileOf(stop - 1)
+
+        # Entries have to be read in order (readers never go back before start)
+        removed = [self.files[k] for k in range(first, last + 1) if k in self.removed]
+        if removed:
+            sys.exit('Prefetched {} was already removed (entries read out of order)'.format(
+                                                                    ', '.join(removed)))
+
+        for k in range(first, last + 1):
+            self.fetch(k)
+        for k in range(first, last + 1):
+            self.threads[k].join()
+            if k in self.errors:
+                raise self.errors[k]
+
+        self.fetch(last + 1)
+
+        for k in list(self.threads):
+            if k < first and not k in self.removed:
+                self.threads[k].join()
+                if os.path.exists(self.tmpfiles[k]):
+                    os.remove(self.tmpfiles[k])
+                self.removed.add(k)
+
+        return int(self.offsets[last + 1])
+
+    def finish(self):
+
+        # Wait for outstanding copies and clear up everything fetched
+
+        for k in self.threads:
+            self.threads[k].join()
+            if not k in self.removed and os.path.exists(self.tmpfiles[k]):
+                os.remove(self.tmpfiles[k])
+            self.removed.add(k)
+
+class FeatureLayout:
+
+    # Fixed slot for every branch in one contiguous float buffer, so feature code can
+    # write feats[slot] and TreeMaker can fill branches without looping over names
+
+    def __init__(self, branches_info):
+
+        self.names = list(branches_info)
+        self.slots = {name: k for k, name in enumerate(self.names)}
+        self.defaults = np.array([float(branches_info[name]['default'])\
+                                  for name in self.names])
+        self.int_slots = np.array([k for k, name in enumerate(self.names)\
+                                   if isInt(branches_info[name]['rtype'])], dtype=int)
+
+    def slot(self, names):
+
+        # Slots of a list of branches (to write many features at once)
+
+        return np.array([self.slots[name] for name in names], dtype=int)
+
 class TreeMaker:
 
     # To write a tree in an analysis process
 
-    def __init__(self, outfile, tree_name, branches_info = {}, outdir=''):
+    def __init__(self, outfile, tree_name, branches_info = {}, outdir='', bufferSize=0,\
+                                                                            store=None):
 
         self.outfile = outfile
         self.tree_name = tree_name
@@ -176,6 +474,34 @@ class TreeMaker:
         self.branches = {}
         self.outdir = outdir
 
+        # Float branches are bound straight to slots of the feature buffer and
+        # int branches to a buffer that's copied from it at fill time
+        self.layout = FeatureLayout(branches_info)
+        self.feats = self.layout.defaults.copy()
+        self.ints = np.zeros(len(self.layout.int_slots), dtype=np.int32)
+        self.dtypes = {name: np.int32 if isInt(branches_info[name]['rtype']) else np.float64\
+                       for name in self.layout.names}
+
+        # A columnar copy of the tree in a feature store of format store (see
+        # featureStore) is written from the same blocks, so it turns buffering on
+        self.store = None
+        if store != None:
+            from mods import featureStore
+            if bufferSize == 0: bufferSize = storeBufferSize
+            self.store = featureStore.StoreWriter(featureStore.storeName(outfile, store),
+                                                  self.dtypes, store)
+
+        # With bufferSize > 0, events are collected as rows of a preallocated block
+        # and written bufferSize at a time in one bulk write per part (see flush)
+        # No tree is filled event by event; wq merges the parts into the output
+        self.bufferSize = bufferSize
+        self.nRows = 0
+        self.parts = []
+        if bufferSize > 0:
+            self.rows = np.empty((bufferSize, len(self.layout.names)))
+            self.tfout = self.tree = None
+            return
+
         # Create output file and tree
         self.tfout = r.TFile(self.outfile,"RECREATE")
         self.tree = r.TTree(tree_name, tree_name)
@@ -190,9 +516,17 @@ class TreeMaker:
     def addBranch(self, rtype, default_value, branch_name):
 
         # Add a new branch to write to
+        # (branches added after construction get their own 1 element arrays)
 
         self.branches_info[branch_name] = {'rtype': rtype, 'default': default_value}
-        self.branches[branch_name] = np.zeros(1, dtype=rtype)
+        if branch_name in self.layout.slots and isInt(rtype):
+            k = list(self.layout.int_slots).index(self.layout.slots[branch_name])
+            self.branches[branch_name] = self.ints[k:k + 1]
+        elif branch_name in self.layout.slots:
+            k = self.layout.slots[branch_name]
+            self.branches[branch_name] = self.feats[k:k + 1]
+        else:
+            self.branches[branch_name] = np.zeros(1, dtype=rtype)
         if str(rtype) == "<type 'float'>" or str(rtype) == "<class 'float'>":
             self.tree.Branch(branch_name, self.branches[branch_name], branch_name + "/D")
         elif str(rtype) == "<type 'int'>" or str(rtype) == "<class 'int'>":
@@ -210,16 +544,117 @@ class TreeMaker:
 
         return feats
 
+    def resetBuffer(self):
+
+        # Reset the feature buffer to defaults for a new event and return it
+        # Write to it by slot: feats[self.layout.slots['feat']]
+
+        self.feats[:] = self.layout.defaults
+
+        return self.feats
+
     def fillEvent(self, feats):
 
         # Fill the tree with new feature values
-
-        for feat in feats:
-            self.branches[feat][0] = feats[feat]
+        # feats is either a dict from resetFeats or a buffer laid out like self.feats
+
+        if self.bufferSize > 0:
+            if isinstance(feats, dict):
+                feats = [feats[name] for name in self.layout.names]
+            self.rows[self.nRows] = feats
+            self.nRows += 1
+            if self.nRows == self.bufferSize:
+                self.flush()
+            return
+
+        if isinstance(feats, dict):
+            for feat in feats:
+                self.branches[feat][0] = feats[feat]
+        else:
+            if feats is not self.feats:
+                self.feats[:] = feats
+            self.ints[:] = self.feats[self.layout.int_slots]
         self.tree.Fill()
 
+    def fillRows(self, rows):
+
+        # Fill the tree with many events at once (rows laid out like self.feats)
+
+        if self.bufferSize == 0:
+            for row in rows:
+                self.fillEvent(row)
+            return
+
+        start = 0
+        while start < len(rows):
+            n = min(len(rows) - start, self.bufferSize - self.nRows)
+            self.rows[self.nRows:self.nRows + n] = rows[start:start + n]
+            self.nRows += n
+            start += n
+            if self.nRows == self.bufferSize:
+                self.flush()
+
+    def flush(self):
+
+        # Write the buffered rows to a new part file in one go, through an RDataFrame
+        # made from numpy columns (same branch names, order and types as filled trees)
+
+        if self.nRows == 0: return
+
+        columns = {}
+        for k, name in enumerate(self.layout.names):
+            columns[name] = np.ascontiguousarray(self.rows[:self.nRows, k],
+                                                 dtype=self.dtypes[name])
+
+        # RDF.FromNumpy was called MakeNumpyDataFrame before ROOT 6.28
+        fromNumpy = getattr(r.RDF, 'FromNumpy', None) or r.RDF.MakeNumpyDataFrame
+        part = '{}_part{}.root'.format(os.path.splitext(self.outfile)[0], len(self.parts))
+        fromNumpy(columns).Snapshot(self.tree_name, part, self.layout.names)
+        if self.store != None:
+            self.store.write(columns)
+
+        self.parts.append(part)
+        self.nRows = 0
+
+    def wqBuffered(self):
+
+        # Write what's left and put the parts together straight into outdir
+
+        import shutil
+
+        self.flush()
+
+        if self.outdir != '' and not os.path.exists(self.outdir):
+            print( 'Creating %s' % (self.outdir) )
+            os.makedirs(self.outdir)
+        outpath = os.path.join(self.outdir, self.outfile)
+
+        if self.store != None:
+            self.store.close(self.outdir)
+
+        if len(self.parts) == 1:
+            shutil.move(self.parts[0], outpath)
+        elif len(self.parts) > 1:
+            print( 'Merging %s parts into %s' % (len(self.parts), outpath) )
+            mergeTrees(self.parts, outpath, self.tree_name)
+            for part in self.parts:
+                os.remove(part)
+        else:
+            # No events: write the empty tree the usual way
+            self.tfout = r.TFile(outpath, "RECREATE")
+            self.tree = r.TTree(self.tree_name, self.tree_name)
+            for branch_name in self.layout.names:
+                self.addBranch(self.branches_info[branch_name]['rtype'],\
+                               self.branches_info[branch_name]['default'],\
+                               branch_name)
+            self.tfout.Write(self.tree_name)
+            self.tfout.Close()
+
     def wq(self):
 
+        if self.bufferSize > 0:
+            return self.wqBuffered()
+
         # Save the tree and close the file
         self.tfout.Write(self.tree_name)
         self.tfout.Close()
@@ -255,6 +690,7 @@ def parse(nolist = False):
 
     import glob
     import argparse
+    from mods import jit, featureStore, featureCache
 
     # Arguments
     parser = argparse.ArgumentParser()
@@ -278,6 +714,47 @@ def parse(nolist = False):
             default=0, help='event to start at')
     parser.add_argument('-m','--max', type=int, action='store', dest='maxEvents',
             default=-1, help='max events to run over for EACH group')
+    parser.add_argument('-j','--jobs', type=int, action='store', dest='jobs',
+            default=1, help='number of worker processes to run groups in [Default: 1]')
+    parser.add_argument('--shards', type=int, action='store', dest='shards',
+            default=1, help='split EACH group into this many event ranges [Default: 1]')
+    parser.add_argument('--stage', action='store', dest='stage', default='local',
+            choices=staging_modes,
+            help='read input files in place, symlink or copy them into scratch '\
+                    '(all up front, or one ahead of processing with prefetch) '\
+                    '[Default: local]')
+    parser.add_argument('--copiers', type=int, action='store', dest='copiers', default=4,
+            help='parallel copies when staging with copy [Default: 4]')
+    parser.add_argument('--cache', type=float, action='store', dest='cache', default=0,
+            help='memory budget (MB) for EACH job\'s TTreeCache [Default: ROOT\'s]')
+    parser.add_argument('--allbranches', action='store_false', dest='prune', default=True,
+            help='read every input branch, not just the ones used (for I/O comparisons)')
+    parser.add_argument('--features', action='store', dest='features', default=None,
+            help='only compute and write the features of this list in feature_lists.txt '\
+                    '[Default: all]')
+    parser.add_argument('--chunk', type=int, action='store', dest='chunkSize', default=0,
+            help='process this many events at a time on numpy columns, if the script '\
+                    'supports it (0 for one event at a time) [Default: 0]')
+    parser.add_argument('--buffer', type=int, action='store', dest='bufferSize', default=0,
+            help='write output trees this many events at a time in bulk instead of '\
+                    'filling them event by event (0 to fill) [Default: 0]')
+    parser.add_argument('--store', action='store', dest='store', default=None,
+            choices=featureStore.formats,
+            help='also write the output trees as columnar feature stores in this format '\
+                    '(turns on --buffer) [Default: none]')
+    parser.add_argument('--feature_cache', action='store', dest='featureCache', default=None,
+            help='directory of the feature matrix cache, if the script uses one '\
+                    '(see featureCache) [Default: no cache]')
+    parser.add_argument('--feature_cache_size', type=float, action='store',
+            dest='featureCacheSize', default=featureCache.default_size,
+            help='size cap (GB) of the feature matrix cache [Default: %(default)s]')
+    parser.add_argument('--model', action='store', dest='model', default=None,
+            help='trained BDT to evaluate (.ubj/.json xgboost model, flattened .npz or '\
+                    'pickle), if the script uses one [Default: the script\'s]')
+    parser.add_argument('--backend', action='store', dest='backend', default='numpy',
+            choices=jit.backends,
+            help='run the per-hit loops with numpy or compile them with numba '\
+                    '(if installed) [Default: numpy]')
     args = parser.parse_args()
 
     # Input
@@ -307,22 +784,393 @@ def parse(nolist = False):
             'groupls': args.group_labels,
             'outlist': outlist,
             'startEvent': args.startEvent,
-            'maxEvents': args.maxEvents
+            'maxEvents': args.maxEvents,
+            'jobs': args.jobs,
+            'shards': args.shards,
+            'stage': args.stage,
+            'copiers': args.copiers,
+            'cacheSize': int(args.cache*1024*1024),
+            'prune': args.prune,
+            'chunkSize': args.chunkSize,
+            'features': args.features,
+            'bufferSize': args.bufferSize,
+            'store': args.store,
+            'featureCache': args.featureCache,
+            'featureCacheSize': args.featureCacheSize,
+            'model': os.path.abspath(args.model) if args.model != None else None,
+            'backend': args.backend
             }
 
     return pdict
 
+# Copy a file and make sure all of it arrived
+def copyFile(src, dest):
+
+    import shutil
+
+    shutil.copyfile(src, dest)
+    if os.path.getsize(dest) != os.path.getsize(src):
+        raise IOError('Size mismatch copying {} to {}'.format(src, dest))
+
+    return dest
+
+# Get a group of input files ready to be loaded from tmp_dir
+#   local: read them where they are (nothing is moved)
+#   link:  symlink them into tmp_dir
+#   copy:  copy them into tmp_dir, at most copiers at a time
+# Returns the paths to load (relative paths in group are taken relative to cwd)
+def stageFiles(group, tmp_dir, stage='local', copiers=4, cwd=None):
+
+    if cwd == None: cwd = os.getcwd()
+    paths = [f if '://' in f else os.path.join(cwd, f) for f in group]
+
+    if stage == 'local':
+        return paths
+
+    tmpfiles = [os.path.join(tmp_dir, os.path.basename(f)) for f in paths]
+
+    if stage == 'link':
+        for path, tmpfile in zip(paths, tmpfiles):
+            os.symlink(path, tmpfile)
+
+    elif stage == 'copy':
+        from concurrent.futures import ThreadPoolExecutor
+
+        print( 'Copying {} input files into tmp directory'.format(len(paths)) )
+        with ThreadPoolExecutor(max_workers=max(1, copiers)) as pool:
+            list(pool.map(copyFile, paths, tmpfiles)) # Raises if any copy failed
+
+    else:
+        sys.exit('Unknown staging mode {}'.format(stage))
+
+    return tmpfiles
+
+# Check if a branches_info rtype is an int
+def isInt(rtype):
+    return str(rtype) == "<type 'int'>" or str(rtype) == "<class 'int'>"
+
 # Load a tree from a group of input files
-def load(group,treeName='LDMX_Events'):
+def load(group,treeName='LDMX_Events',entries=None):
 
     # Load a group of files into a readable tree
+    # Giving the entries per file means the files aren't opened until they're read
 
     tree = r.TChain(treeName)
-    for f in group:
-        tree.Add(f)
+    if entries == None:
+        for f in group:
+            tree.Add(f)
+    else:
+        for f, n in zip(group, entries):
+            tree.Add(f, int(n))
 
     return tree
 
+# float32 (events, len(names)) matrix of the branches names of the first maxEvents
+# events (all with -1) in the treeName trees of files
+def readFeatures(files, names, maxEvents=-1, treeName='EcalVeto', chunkSize=100000):
+
+    tree = load(files, treeName)
+    nEvents = tree.GetEntries()
+    if maxEvents != -1: nEvents = min(nEvents, maxEvents)
+
+    matrix = np.empty((nEvents, len(names)), dtype=np.float32)
+    for chunk in featureChunks(tree, names, nEvents, chunkSize, matrix): pass
+
+    return matrix
+
+# The same matrix for the first nEvents events of tree, chunkSize events at a time
+# Read by a compiled TTreeReader loop (see featureReader), so only the named
+# branches of each chunk's own entries are read, straight into float32 rows
+# With out given, every chunk is written into (and is a view of) its rows of out
+def featureChunks(tree, names, nEvents, chunkSize=100000, out=None):
+
+    if nEvents == 0: return
+
+    reader = featureReader(tree, names)
+    for start in range(0, nEvents, chunkSize):
+        stop = min(start + chunkSize, nEvents)
+        print('Reading features of events {} - {}'.format(start, stop - 1))
+        if out is not None:
+            chunk = out[start:stop]
+        else:
+            chunk = np.empty((stop - start, len(names)), dtype=np.float32)
+        reader.read(tree, start, stop, chunk.reshape(-1))
+        yield chunk
+
+# C++ reader classes declared in this process: {code: class name}
+declared_readers = {}
+
+# An instance of a C++ class with the vectors in members and a
+#   read(TTree* tree, Long64_t start, Long64_t stop<args>)
+# method that sets up the TTreeReaderValues in values, clears the vectors and runs
+# body for every entry in [start, stop)
+# Entries are loaded one by one with SetEntry, so nothing before start is touched
+# (prefetched files before it may already be gone) and a chunk costs no new JIT-ing
+def cppReader(members, values, body, args=''):
+
+    code = '\n'.join(
+        ['struct {name} {',
+         '    ' + '\n    '.join(members),
+         '    void read(TTree* tree, Long64_t start, Long64_t stop' + args + ') {',
+         '        TTreeReader reader(tree);',
+         '        ' + '\n        '.join(values)]\
+        + ['        {}.clear();'.format(member.split()[-1].rstrip(';'))\
+           for member in members]\
+        + ['        for (Long64_t i = start; i < stop; ++i) {',
+           '            if (reader.SetEntry(i) != TTreeReader::kEntryValid)',
+           '                throw std::runtime_error("Could not read entry "'\
+                                                    ' + std::to_string(i));',
+           '            ' + '\n            '.join(body),
+           '        }',
+           '    }',
+           '};'])
+
+    if not code in declared_readers:
+        import hashlib
+        name = 'ldmxReader_' + hashlib.sha1(code.encode()).hexdigest()[:12]
+        header = '#include <string>\n#include <vector>\n#include <stdexcept>\n'\
+                 '#include "TTree.h"\n#include "TTreeReader.h"\n'\
+                 '#include "TTreeReaderValue.h"\n'
+        if not r.gInterpreter.Declare(header + code.replace('{name}', name, 1)):
+            sys.exit('Could not compile reader:\n{}'.format(code))
+        declared_readers[code] = name
+
+    return getattr(r, declared_readers[code])()
+
+# Reader for the columns of TreeProcess.addColumns
+# Column k of the j-th branch is filled into c<j>_<k>, flattened over events for
+# collections, whose sizes go in n<j>
+def columnReader(columns):
+
+    members, values, body = [], [], []
+    for j, branch_name in enumerate(columns):
+        ldmx_class = columns[branch_name]['ldmx_class']
+        accessors = [column_accessors[ldmx_class][name]\
+                     for name in columns[branch_name]['names']]
+        ctypes = ['long' if ctype == 'int' else 'double' for getter, ctype in accessors]
+        members += ['std::vector<{}> c{}_{};'.format(ctype, j, k)\
+                    for k, ctype in enumerate(ctypes)]
+
+        if ldmx_class in scalar_classes:
+            values.append('TTreeReaderValue<ldmx::{}> b{}(reader, "{}");'.format(
+                                                            ldmx_class, j, branch_name))
+            body += ['c{0}_{1}.push_back(b{0}->{2});'.format(j, k, getter)\
+                     for k, (getter, ctype) in enumerate(accessors)]
+        else:
+            members.append('std::vector<long> n{};'.format(j))
+            values.append('TTreeReaderValue<std::vector<ldmx::{}>> b{}(reader, "{}");'\
+                          .format(ldmx_class, j, branch_name))
+            body += ['n{0}.push_back(b{0}->size());'.format(j),
+                     'for (auto& hit : *b{}) {{'.format(j)]\
+                  + ['    c{}_{}.push_back(hit.{});'.format(j, k, getter)\
+                     for k, (getter, ctype) in enumerate(accessors)]\
+                  + ['}']
+
+    return cppReader(members, values, body)
+
+# Reader writing the branches names of entries [start, stop) of tree into the rows
+# of a C-contiguous float32 (stop - start, len(names)) array
+def featureReader(tree, names):
+
+    values, body = [], []
+    for k, name in enumerate(names):
+        leaf = tree.GetLeaf(name)
+        if not leaf:
+            sys.exit('{} has no branch {}'.format(tree.GetName(), name))
+        values.append('TTreeReaderValue<{}> v{}(reader, "{}");'.format(
+                                                        leaf.GetTypeName(), k, name))
+        body.append('out[(i - start)*{} + {}] = *v{};'.format(len(names), k, k))
+
+    return cppReader([], values, body, args=', float* out')
+
+# Copy of a std::vector filled by a reader as a numpy array
+def vectorArray(vec, dtype):
+
+    if vec.size() == 0:
+        return np.zeros(0, dtype=dtype)
+
+    return np.array(vec, dtype=dtype)
+
+# Number of entries in the tree of each file (only reads the file headers)
+def fileEntries(group, treeName='LDMX_Events'):
+
+    entries = []
+    for f in group:
+        tfile = r.TFile.Open(f)
+        tree = tfile.Get(treeName) if tfile else None
+        entries.append(tree.GetEntries() if tree else 0)
+        if tfile: tfile.Close()
+
+    return entries
+
+# Run one pool job, turning failures into an exit status instead of raising
+def poolJob(job):
+
+    import traceback
+
+    target, args = job
+    try:
+        return 0, target(*args)
+    except SystemExit as e:
+        print(e)
+        return (e.code if isinstance(e.code, int) and e.code != 0 else 1), 0
+    except Exception:
+        traceback.print_exc()
+        return 1, 0
+
+# Run a pool job in its own process, sending its (exit status, result) back
+def poolChild(job, conn):
+    conn.send(poolJob(job))
+    conn.close()
+
+# Run target(*args) for every args in arglist in nJobs worker processes
+# target should return its number of processed events
+# Returns [(exit status, event count)] in the same order as arglist
+def poolRun(target, arglist, nJobs):
+
+    import multiprocessing
+    from multiprocessing.connection import wait
+
+    # Fresh interpreters (not forks) so no ROOT state is shared between workers
+    # and one process per job so every job gets its own scratch directory
+    # A job whose process dies without sending a result (segfault, OOM kill, ...)
+    # gets the process exit code as its status (negative for a signal)
+    ctx = multiprocessing.get_context('spawn')
+    results = [None]*len(arglist)
+    todo = list(range(len(arglist)))
+    running = {} # {process sentinel: (job index, process, result pipe)}
+
+    while todo or running:
+
+        while todo and len(running) < nJobs:
+            k = todo.pop(0)
+            recv, send = ctx.Pipe(duplex=False)
+            proc = ctx.Process(target=poolChild, args=((target, arglist[k]), send))
+            proc.start()
+            send.close()
+            running[proc.sentinel] = (k, proc, recv)
+
+        # Take results as they come (so a big one can't block its sender) and
+        # finish jobs whose process has ended
+        pipes = {running[sentinel][2]: sentinel for sentinel in running\
+                 if results[running[sentinel][0]] is None}
+        for ready in wait(list(running) + list(pipes)):
+            if ready in pipes:
+                k = running[pipes[ready]][0]
+                try:
+                    results[k] = ready.recv()
+                except EOFError:
+                    pass # Died before sending; dealt with once it's joined
+                continue
+
+            k, proc, recv = running.pop(ready)
+            proc.join()
+            if results[k] is None and recv.poll():
+                try:
+                    results[k] = recv.recv()
+                except EOFError:
+                    pass
+            recv.close()
+            if results[k] is None:
+                print('Job {} died with exit code {}'.format(k, proc.exitcode))
+                results[k] = (proc.exitcode if proc.exitcode else 1), 0
+
+    return results
+
+# Split a group into nShards contiguous entry ranges of (about) equal size
+# Returns [(files, strEvent, maxEvents)] with strEvent relative to the first of files,
+# so that each shard only has to load the files its range overlaps
+def shardGroup(group, nShards, treeName='LDMX_Events', strEvent=0, maxEvents=-1):
+
+    entries = fileEntries(group, treeName)
+    offsets = np.concatenate(([0], np.cumsum(entries)))
+
+    total = offsets[-1]
+    if maxEvents == -1 or strEvent + maxEvents > total:
+        maxEvents = total - strEvent
+    bounds = strEvent + (maxEvents*np.arange(nShards + 1))//nShards
+
+    shards = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        if stop <= start: continue
+        overlap = [k for k in range(len(group))\
+                   if offsets[k] < stop and offsets[k + 1] > start]
+        shards.append( ([group[k] for k in overlap],
+                        int(start - offsets[overlap[0]]), int(stop - start)) )
+
+    return shards
+
+# Merge trees from infiles (in the given order) into one tree in outfile
+def mergeTrees(infiles, outfile, treeName):
+    chain = load(infiles, treeName)
+    chain.Merge(outfile, 'fast')
+
+# Run runGroup(label, files, outdir, pdict) for every group, sharding groups over
+# pdict['shards'] event ranges and running pdict['jobs'] at a time
+# Shard outputs (label + suffix for each suffix) are merged back in event order,
+# along with their feature stores if they were written in format storeFormat
+# Returns the labels of failed groups
+def runJobs(runGroup, pdict, suffixes, treeName='LDMX_Events', outTreeName='EcalVeto',\
+                                                                    storeFormat=None):
+
+    jobs = []
+    shards = {}
+    for gl, group, outdir in zip(pdict['groupls'], pdict['inlist'], pdict['outlist']):
+        if pdict['shards'] > 1:
+            shards[gl] = []
+            for k, (files, strEvent, maxEvents) in enumerate(shardGroup(group,
+                                pdict['shards'], treeName,
+                                pdict['startEvent'], pdict['maxEvents'])):
+                sl = '{}_shard{}'.format(gl, k)
+                spdict = dict(pdict, startEvent=strEvent, maxEvents=maxEvents)
+                jobs.append( (sl, (sl, files, outdir, spdict)) )
+                shards[gl].append(sl)
+        else:
+            jobs.append( (gl, (gl, group, outdir, pdict)) )
+
+    # Process jobs
+    if pdict['jobs'] > 1:
+        results = poolRun(runGroup, [args for label, args in jobs], pdict['jobs'])
+    else:
+        results = [(0, runGroup(*args)) for label, args in jobs]
+
+    print('\nSummary:')
+    status = {}
+    for (label, args), (code, nEvents) in zip(jobs, results):
+        print('{}: exit status {}, {} events'.format(label, code, nEvents))
+        status[label] = code
+
+    # Merge shards back together in order
+    failed = []
+    for gl, outdir in zip(pdict['groupls'], pdict['outlist']):
+        if not gl in shards:
+            if status[gl] != 0: failed.append(gl)
+            continue
+
+        if any(status[sl] != 0 for sl in shards[gl]):
+            print('Not merging shards of {}'.format(gl))
+            failed.append(gl)
+            continue
+
+        for suffix in suffixes:
+            parts = [os.path.join(outdir, sl + suffix) for sl in shards[gl]]
+            print('Merging {} shards into {}'.format(len(parts), gl + suffix))
+            mergeTrees(parts, os.path.join(outdir, gl + suffix), outTreeName)
+            for part in parts:
+                os.remove(part)
+
+            if storeFormat != None:
+                import shutil
+                from mods import featureStore
+                parts = [featureStore.storeName(part, storeFormat) for part in parts]
+                featureStore.mergeStores(parts,
+                        featureStore.storeName(os.path.join(outdir, gl + suffix), storeFormat))
+                for part in parts:
+                    if os.path.isdir(part): shutil.rmtree(part)
+                    else: os.remove(part)
+
+    return failed
+
 # Remove scratch dir
 def rmScratch():
     if os.path.exists('./scratch'):
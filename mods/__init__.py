@@ -1,4 +1,11 @@
 __all__ = ['ROOTmanager',
            'physTools',
-           'mipTracking'
+           'mipTracking',
+           'containment',
+           'jit',
+           'features',
+           'featureStore',
+           'featureCache',
+           'flatTrees',
+           'models'
            ]
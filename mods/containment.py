@@ -0,0 +1,270 @@
+import numpy as np
+from mods import physTools, jit
+
+
+# Longitudinal segment and region of containment (RoC) sums of ECal hits
+#
+# Each hit goes into the bin of its segment and, within that segment, the bins of the
+# electron and photon RoC regions it's in and of every outside RoC region it's beyond
+# Bins are ordered segments first, then the eCont, gCont and oCont blocks, each indexed
+# by (segment - 1)*nRegions + (region - 1)
+
+families = ['seg', 'eCont', 'gCont', 'oCont']
+quantities = ['Energy', 'NHits', 'XMean', 'YMean', 'LayerMean', 'XStd', 'YStd', 'LayerStd']
+nBins = physTools.nSegments*(1 + 3*physTools.nRegions)
+
+# Sums of each RoC region over all segments (the EcalVetoResult-style containment
+# variables, e.g. electronContainmentEnergy_x1): {family: (name prefix, quantities)}
+total_quantities = {'eCont': ('electronContainment', ['Energy']),
+                    'gCont': ('photonContainment',   ['Energy']),
+                    'oCont': ('outsideContainment',  ['Energy', 'NHits', 'XStd', 'YStd'])}
+
+##########################
+# Branch names of each bin
+##########################
+def featureNames(quantity, families=families):
+
+    names = []
+    if 'seg' in families:
+        names += ['{}{}_s{}'.format(quantity[0].lower(), quantity[1:], i)\
+                  for i in range(1, physTools.nSegments + 1)]
+
+    for family in [family for family in ['eCont', 'gCont', 'oCont'] if family in families]:
+        for i in range(1, physTools.nSegments + 1):
+            for j in range(1, physTools.nRegions + 1):
+                names.append('{}{}_x{}_s{}'.format(family, quantity, j, i))
+
+    return names
+
+##########################
+# Branch names of the sums over all segments (quantity by quantity, then region)
+##########################
+def totalNames(families=families):
+
+    names = []
+    for family in [family for family in ['eCont', 'gCont', 'oCont'] if family in families]:
+        prefix, quantities = total_quantities[family]
+        names += ['{}{}_x{}'.format(prefix, quantity, j) for quantity in quantities\
+                  for j in range(1, physTools.nRegions + 1)]
+
+    return names
+
+##########################
+# Sums over all segments from the per segment sums
+##########################
+def totals(sums, families=families):
+
+    # sums holds each quantity with bins last (from chunkSums or eventSums)
+    # Returns the totalNames(families) values, also with them last
+    # Stds are of all the region's hits (energy weighted), combined exactly from the
+    # segments' weights, means and stds (segments without positive energy have no
+    # moments, so they are left out as in weightedMoments)
+
+    nS, nR = physTools.nSegments, physTools.nRegions
+    shape = sums['Energy'].shape[:-1] + (nS, nR)
+
+    columns = []
+    for k, family in enumerate(['eCont', 'gCont', 'oCont']):
+        if not family in families: continue
+        block = lambda quantity: sums[quantity][..., nS + k*nS*nR:nS + (k + 1)*nS*nR]\
+                                                                        .reshape(shape)
+        W = np.maximum(block('Energy'), 0.)
+        Wtotal = W.sum(axis=-2)
+        filled = Wtotal > 0
+        for quantity in total_quantities[family][1]:
+            if quantity in ['Energy', 'NHits']:
+                columns.append(block(quantity).sum(axis=-2))
+                continue
+            mean, std = block(quantity[0] + 'Mean'), block(quantity)
+            # Within plus between segment variances (about the total mean, so no
+            # cancellation when the spread is small next to the mean)
+            m1 = np.zeros(Wtotal.shape)
+            var = np.zeros(Wtotal.shape)
+            m1[filled] = (W*mean).sum(axis=-2)[filled]/Wtotal[filled]
+            dev = np.where(W > 0, mean - np.expand_dims(m1, -2), 0.)
+            var[filled] = (W*(std**2 + dev**2)).sum(axis=-2)[filled]/Wtotal[filled]
+            columns.append(np.sqrt(var))
+
+    return np.concatenate(columns, axis=-1)
+
+##########################
+# (hit, bin) pairs for every bin each hit falls in
+##########################
+def hitBins(layer, d_e, d_g, r_e, r_g, families=families):
+
+    # d_e/d_g are distances to the electron/photon trajectories (-1 if missing)
+    # r_e/r_g are the RoC radii in each hit's layer
+    # Only the RoC blocks of the given families are filled (segments always are)
+
+    nS, nR = physTools.nSegments, physTools.nRegions
+
+    # Segment of each hit (segLayers[i - 1] <= layer < segLayers[i])
+    seg = np.searchsorted(physTools.segLayers, layer, side='right') - 1
+    hits = np.flatnonzero((seg >= 0) & (seg < nS))
+    seg = seg[hits]
+    hitList, binList = [hits], [seg]
+
+    d_e, d_g, r_e, r_g = d_e[hits], d_g[hits], r_e[hits], r_g[hits]
+
+    # Electron and photon RoC: one region per hit (if any)
+    for family, offset, d, radius in (('eCont', nS, d_e, r_e),
+                                      ('gCont', nS + nS*nR, d_g, r_g)):
+        if not family in families: continue
+        region = np.full(len(hits), -1)
+        for j in range(1, nR + 1):
+            region[((j - 1)*radius <= d) & (d < j*radius)] = j - 1
+        inRoC = region >= 0
+        hitList.append(hits[inRoC])
+        binList.append(offset + seg[inRoC]*nR + region[inRoC])
+
+    # Outside RoC: every region the hit is beyond for both trajectories
+    for j in range(1, nR + 1 if 'oCont' in families else 1):
+        outside = (d_e > j*r_e) & (d_g > j*r_g)
+        hitList.append(hits[outside])
+        binList.append(nS + 2*nS*nR + seg[outside]*nR + j - 1)
+
+    return np.concatenate(hitList), np.concatenate(binList)
+
+##########################
+# One pass weighted means and standard deviations
+##########################
+def weightedMoments(bins, w, values, minlength):
+
+    # Weighted mean and std per bin of each column of values (nHits x nColumns)
+    # Moments are summed about the first value seen in each bin: the shifted data form
+    # of West's weighted update, stable without a separate pass for the means
+    # Returns total weights, means and stds (0 for empty bins)
+
+    nHits, nCols = values.shape
+
+    W = np.bincount(bins, weights=w, minlength=minlength).astype(float, copy=False)
+
+    # Index of the first hit in each bin (np.unique gives first occurrences)
+    first = np.zeros(minlength, dtype=int)
+    present, firstHit = np.unique(bins, return_index=True)
+    first[present] = firstHit
+    shift = values[first[bins]]
+    d = values - shift
+
+    cols = ((bins*nCols)[:, None] + np.arange(nCols)).ravel()
+    S1 = np.bincount(cols, weights=(w[:, None]*d).ravel(),
+                     minlength=minlength*nCols).reshape(minlength, nCols)
+    S2 = np.bincount(cols, weights=(w[:, None]*d*d).ravel(),
+                     minlength=minlength*nCols).reshape(minlength, nCols)
+
+    filled = W > 0
+    mean = np.zeros((minlength, nCols))
+    std = np.zeros((minlength, nCols))
+    m1 = S1[filled]/W[filled, None]
+    mean[filled] = values[first[filled]] + m1
+    std[filled] = np.sqrt(np.maximum(S2[filled]/W[filled, None] - m1**2, 0.))
+
+    return W, mean, std
+
+##########################
+# Energy weighted sums, means and standard deviations per bin
+##########################
+def binSums(hit_idx, bins, e, x, y, layer, minlength=nBins):
+
+    values = np.column_stack((x[hit_idx], y[hit_idx], layer[hit_idx])).astype(float)
+    W, mean, std = weightedMoments(bins, e[hit_idx], values, minlength)
+
+    sums = {'Energy': W, 'NHits': np.bincount(bins, minlength=minlength)}
+    for k, name in enumerate(['X', 'Y', 'Layer']):
+        sums[name + 'Mean'], sums[name + 'Std'] = mean[:, k], std[:, k]
+
+    return sums
+
+##########################
+# Single loop over hits doing both of the above (compiled with the numba backend)
+##########################
+@jit.kernel
+def accumulate(e, x, y, layer, d_e, d_g, r_e, r_g, base, use, segLayers, nR, minlength):
+
+    # Same binning as hitBins (offset by base[i] for hit i and with the RoC blocks
+    # of the eCont/gCont/oCont families flagged in use), with each hit's
+    # (x, y, layer) folded into its bins' energy weighted means and squared
+    # deviations by West's update as it's seen
+
+    nS = len(segLayers) - 1
+    W = np.zeros(minlength)
+    N = np.zeros(minlength)
+    mean = np.zeros((minlength, 3))
+    M2 = np.zeros((minlength, 3))
+    bins = np.empty(3 + nR, dtype=np.int64)
+    values = np.empty(3)
+
+    for i in range(len(e)):
+
+        seg = -1
+        for s in range(nS):
+            if segLayers[s] <= layer[i] and layer[i] < segLayers[s + 1]:
+                seg = s
+        if seg < 0: continue
+
+        bins[0] = base[i] + seg
+        nHitBins = 1
+        for j in range(nR if use[0] else 0):
+            if j*r_e[i] <= d_e[i] and d_e[i] < (j + 1)*r_e[i]:
+                bins[nHitBins] = base[i] + nS + seg*nR + j
+                nHitBins += 1
+                break
+        for j in range(nR if use[1] else 0):
+            if j*r_g[i] <= d_g[i] and d_g[i] < (j + 1)*r_g[i]:
+                bins[nHitBins] = base[i] + nS + nS*nR + seg*nR + j
+                nHitBins += 1
+                break
+        for j in range(nR if use[2] else 0):
+            if d_e[i] > (j + 1)*r_e[i] and d_g[i] > (j + 1)*r_g[i]:
+                bins[nHitBins] = base[i] + nS + 2*nS*nR + seg*nR + j
+                nHitBins += 1
+
+        values[0], values[1], values[2] = x[i], y[i], layer[i]
+        for b in bins[:nHitBins]:
+            W[b] += e[i]
+            N[b] += 1
+            for k in range(3):
+                delta = values[k] - mean[b, k]
+                mean[b, k] += delta*(e[i]/W[b])
+                M2[b, k] += e[i]*delta*(values[k] - mean[b, k])
+
+    std = np.zeros((minlength, 3))
+    for b in range(minlength):
+        if W[b] > 0:
+            for k in range(3):
+                std[b, k] = np.sqrt(max(M2[b, k]/W[b], 0.))
+
+    return W, N, mean, std
+
+##########################
+# Sums per bin of the hits of many events with the selected backend
+##########################
+def chunkSums(evt, nEvents, e, x, y, layer, d_e, d_g, r_e, r_g, families=families):
+
+    # evt is the event (0 to nEvents - 1) of each hit
+    # Returns each quantity as an nEvents x nBins array (zeros in skipped families)
+
+    if jit.useNumba():
+        use = np.array([family in families for family in ['eCont', 'gCont', 'oCont']])
+        W, N, mean, std = accumulate(e, x, y, layer, d_e, d_g, r_e, r_g, evt*nBins, use,
+                                     np.asarray(physTools.segLayers), physTools.nRegions,
+                                     nEvents*nBins)
+        sums = {'Energy': W, 'NHits': N}
+        for k, name in enumerate(['X', 'Y', 'Layer']):
+            sums[name + 'Mean'], sums[name + 'Std'] = mean[:, k], std[:, k]
+    else:
+        hit_idx, bins = hitBins(layer, d_e, d_g, r_e, r_g, families)
+        sums = binSums(hit_idx, bins + evt[hit_idx]*nBins, e, x, y, layer,
+                       minlength=nEvents*nBins)
+
+    return {quantity: sums[quantity].reshape(nEvents, nBins) for quantity in sums}
+
+##########################
+# Sums per bin of an event's hits with the selected backend
+##########################
+def eventSums(e, x, y, layer, d_e, d_g, e_radii, g_radii, families=families):
+
+    sums = chunkSums(np.zeros(len(e), dtype=np.int64), 1, e, x, y, layer, d_e, d_g,
+                     np.asarray(e_radii)[layer], np.asarray(g_radii)[layer], families)
+
+    return {quantity: sums[quantity][0] for quantity in sums}
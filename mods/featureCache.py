@@ -0,0 +1,149 @@
+import os
+import sys
+import glob
+import json
+import hashlib
+import numpy as np
+
+
+# On-disk cache of feature matrices read from ROOT files
+#
+# The first load of a set of files writes the float32 (events, features) matrix as
+# <key>.npy, with its number of events (and whether that's all of them) and the
+# feature names in <key>.txt; later loads memory-map the .npy
+# The key covers each file's size, mtime and a hash of its contents (sampled, see
+# fileHash) and the feature names, so changed inputs or a different list give a new
+# entry, while loads of different numbers of events (bdtMaker's --max_evt, eval's
+# whole groups or shards) share one: the first events of an entry serve any load
+# asking for no more than it holds, and a load asking for more rebuilds it
+# Entries are evicted least recently used first once the cache is over its size cap
+
+default_dir = 'feature_cache'
+default_size = 20 # GB
+
+# Bytes hashed at the start, middle and end of each file
+hash_block = 1024*1024
+
+##########################
+# Files matched by a file name, pattern (as TChain.Add takes them) or list of them
+##########################
+def expand(files):
+
+    if isinstance(files, str):
+        files = [files]
+
+    expanded = []
+    for pattern in files:
+        matches = sorted(glob.glob(pattern))
+        if matches == []:
+            sys.exit('No files match {}'.format(pattern))
+        expanded += matches
+
+    return expanded
+
+##########################
+# Content hash of a file
+##########################
+def fileHash(path):
+
+    # Hashing all of a multi-GB file would cost about as much as reading it, so only
+    # blocks at the start, middle and end are hashed (with the size and mtime in the
+    # key, any rewrite of the file still changes it)
+
+    size = os.path.getsize(path)
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for start in sorted(set([0, max(size//2 - hash_block//2, 0),
+                                 max(size - hash_block, 0)])):
+            f.seek(start)
+            h.update(f.read(hash_block))
+
+    return h.hexdigest()
+
+def cacheKey(files, names):
+
+    stats = []
+    for path in files:
+        st = os.stat(path)
+        stats.append([st.st_size, st.st_mtime, fileHash(path)])
+
+    return hashlib.sha1(json.dumps([stats, list(names)]).encode()).hexdigest()
+
+##########################
+# Feature matrix of files, from the cache if it's there
+##########################
+def load(files, names, loader, maxEvents=-1, cacheDir=default_dir, maxSize=default_size):
+
+    # float32 (events, len(names)) matrix of names over the events in files
+    # (the first maxEvents of them if maxEvents != -1), memory-mapped read-only
+    # On a miss loader(files, names, maxEvents) builds the matrix, which is then cached
+
+    files = expand(files)
+    path = os.path.join(cacheDir, cacheKey(files, names))
+
+    cached = readEntry(path, names)
+    if cached is not None:
+        matrix, complete = cached
+        if complete or (maxEvents != -1 and len(matrix) >= maxEvents):
+            print('Loading cached features {}'.format(path + '.npy'))
+            os.utime(path + '.npy', None) # Most recently used
+            return matrix if maxEvents == -1 else matrix[:maxEvents]
+
+    matrix = np.asarray(loader(files, names, maxEvents), dtype=np.float32)
+    complete = maxEvents == -1 or len(matrix) < maxEvents
+
+    # Write under temporary names so parallel jobs never see half an entry
+    # (the .npy goes first; readEntry checks both agree on the number of events)
+    if not os.path.exists(cacheDir):
+        os.makedirs(cacheDir, exist_ok=True)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        np.save(f, matrix)
+    os.replace(tmp, path + '.npy')
+    with open(tmp, 'w') as f:
+        f.write('{} {}\n'.format(len(matrix), 'all' if complete else 'first'))
+        f.write('\n'.join(names) + '\n')
+    os.replace(tmp, path + '.txt')
+    print('Cached features in {}'.format(path + '.npy'))
+
+    evict(cacheDir, maxSize, keep=path + '.npy')
+
+    return np.load(path + '.npy', mmap_mode='r')
+
+# (memory-mapped matrix, whether it holds every event) of a cache entry, or None if
+# there's no complete entry for names
+def readEntry(path, names):
+
+    if not (os.path.exists(path + '.npy') and os.path.exists(path + '.txt')):
+        return None
+
+    with open(path + '.txt') as f:
+        header = f.readline().split()
+        if len(header) != 2 or f.read().split() != list(names):
+            return None
+
+    try:
+        matrix = np.load(path + '.npy', mmap_mode='r')
+    except (IOError, ValueError):
+        return None
+    if str(len(matrix)) != header[0]:
+        return None # Caught between another job's two writes
+
+    return matrix, header[1] == 'all'
+
+##########################
+# Remove least recently used entries until the cache fits in maxSize GB
+##########################
+def evict(cacheDir=default_dir, maxSize=default_size, keep=None):
+
+    entries = sorted(glob.glob(os.path.join(cacheDir, '*.npy')), key=os.path.getmtime)
+    total = sum(os.path.getsize(entry) for entry in entries)
+
+    for entry in entries:
+        if total <= maxSize*1024**3: break
+        if entry == keep: continue
+        total -= os.path.getsize(entry)
+        print('Evicting cached features {}'.format(entry))
+        os.remove(entry)
+        if os.path.exists(entry[:-len('.npy')] + '.txt'):
+            os.remove(entry[:-len('.npy')] + '.txt')
@@ -0,0 +1,210 @@
+import os
+import sys
+import shutil
+import numpy as np
+
+# pyarrow is optional: without it only npy stores can be written and read
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
+
+# Columnar feature stores: the branches of an output tree kept column by column
+# (same names, order and types) so training and evaluation can load just the
+# columns they need instead of reading the tree back one attribute at a time
+#   npy:     a directory with <branch>.npy for every branch and columns.txt listing
+#            them in tree order; columns can be memory-mapped
+#   parquet: one parquet file with a row group per block of events (needs pyarrow)
+formats = ['npy', 'parquet']
+suffixes = {'npy': '.features', 'parquet': '.parquet'}
+
+##########################
+# Store name for an output tree file (e.g. x_unsorted.root -> x_unsorted.features)
+##########################
+def storeName(outfile, fmt):
+    return os.path.splitext(outfile)[0] + suffixes[fmt]
+
+def checkFormat(fmt):
+
+    if not fmt in formats:
+        sys.exit('Unknown feature store format {} (choose from {})'.format(fmt,
+                                                                   ', '.join(formats)))
+
+    if fmt == 'parquet' and pyarrow == None:
+        sys.exit('pyarrow is needed for parquet feature stores (or use npy)')
+
+##########################
+# Writer
+##########################
+class StoreWriter:
+
+    # Writes blocks of events ({branch name: column}) as they come
+    # npy columns are appended to raw files in path.tmp and turned into .npy files
+    # by close; parquet blocks become row groups straight away
+
+    def __init__(self, path, dtypes, fmt='npy'):
+
+        checkFormat(fmt)
+
+        self.path = path
+        self.dtypes = dtypes # {branch name: numpy dtype} in tree order
+        self.names = list(dtypes)
+        self.fmt = fmt
+        self.nRows = 0
+
+        if fmt == 'npy':
+            self.tmp = path + '.tmp'
+            if os.path.exists(self.tmp): shutil.rmtree(self.tmp)
+            os.makedirs(self.tmp)
+        else:
+            self.schema = pyarrow.schema([(name, pyarrow.from_numpy_dtype(dtypes[name]))\
+                                          for name in self.names])
+            self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, columns):
+
+        if self.fmt == 'npy':
+            for name in self.names:
+                with open(os.path.join(self.tmp, name), 'ab') as f:
+                    np.asarray(columns[name], dtype=self.dtypes[name]).tofile(f)
+        else:
+            self.writer.write_table(pyarrow.table(
+                        [np.asarray(columns[name], dtype=self.dtypes[name])\
+                         for name in self.names], schema=self.schema))
+
+        self.nRows += len(columns[self.names[0]])
+
+    def close(self, outdir=''):
+
+        # Finish the store and put it in outdir; returns its path
+
+        outpath = os.path.join(outdir, os.path.basename(self.path))
+
+        if self.fmt == 'npy':
+            if os.path.exists(outpath): shutil.rmtree(outpath)
+            os.makedirs(outpath)
+            for name in self.names:
+                raw = os.path.join(self.tmp, name)
+                if os.path.exists(raw):
+                    column = np.fromfile(raw, dtype=self.dtypes[name])
+                else:
+                    column = np.zeros(0, dtype=self.dtypes[name])
+                np.save(os.path.join(outpath, name + '.npy'), column)
+            writeColumns(outpath, self.names)
+            shutil.rmtree(self.tmp)
+        else:
+            self.writer.close()
+            if os.path.abspath(outpath) != os.path.abspath(self.path):
+                shutil.move(self.path, outpath)
+
+        return outpath
+
+def writeColumns(path, names):
+    with open(os.path.join(path, 'columns.txt'), 'w') as f:
+        f.write('\n'.join(names) + '\n')
+
+##########################
+# Readers
+##########################
+
+# Branch names in a store, in tree order
+def storeColumns(path):
+
+    if os.path.isdir(path):
+        with open(os.path.join(path, 'columns.txt')) as f:
+            return f.read().split()
+
+    if pyarrow == None:
+        sys.exit('pyarrow is needed to read {}'.format(path))
+
+    return pq.read_schema(path).names
+
+# {branch name: column} for names (every column by default)
+# npy columns are memory-mapped unless mmap=False
+def readStore(path, names=None, mmap=True):
+
+    available = storeColumns(path)
+    if names == None:
+        names = available
+
+    missing = [name for name in names if not name in available]
+    if missing:
+        sys.exit('{} has no {}'.format(path, ', '.join(missing)))
+
+    if os.path.isdir(path):
+        return {name: np.load(os.path.join(path, name + '.npy'),
+                              mmap_mode='r' if mmap else None) for name in names}
+
+    table = pq.read_table(path, columns=list(names))
+    return {name: table.column(name).to_numpy() for name in names}
+
+# Columns stacked into one (events, len(names)) matrix (at most maxEvents rows)
+def readMatrix(path, names, dtype=np.float32, maxEvents=-1):
+
+    columns = readStore(path, names)
+
+    nEvents = len(columns[names[0]]) if len(names) != 0 else 0
+    if maxEvents != -1:
+        nEvents = min(nEvents, maxEvents)
+
+    matrix = np.empty((nEvents, len(names)), dtype=dtype)
+    for k, name in enumerate(names):
+        matrix[:, k] = columns[name][:nEvents]
+
+    return matrix
+
+# The same matrix chunkSize events at a time
+# npy columns are memory-mapped and parquet files read a batch at a time, so only
+# about a chunk of events is in memory at once
+def storeChunks(path, names, maxEvents=-1, chunkSize=100000, dtype=np.float32):
+
+    if os.path.isdir(path):
+        columns = readStore(path, names)
+        blocks = ([columns[name][start:start + chunkSize] for name in names]\
+                  for start in range(0, len(columns[names[0]]) if names else 0, chunkSize))
+    else:
+        missing = [name for name in names if not name in storeColumns(path)]
+        if missing:
+            sys.exit('{} has no {}'.format(path, ', '.join(missing)))
+        blocks = ([batch.column(batch.schema.get_field_index(name))\
+                        .to_numpy(zero_copy_only=False) for name in names]\
+                  for batch in pq.ParquetFile(path).iter_batches(batch_size=chunkSize,
+                                                                 columns=list(names)))
+
+    nEvents = 0
+    for block in blocks:
+        if maxEvents != -1 and nEvents >= maxEvents: return
+        stop = len(block[0]) if maxEvents == -1 else min(len(block[0]), maxEvents - nEvents)
+        chunk = np.empty((stop, len(names)), dtype=dtype)
+        for k in range(len(names)):
+            chunk[:, k] = block[k][:stop]
+        nEvents += stop
+        yield chunk
+
+def isStore(path):
+    return os.path.isdir(path) or path.endswith(suffixes['parquet'])
+
+##########################
+# Merge stores (in the given order) into one
+##########################
+def mergeStores(paths, outpath):
+
+    names = storeColumns(paths[0])
+
+    if os.path.isdir(paths[0]):
+        if os.path.exists(outpath): shutil.rmtree(outpath)
+        os.makedirs(outpath)
+        for name in names:
+            np.save(os.path.join(outpath, name + '.npy'),
+                    np.concatenate([readStore(path, [name])[name] for path in paths]))
+        writeColumns(outpath, names)
+    else:
+        writer = None
+        for path in paths:
+            table = pq.read_table(path)
+            if writer == None:
+                writer = pq.ParquetWriter(outpath, table.schema)
+            writer.write_table(table)
+        writer.close()
@@ -0,0 +1,106 @@
+import re
+import sys
+
+
+# Feature lists and feature families
+#
+# feature_lists.txt lays the lists out side by side: the header names each list and
+# where its column starts, then each row holds 'name # index' entries (or section
+# comments) for every list in its column
+#
+# A family is a group of features computed together, declared as
+#   {'branches': [...], 'inputs': [...], 'requires': [...], 'cost': c}
+# with the output branches it fills, the input branches it reads, the families that
+# have to be computed before it and a rough relative cost per event
+
+##########################
+# Read every list in a feature list file
+##########################
+def readFeatureLists(path='feature_lists.txt'):
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+
+    # Columns are separated by two or more spaces; a list's name is its first word
+    header = [(m.start(), m.group().split()[0])\
+              for m in re.finditer(r'\S+(?: \S+)*', lines[0])]
+    starts = [start for start, name in header] + [None]
+
+    lists = {name: [] for start, name in header}
+    for line in lines[1:]:
+        for k, (start, name) in enumerate(header):
+            entry = line[start:starts[k + 1]].strip()
+            if entry == '' or entry.startswith('#'): continue
+            lists[name].append(entry.split('#')[0].strip())
+
+    return lists
+
+##########################
+# Families needed for a set of branches (and everything they require)
+##########################
+def resolve(families, branch_names, always=[]):
+
+    owner = {}
+    for family in families:
+        for branch_name in families[family]['branches']:
+            owner[branch_name] = family
+
+    unknown = [branch_name for branch_name in branch_names if not branch_name in owner]
+    if unknown:
+        sys.exit('No feature family computes {}'.format(', '.join(unknown)))
+
+    needed = set()
+    todo = [owner[branch_name] for branch_name in branch_names] + list(always)
+    while todo:
+        family = todo.pop()
+        if family in needed: continue
+        needed.add(family)
+        todo += families[family]['requires']
+
+    return needed
+
+##########################
+# Input branches read and relative cost of a set of families
+##########################
+def inputs(families, needed):
+    return set(branch for family in needed for branch in families[family]['inputs'])
+
+def cost(families, needed):
+    return sum(families[family]['cost'] for family in needed)
+
+##########################
+# One list from a feature list file
+##########################
+def featureList(name, path='feature_lists.txt'):
+
+    lists = readFeatureLists(path)
+    if not name in lists:
+        sys.exit('No feature list {} in {} (lists: {})'.format(name, path,
+                                                                 ', '.join(lists)))
+
+    return lists[name]
+
+##########################
+# Inputs of the BDT (bdtMaker and eval) in the order it takes them
+##########################
+bdt_features = [
+        # Base variables
+        'nReadoutHits', 'summedDet', 'summedTightIso', 'maxCellDep', 'showerRMS',
+        'xStd', 'yStd', 'avgLayerHit', 'stdLayerHit', 'deepestLayerHit', 'ecalBackEnergy',
+        # MIP Tracking variables
+        'straight4', 'firstNearPhLayer', 'nNearPhHits',
+        'fullElectronTerritoryHits', 'fullPhotonTerritoryHits', 'fullTerritoryRatio',
+        'electronTerritoryHits', 'photonTerritoryHits', 'TerritoryRatio'
+        ]
+
+# Longitudinal segment variables
+bdt_features += ['{}_s{}'.format(quantity, s) for s in range(1, 4)\
+                 for quantity in ['energy', 'nHits', 'xMean', 'yMean', 'layerMean',
+                                  'xStd', 'yStd', 'layerStd']]
+
+# Electron, photon and outside RoC variables
+bdt_features += ['{}Cont{}_x{}_s{}'.format(region, quantity, x, s) for region in 'ego'\
+                 for s in range(1, 4)\
+                 for quantity in ['Energy', 'NHits', 'XMean', 'YMean', 'LayerMean',
+                                  'XStd', 'YStd', 'LayerStd']\
+                 for x in range(1, 6)]
@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import numpy as np
+
+
+# Trained BDTs as flat numpy arrays, evaluated without xgboost
+#
+# Every node of every tree goes in one set of arrays:
+#   feature:      index of the feature split on (0 for leaves)
+#   threshold:    split value; events with feature < threshold go left
+#   left, right:  children (global node numbers); leaves point at themselves
+#   default_left: where events with a missing (NaN) feature go
+#   value:        leaf value (0 for splits)
+# roots holds the first node of each tree and depth the deepest tree's depth, so
+# depth steps take every (event, tree) pair from its root to its leaf
+# The score is the sum of the leaves reached plus base_margin, through the sigmoid
+# for logistic objectives, as xgboost's predict gives it
+
+# Objectives handled: {name: sigmoid applied to the margin}
+objectives = {'binary:logistic': True, 'reg:logistic': True,
+              'binary:logitraw': False, 'reg:squarederror': False}
+
+# Events evaluated together (each one holds a node per tree)
+default_chunk = 10000
+
+##########################
+# Model JSON of a booster
+##########################
+def modelJSON(booster):
+
+    try:
+        return json.loads(booster.save_raw('json'))
+    except TypeError: # Older xgboost only dumps JSON to files
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            booster.save_model(os.path.join(tmp_dir, 'model.json'))
+            with open(os.path.join(tmp_dir, 'model.json')) as f:
+                return json.load(f)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+##########################
+# Flatten a booster (or its model JSON) into node arrays
+##########################
+def flatten(model):
+
+    if not isinstance(model, dict):
+        model = modelJSON(model)
+
+    learner = model['learner']
+    objective = learner['objective']['name']
+    if not objective in objectives:
+        sys.exit('Cannot flatten a {} model (handled: {})'.format(objective,
+                                                              ', '.join(objectives)))
+
+    booster = learner['gradient_booster']
+    if booster['name'] != 'gbtree':
+        sys.exit('Cannot flatten a {} booster (only gbtree)'.format(booster['name']))
+    trees = booster['model']['trees']
+    if any(info != 0 for info in booster['model']['tree_info']):
+        sys.exit('Cannot flatten a multi-class model')
+
+    # base_score is kept as a probability for logistic objectives ('[5E-1]' in newer
+    # versions, '5E-1' in older ones)
+    base_score = float(learner['learner_model_param']['base_score'].strip('[]'))
+    if objective in ('binary:logistic', 'reg:logistic'):
+        base_margin = np.log(base_score/(1 - base_score))
+    else:
+        base_margin = base_score
+
+    sizes = [len(tree['left_children']) for tree in trees]
+    roots = np.cumsum([0] + sizes[:-1]).astype(np.int64)
+    nNodes = sum(sizes)
+
+    flat = {'feature':      np.zeros(nNodes, dtype=np.int64),
+            'threshold':    np.zeros(nNodes, dtype=np.float32),
+            'left':         np.zeros(nNodes, dtype=np.int64),
+            'right':        np.zeros(nNodes, dtype=np.int64),
+            'default_left': np.zeros(nNodes, dtype=bool),
+            'value':        np.zeros(nNodes, dtype=np.float32),
+            'roots':        roots}
+
+    depth = 0
+    for root, tree in zip(roots, trees):
+
+        if any(split_type != 0 for split_type in tree.get('split_type', [])):
+            sys.exit('Cannot flatten categorical splits')
+
+        nodes = slice(root, root + len(tree['left_children']))
+        left = np.array(tree['left_children'], dtype=np.int64)
+        right = np.array(tree['right_children'], dtype=np.int64)
+        leaf = left == -1
+        this = np.arange(len(left))
+
+        # Leaves hold their value in split_conditions
+        conditions = np.array(tree['split_conditions'], dtype=np.float32)
+        flat['feature'][nodes] = np.where(leaf, 0, tree['split_indices'])
+        flat['threshold'][nodes] = np.where(leaf, 0, conditions)
+        flat['left'][nodes] = root + np.where(leaf, this, left)
+        flat['right'][nodes] = root + np.where(leaf, this, right)
+        flat['default_left'][nodes] = np.array(tree['default_left'], dtype=bool)
+        flat['value'][nodes] = np.where(leaf, conditions, 0)
+
+        # Depth of each node (children always come after their parents)
+        nodeDepth = np.zeros(len(left), dtype=np.int64)
+        for node in np.flatnonzero(~leaf):
+            nodeDepth[left[node]] = nodeDepth[right[node]] = nodeDepth[node] + 1
+        depth = max(depth, nodeDepth.max())
+
+    flat['depth'] = np.int64(depth)
+    flat['base_margin'] = np.float64(base_margin)
+    flat['sigmoid'] = np.bool_(objectives[objective])
+    flat['num_feature'] = np.int64(learner['learner_model_param']['num_feature'])
+
+    return flat
+
+##########################
+# Scores of events (rows of features, in the order the model was trained on)
+##########################
+def predict(flat, feats, outputMargin=False, chunkSize=default_chunk):
+
+    feats = np.asarray(feats, dtype=np.float32) # The precision xgboost splits in
+    if feats.ndim != 2 or feats.shape[1] != flat['num_feature']:
+        sys.exit('Model takes {} features, got an array of shape {}'.format(
+                                                flat['num_feature'], feats.shape))
+
+    margin = np.empty(len(feats))
+    for start in range(0, len(feats), chunkSize):
+        stop = min(start + chunkSize, len(feats))
+        margin[start:stop] = leafSum(flat, feats[start:stop])
+    margin += flat['base_margin']
+
+    if outputMargin or not flat['sigmoid']:
+        return margin
+
+    return 1/(1 + np.exp(-margin))
+
+def leafSum(flat, feats):
+
+    # Walk every tree one level at a time for all events together
+
+    events = np.arange(len(feats))[:, None]
+    node = np.broadcast_to(flat['roots'], (len(feats), len(flat['roots'])))
+    for level in range(flat['depth']):
+        x = feats[events, flat['feature'][node]]
+        goLeft = np.where(np.isnan(x), flat['default_left'][node], x < flat['threshold'][node])
+        node = np.where(goLeft, flat['left'][node], flat['right'][node])
+
+    return flat['value'][node].sum(axis=1, dtype=np.float64)
+
+##########################
+# Save and load flat models (.npz)
+##########################
+def save(flat, path):
+    with open(path, 'wb') as f:
+        np.savez(f, **flat)
+
+def load(path):
+    with np.load(path) as arrays:
+        return {name: arrays[name] for name in arrays.files}
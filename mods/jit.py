@@ -0,0 +1,55 @@
+import sys
+
+# numba is optional: without it every kernel runs as plain python/numpy
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# Backend used by the kernels in containment and mipTracking
+#   numpy: vectorized numpy where possible, plain python loops otherwise
+#   numba: the same loops compiled with numba (on first call in each process)
+backends = ['numpy', 'numba']
+backend = 'numpy'
+
+##########################
+# Select the backend (needs calling in each worker process)
+##########################
+def setBackend(name):
+
+    global backend
+
+    if name not in backends:
+        sys.exit('Unknown backend {} (choose from {})'.format(name, ', '.join(backends)))
+
+    if name == 'numba' and numba == None:
+        print('numba is not installed; falling back to the numpy backend')
+        name = 'numpy'
+
+    backend = name
+
+def useNumba():
+    return backend == 'numba'
+
+##########################
+# Decorator for loops over flat hit arrays
+##########################
+def kernel(func):
+
+    # Calls func as written with the numpy backend and a numba compiled copy of it
+    # with the numba backend. Kernels must stick to what numba's nopython mode supports
+
+    compiled = []
+
+    def call(*args):
+        if backend != 'numba':
+            return func(*args)
+        if not compiled:
+            compiled.append(numba.njit(cache=True)(func))
+        return compiled[0](*args)
+
+    call.__name__, call.__doc__ = func.__name__, func.__doc__
+    call.py_func = func
+
+    return call
@@ -1,6 +1,6 @@
 import math
 import numpy as np
-from mods import physTools
+from mods import physTools, jit
 
 
 # NOTE: Don't forget to order hits by reverse zpos before using the nXTracks funcs
@@ -206,3 +206,138 @@ def nLinregTracks(trackingHitList, e_traj_ends, g_traj_ends):
     iHit = 0
 
     return 0
+
+##########################
+# Array versions (flat hit arrays; compiled with the numba backend)
+##########################
+
+# nearPhotonInfo on hits given by x, y and layer (ecal_layer)
+def nearPhotonInfoArrays(x, y, layer, g_trajectory, returnLayer=True, returnNumber=True):
+
+    layer, n = nearPhotonHits(x, y, np.asarray(layer, dtype=np.int64),
+                              np.asarray(g_trajectory, dtype=float),
+                              physTools.cellWidth)
+
+    # Prepare and return desired output
+    out = []
+    if returnLayer: out.append(layer)
+    if returnNumber: out.append(n)
+
+    return out
+
+@jit.kernel
+def nearPhotonHits(x, y, layer, g_trajectory, cellWidth):
+
+    first = 33
+    n = 0
+    for i in range(len(x)):
+
+        # Near the photon trajectory
+        dx = x[i] - g_trajectory[layer[i], 0]
+        dy = y[i] - g_trajectory[layer[i], 1]
+        if math.sqrt(dx*dx + dy*dy) < cellWidth:
+            n += 1
+
+            # Earliest layer
+            if layer[i] < first:
+                first = layer[i]
+
+    return first, n
+
+# findStraightTracks on hits given by x, y and z
+# The hit list returned holds the indices of the hits left out of tracks
+def findStraightTracksArrays(x, y, z, etraj_ends, ptraj_ends,\
+                        mst = 2, returnN=True, returnHitList = False):
+
+    traj_ends = np.array([etraj_ends, ptraj_ends], dtype=float)
+    zlayer = physTools.layersOfHitZ(z)
+    if not jit.useNumba(): # Interpreted loops index python lists much faster than arrays
+        x, y, z, zlayer = x.tolist(), y.tolist(), z.tolist(), zlayer.tolist()
+    n, hitlist = straightTracks(x, y, z, zlayer, traj_ends, mst, physTools.cellWidth)
+
+    # Prepare and return desired output
+    out = []
+    if returnN: out.append(n)
+    if returnHitList: out.append(hitlist)
+
+    return out
+
+@jit.kernel
+def straightTracks(x, y, z, zlayer, traj_ends, mst, cellWidth):
+
+    # Follows findStraightTracks step for step so both give the same tracks:
+    # the seed loop walks the hit list as hits get removed from it, and the merge
+    # step compares the ends of the last track built (see there)
+
+    hitlist = np.arange(len(x))  # Hits not in a track are hitlist[:nLeft]
+    nLeft = len(x)
+    track = np.empty(len(x), dtype=np.int64)
+    trackLen = 0
+    nTracks = 0
+    closest = np.empty(2)
+
+    p = 0
+    while p < nLeft:  # Go through all hits, starting at the back of the ecal
+        hit = hitlist[p]
+        p += 1
+        track[0] = hit
+        trackLen = 1
+        current = hit  # "Trailing" hit in track being constructed
+        possibleNeigh = False
+        for q in range(nLeft):
+            h = hitlist[q]
+            if z[h] == z[current]:
+                possibleNeigh = True  # Optimization
+                continue
+            if not possibleNeigh: continue
+            if z[current] - z[h] > 25:  # Optimization
+                possibleNeigh = False
+                continue
+            if (zlayer[h] == zlayer[current] - 1 or zlayer[h] == zlayer[current] - 2) and\
+                    x[h] == x[current] and y[h] == y[current]:
+                track[trackLen] = h
+                trackLen += 1
+                current = h
+
+        # Too short
+        if trackLen < mst: continue
+
+        # Check that the track approaches the photon's and not the electron's
+        s, e = track[0], track[trackLen - 1]
+        trk = np.array([x[s] - x[e], y[s] - y[e], z[s] - z[e]])
+        e2 = trk/math.sqrt(np.sum(trk*trk))
+        for t in range(2):
+            line = traj_ends[t, 0] - traj_ends[t, 1]
+            e1 = line/math.sqrt(np.sum(line*line))
+            sep = traj_ends[t, 0] - np.array([x[s], y[s], z[s]])
+            crs = np.array([e1[1]*e2[2] - e1[2]*e2[1],
+                            e1[2]*e2[0] - e1[0]*e2[2],
+                            e1[0]*e2[1] - e1[1]*e2[0]])
+            if math.sqrt(np.sum(crs*crs)) != 0:
+                closest[t] = abs(np.sum(crs*sep))
+            else:  # Lines are parallel
+                crs = np.array([e1[1]*sep[2] - e1[2]*sep[1],
+                                e1[2]*sep[0] - e1[0]*sep[2],
+                                e1[0]*sep[1] - e1[1]*sep[0]])
+                closest[t] = math.sqrt(np.sum(crs*crs))
+        if closest[1] > cellWidth and closest[0] < 2*cellWidth:
+            continue
+
+        # Remove hits in current track from further consideration
+        for k in range(trackLen):
+            for q in range(nLeft):
+                if hitlist[q] == track[k]:
+                    hitlist[q:nLeft - 1] = hitlist[q + 1:nLeft].copy()
+                    nLeft -= 1
+                    break
+
+        nTracks += 1
+
+    # Combine tracks: every pair merges if the last track built starts and ends
+    # within a cell, none do otherwise
+    if nTracks > 0:
+        s, e = track[0], track[trackLen - 1]
+        if math.sqrt((x[s] - x[e])**2 + (y[s] - y[e])**2 + (z[s] - z[e])**2) < cellWidth:
+            nTracks = 1
+
+    return nTracks, hitlist[:nLeft].copy()
@@ -0,0 +1,68 @@
+import os
+import sys
+import pickle
+from mods import flatTrees
+
+# xgboost is optional: flattened (.npz) models are evaluated with numpy alone
+try:
+    import xgboost as xgb
+except ImportError:
+    xgb = None
+
+
+# Trained BDTs, told apart by file extension
+#   .ubj/.json: xgboost's own model formats (binary UBJSON or JSON), which any later
+#               xgboost version can read
+#   .npz:       the model flattened into numpy arrays (see flatTrees)
+#   .pkl:       a pickled Booster, as bdtMaker has always saved them (only safe to
+#               read with the xgboost version that wrote it)
+formats = ['.ubj', '.json', '.npz', '.pkl']
+
+# Models loaded in this process: {path: (mtime, model)}
+loaded = {}
+
+##########################
+# Load a model (once per process unless the file changes)
+##########################
+def load(path):
+
+    path = os.path.abspath(path)
+    if not os.path.exists(path):
+        sys.exit('No model {}'.format(path))
+
+    ext = os.path.splitext(path)[1]
+    if not ext in formats:
+        sys.exit('Unknown model format {} (choose from {})'.format(ext, ', '.join(formats)))
+
+    mtime = os.path.getmtime(path)
+    if path in loaded and loaded[path][0] == mtime:
+        return loaded[path][1]
+
+    if ext == '.npz':
+        model = flatTrees.load(path)
+    elif xgb == None:
+        sys.exit('xgboost is needed to read {} (or use a flattened .npz model)'.format(path))
+    elif ext == '.pkl':
+        with open(path, 'rb') as f:
+            model = pickle.load(f)
+    else:
+        model = xgb.Booster()
+        model.load_model(path)
+
+    print('Loaded model {}'.format(path))
+    loaded[path] = (mtime, model)
+
+    return model
+
+##########################
+# Scores of a batch of events (rows of features in the order the model takes them)
+##########################
+def predict(model, feats):
+
+    if isinstance(model, dict):
+        return flatTrees.predict(model, feats)
+
+    if hasattr(model, 'inplace_predict'):
+        return model.inplace_predict(feats)
+
+    return model.predict(xgb.DMatrix(feats))
@@ -185,6 +185,99 @@ def angle(vec, units, vec2=[0,0,1]):
 def pos(hit):
     return np.array( ( hit.getXPos(), hit.getYPos(), hit.getZPos() ) )
 
+###########################
+# Array versions (one entry per hit)
+###########################
+
+# Get np.ndarrays of energies, positions and layers of ecal hits (one call per getter)
+def ecalHitArrays(hits):
+    n = len(hits)
+    e, x, y, z = np.empty(n), np.empty(n), np.empty(n), np.empty(n)
+    layer = np.empty(n, dtype=int)
+    for i, hit in enumerate(hits):
+        e[i], x[i], y[i], z[i] = hit.getEnergy(), hit.getXPos(), hit.getYPos(), hit.getZPos()
+        layer[i] = ecal_layer(hit)
+    return e, x, y, z, layer
+
+# Layer index of each hit z (layerofHitZ with index 0)
+def layersOfHitZ(z):
+    rz = np.round(z).astype(int)
+    keys = np.array(ecal_zs_round)
+    idx = np.minimum(np.searchsorted(keys, rz), len(keys) - 1)
+    if np.any(keys[idx] != rz): raise KeyError(rz[keys[idx] != rz][0])
+    return idx
+
+# Distances from hits to a trajectory (from layerIntercepts) in the hits' layers
+# With evt (the event of each hit), traj holds one trajectory per event
+def layerDists(x, y, layer, traj, evt=None):
+    traj = np.asarray(traj)
+    if evt is None: t = traj[layer]
+    else: t = traj[evt, layer]
+    return np.sqrt( (x - t[:, 0])**2 + (y - t[:, 1])**2 )
+
+# layerIntercepts of many (pos, mom) rows at once; returns nRows x nLayers x 2
+def layerInterceptsArray(pos, mom, layerZs=ecal_layerZs):
+    slope = mom[:, :2]/mom[:, 2:3]
+    return pos[:, None, :2] + slope[:, None, :]*(layerZs[None, :, None] - pos[:, None, 2:3])
+
+# Whether each (x, y) point is within a cell radius of one of the cell centers
+# (compared a block of points at a time to keep the distance table small)
+def inCells(points, centers, block=256):
+    out = np.zeros(len(points), dtype=bool)
+    for start in range(0, len(points), block):
+        p = points[start:start + block]
+        d = np.sqrt( (centers[None, :, 0] - p[:, None, 0])**2 +\
+                     (centers[None, :, 1] - p[:, None, 1])**2 )
+        out[start:start + block] = np.any(d <= cell_radius, axis=1)
+    return out
+
+###########################
+# Chunk versions (columns from ROOTmanager.TreeProcess.readChunk)
+###########################
+
+# Event (row in the chunk) of each entry of a collection
+def eventIndex(offsets):
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+# Index of the highest momentum SP hit passing mask in each event (-1 if none)
+def maxMomentumHits(spHits, mask):
+    evt = eventIndex(spHits['offsets'])
+    pmag = np.sqrt( spHits['px']**2 + spHits['py']**2 + spHits['pz']**2 )
+    cand = np.flatnonzero(mask & (pmag > 0))
+
+    # Highest momentum first in each event; earliest hit first among equals
+    cand = cand[np.lexsort((cand, -pmag[cand], evt[cand]))]
+    first = np.ones(len(cand), dtype=bool)
+    first[1:] = evt[cand[1:]] != evt[cand[:-1]]
+
+    best = np.full(len(spHits['offsets']) - 1, -1)
+    best[evt[cand[first]]] = cand[first]
+    return best
+
+# electronTargetSPHit of each event
+def electronTargetSPHits(targetSPHits):
+    return maxMomentumHits(targetSPHits,
+                (targetSPHits['z'] <= sp_thickness + sp_thickness + 0.5) &\
+                (targetSPHits['pz'] > 0) &\
+                (targetSPHits['trackID'] == 1) &\
+                (targetSPHits['pdgID'] == 11) )
+
+# electronEcalSPHit of each event
+def electronEcalSPHits(ecalSPHits):
+    return maxMomentumHits(ecalSPHits,
+                (ecalSPHits['z'] <= sp_ecal_front_z + sp_thickness/2) &\
+                (ecalSPHits['pz'] > 0) &\
+                (ecalSPHits['trackID'] == 1) &\
+                (ecalSPHits['pdgID'] == 11) )
+
+# Positions and momenta of the SP hits picked above (zeros where there's none)
+def spHitVectors(spHits, hit):
+    found = hit >= 0
+    pos, mom = np.zeros((len(hit), 3)), np.zeros((len(hit), 3))
+    pos[found] = np.column_stack((spHits['x'], spHits['y'], spHits['z']))[hit[found]]
+    mom[found] = np.column_stack((spHits['px'], spHits['py'], spHits['pz']))[hit[found]]
+    return pos, mom
+
 ###########################
 # Get hitID-related info
 ###########################
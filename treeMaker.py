@@ -1,9 +1,10 @@
 import os
+import sys
 import math
 import ROOT as r
 import numpy as np
 from mods import ROOTmanager as manager
-from mods import physTools, mipTracking
+from mods import physTools, mipTracking, containment, features, jit
 cellMap = np.loadtxt('mods/cellmodule.txt')
 r.gSystem.Load('libFramework.so')
 
@@ -79,438 +80,365 @@ for i in range(1, physTools.nSegments + 1):
         branches_info['oContYStd_x{}_s{}'.format(j,i)]      = {'rtype': float, 'default': 0.}
         branches_info['oContLayerStd_x{}_s{}'.format(j,i)]  = {'rtype': float, 'default': 0.}
 
+# Branches only written when a feature list asks for them
+optional_branches_info = {
+        'epSep':                     {'rtype': float, 'default': 0.},
+        'epDot':                     {'rtype': float, 'default': 0.}
+        }
+
+# Containment sums over all segments
+for name in containment.totalNames():
+    optional_branches_info[name] = {'rtype': int if 'NHits' in name else float,
+                                    'default': 0 if 'NHits' in name else 0.}
+
+# Slot of every branch that can be computed in the flat feature buffer
+all_branches_info = dict(branches_info, **optional_branches_info)
+layout = manager.FeatureLayout(all_branches_info)
+slot = layout.slots
+
+# Slots of the segment and containment features in containment's bin order
+cont_slots = layout.slot([feat for quantity in containment.quantities\
+                          for feat in containment.featureNames(quantity)])
+total_slots = layout.slot(containment.totalNames())
+
+# Input branches: ldmx class, attribute read into per event and columns read per chunk
+inputs_info = {
+        'EcalVeto_v12':               ('EcalVetoResult', 'ecalVeto',     None),
+        'TargetScoringPlaneHits_v12': ('SimTrackerHit',  'targetSPHits', None),
+        'EcalScoringPlaneHits_v12':   ('SimTrackerHit',  'ecalSPHits',   None),
+        'EcalRecHits_v12':            ('EcalHit',        'ecalRecHits',
+                                       ['energy', 'x', 'y', 'z', 'id'])
+        }
+
+# Feature families (see mods/features.py); the ones without branches are
+# intermediate results that other families need
+families = {
+        'base':         {'branches': list(manager.column_accessors['EcalVetoResult']),
+                         'inputs': ['EcalVeto_v12'], 'requires': [], 'cost': 1},
+        'trajectories': {'branches': [],
+                         'inputs': ['TargetScoringPlaneHits_v12', 'EcalScoringPlaneHits_v12'],
+                         'requires': [], 'cost': 2},
+        'hits':         {'branches': [], 'inputs': ['EcalRecHits_v12'],
+                         'requires': [], 'cost': 4},
+        'distances':    {'branches': [], 'inputs': [],
+                         'requires': ['trajectories', 'hits'], 'cost': 1},
+        'tracking':     {'branches': [], 'inputs': [],
+                         'requires': ['distances'], 'cost': 1},
+        'territory':    {'branches': ['fullElectronTerritoryHits', 'fullPhotonTerritoryHits',
+                                      'fullTerritoryRatio', 'electronTerritoryHits',
+                                      'photonTerritoryHits', 'TerritoryRatio'],
+                         'inputs': [], 'requires': ['base', 'tracking'], 'cost': 1},
+        'nearPhoton':   {'branches': ['firstNearPhLayer', 'nNearPhHits'],
+                         'inputs': [], 'requires': ['base', 'tracking'], 'cost': 1},
+        'straight':     {'branches': ['straight4'],
+                         'inputs': [], 'requires': ['tracking'], 'cost': 10},
+        'epSepDot':     {'branches': ['epSep', 'epDot'],
+                         'inputs': [], 'requires': ['trajectories'], 'cost': 1}
+        }
+for family in containment.families:
+    families[family] = {'branches': [feat for quantity in containment.quantities\
+                                     for feat in containment.featureNames(quantity, [family])],
+                        'inputs': [],
+                        'requires': ['hits'] if family == 'seg' else ['distances'],
+                        'cost': 2 if family == 'seg' else 3}
+families['contTotals'] = {'branches': containment.totalNames(), 'inputs': [],
+                          'requires': ['eCont', 'gCont', 'oCont'], 'cost': 1}
+
 def main():
 
     # Inputs and their trees and stuff
     pdict = manager.parse()
     batch_mode = pdict['batch']
-    separate = pdict['separate']
-    inlist = pdict['inlist']
-    outlist = pdict['outlist']
-    group_labels = pdict['groupls']
-    startEvent = pdict['startEvent']
-    maxEvents = pdict['maxEvents']
     # Should maybe put in parsing eventually and make event_process *arg
 
-    # Construct tree processes
-    procs = []
-    for gl, group in zip(group_labels,inlist):
-        procs.append( manager.TreeProcess(event_process, group,
-                                          ID=gl, batch=batch_mode, pfreq=100) )
-
-    # Process jobs
-    for proc in procs:
-
-        # Move into appropriate scratch dir
-        os.chdir(proc.tmp_dir)
-
-        # Branches needed
-        proc.ecalVeto     = proc.addBranch('EcalVetoResult', 'EcalVeto_v12')
-        proc.targetSPHits = proc.addBranch('SimTrackerHit', 'TargetScoringPlaneHits_v12')
-        proc.ecalSPHits   = proc.addBranch('SimTrackerHit', 'EcalScoringPlaneHits_v12')
-        proc.ecalRecHits  = proc.addBranch('EcalHit', 'EcalRecHits_v12')
-
-        # Tree/Files(s) to make
-        print('\nRunning %s'%(proc.ID))
-
-        proc.separate = separate
-
-        proc.tfMakers = {'unsorted': None}
-        if proc.separate:
-            proc.tfMakers = {
-                'egin': None,
-                'ein': None,
-                'gin': None,
-                'none': None
-                }
-
-        for tfMaker in proc.tfMakers:
-            proc.tfMakers[tfMaker] = manager.TreeMaker(group_labels[procs.index(proc)]+\
-                                        '_{}.root'.format(tfMaker),\
-                                        "EcalVeto",\
-                                        branches_info,\
-                                        outlist[procs.index(proc)]
-                                        )
-
-        # Gets executed at the end of run()
-        proc.extrafs = [ proc.tfMakers[tfMaker].wq for tfMaker in proc.tfMakers ]
+    # Output files written for each group label
+    if pdict['separate']:
+        suffixes = ['_{}.root'.format(tfMaker) for tfMaker in ['egin', 'ein', 'gin', 'none']]
+    else:
+        suffixes = ['_unsorted.root']
 
-        # RUN
-        proc.run(strEvent=startEvent, maxEvents=maxEvents)
+    # Process jobs (in parallel and/or split into shards if asked)
+    failed = manager.runJobs(runGroup, pdict, suffixes, storeFormat=pdict['store'])
 
     # Remove scratch directory if there is one
     if not batch_mode:     # Don't want to break other batch jobs when one finishes
         manager.rmScratch()
 
-    print('\nDone!\n')
-
-
-# Process an event
-def event_process(self):
-
-    # Initialize BDT input variables w/ defaults
-    feats = next(iter(self.tfMakers.values())).resetFeats()
+    if failed:
+        sys.exit('\nFailed: {}\n'.format(', '.join(failed)))
 
-    # Assign pre-computed variables
-    feats['nReadoutHits']       = self.ecalVeto.getNReadoutHits()
-    feats['summedDet']          = self.ecalVeto.getSummedDet()
-    feats['summedTightIso']     = self.ecalVeto.getSummedTightIso()
-    feats['maxCellDep']         = self.ecalVeto.getMaxCellDep()
-    feats['showerRMS']          = self.ecalVeto.getShowerRMS()
-    feats['xStd']               = self.ecalVeto.getXStd()
-    feats['yStd']               = self.ecalVeto.getYStd()
-    feats['avgLayerHit']        = self.ecalVeto.getAvgLayerHit()
-    feats['stdLayerHit']        = self.ecalVeto.getStdLayerHit()
-    feats['deepestLayerHit']    = self.ecalVeto.getDeepestLayerHit() 
-    feats['ecalBackEnergy']     = self.ecalVeto.getEcalBackEnergy()
-    
-    ###################################
-    # Determine event type
-    ###################################
-
-    # Get e position and momentum from EcalSP
-    e_ecalHit = physTools.electronEcalSPHit(self.ecalSPHits)
-    if e_ecalHit != None:
-        e_ecalPos, e_ecalP = e_ecalHit.getPosition(), e_ecalHit.getMomentum()
-
-    # Photon Info from targetSP
-    e_targetHit = physTools.electronTargetSPHit(self.targetSPHits)
-    if e_targetHit != None:
-        g_targPos, g_targP = physTools.gammaTargetInfo(e_targetHit)
-    else:  # Should about never happen -> division by 0 in g_traj
-        print('no e at targ!')
-        g_targPos = g_targP = np.zeros(3)
-
-    # Get electron and photon trajectories
-    e_traj = g_traj = None
-
-    if e_ecalHit != None:
-        e_traj = physTools.layerIntercepts(e_ecalPos, e_ecalP)
-
-    if e_targetHit != None:
-        g_traj = physTools.layerIntercepts(g_targPos, g_targP)
-
-    # Fiducial categories (filtered into different output trees)
-    if self.separate:
-        e_fid = g_fid = False
-
-        if e_traj != None:
-            for cell in cellMap:
-                if physTools.dist( cell[1:], e_traj[0] ) <= physTools.cell_radius:
-                    e_fid = True
-                    break
-
-        if g_traj != None:
-            for cell in cellMap:
-                if physTools.dist( cell[1:], g_traj[0] ) <= physTools.cell_radius:
-                    g_fid = True
-                    break
-
-    ###################################
-    # Compute extra BDT input variables
-    ###################################
-
-    # Find epSep and epDot, and prepare electron and photon trajectory vectors
-    if e_traj != None and g_traj != None:
-
-        # Create arrays marking start and end of each trajectory
-        e_traj_ends = [np.array([e_traj[0][0], e_traj[0][1], physTools.ecal_layerZs[0]    ]),
-                       np.array([e_traj[-1][0], e_traj[-1][1], physTools.ecal_layerZs[-1] ])]
-        g_traj_ends = [np.array([g_traj[0][0], g_traj[0][1], physTools.ecal_layerZs[0]    ]),
-                       np.array([g_traj[-1][0], g_traj[-1][1], physTools.ecal_layerZs[-1] ])]
-
-        # Unused epDot and epSep
-        #e_norm  = physTools.unit( e_traj_ends[1] - e_traj_ends[0] )
-        #g_norm  = physTools.unit( g_traj_ends[1] - g_traj_ends[0] )
-        #feats['epSep'] = physTools.dist( e_traj_ends[0], g_traj_ends[0] )
-        #feats['epDot'] = physTools.dot(e_norm,g_norm)
+    print('\nDone!\n')
 
-    else:
 
-        # Electron trajectory is missing so all hits in Ecal are okay to use
-        # Pick trajectories so they won'trestrict tracking, far outside the Ecal
+# Build and run the tree process for one group; returns the number of events processed
+def runGroup(gl, group, outdir, pdict):
 
-        e_traj_ends   = [np.array([999 ,999 ,0   ]), np.array([999 ,999 ,999 ]) ]
-        g_traj_ends   = [np.array([1000,1000,0   ]), np.array([1000,1000,1000]) ]
+    jit.setBackend(pdict['backend'])
 
-        #feats['epSep'] = 10.0 + 1.0 # Don't cut on these in this case
-        #feats['epDot'] = 3.0 + 1.0
+    # Branches to write (all of branches_info unless a feature list is picked)
+    # and the families needed to compute them
+    if pdict['features'] == None: out_names = list(branches_info)
+    else: out_names = features.featureList(pdict['features'])
+    needed = features.resolve(families, out_names,
+                              ['trajectories'] if pdict['separate'] else [])
 
-    # Territory setup (consider missing case)
-    gToe    = physTools.unit( e_traj_ends[0] - g_traj_ends[0] )
-    origin  = g_traj_ends[0] + 0.5*8.7*gToe
+    # Events are processed a chunk at a time on numpy columns if asked
+    chunked = pdict['chunkSize'] > 0
 
-    # Recoil electron momentum magnitude and angle with z-axis
-    recoilPMag  = physTools.mag(  e_ecalP )                 if e_ecalHit != None else -1.0
-    recoilTheta = physTools.angle(e_ecalP, units='radians') if recoilPMag > 0    else -1.0
+    proc = manager.TreeProcess(chunk_process if chunked else event_process, group,
+                               ID=gl, batch=pdict['batch'], pfreq=100,
+                               stage=pdict['stage'], copiers=pdict['copiers'],
+                               cacheSize=pdict['cacheSize'], pruneBranches=pdict['prune'])
 
-    # Set electron RoC binnings
-    e_radii = physTools.radius68_thetalt10_plt500
-    if recoilTheta < 10 and recoilPMag >= 500: e_radii = physTools.radius68_thetalt10_pgt500
-    elif recoilTheta >= 10 and recoilTheta < 20: e_radii = physTools.radius68_theta10to20
-    elif recoilTheta >= 20: e_radii = physTools.radius68_thetagt20
+    # Move into appropriate scratch dir
+    os.chdir(proc.tmp_dir)
 
-    # Always use default binning for photon RoC
-    g_radii = physTools.radius68_thetalt10_plt500
+    # Branches needed
+    for branch_name in inputs_info:
+        ldmx_class, attribute, columns = inputs_info[branch_name]
+        if not branch_name in features.inputs(families, needed):
+            setattr(proc, attribute, None)
+        elif chunked:
+            proc.addColumns(ldmx_class, branch_name, columns)
+        else:
+            setattr(proc, attribute, proc.addBranch(ldmx_class, branch_name))
+
+    # Tree/Files(s) to make
+    print('\nRunning %s'%(proc.ID))
+    if pdict['features'] != None:
+        print('Writing the {} {} features ({} of {} families, {:.0f}% of the full cost)'\
+                .format(len(out_names), pdict['features'], len(needed), len(families),
+                        100.*features.cost(families, needed)/\
+                        features.cost(families, families)))
+
+    proc.separate = pdict['separate']
+    proc.families = needed
+    proc.feats = layout.defaults.copy()
+    proc.out_slots = layout.slot(out_names)
+
+    proc.tfMakers = {'unsorted': None}
+    if proc.separate:
+        proc.tfMakers = {
+            'egin': None,
+            'ein': None,
+            'gin': None,
+            'none': None
+            }
+
+    for tfMaker in proc.tfMakers:
+        proc.tfMakers[tfMaker] = manager.TreeMaker(gl+'_{}.root'.format(tfMaker),\
+                                    "EcalVeto",\
+                                    {name: all_branches_info[name] for name in out_names},\
+                                    outdir,
+                                    bufferSize=pdict['bufferSize'],
+                                    store=pdict['store']
+                                    )
+
+    # Gets executed at the end of run()
+    proc.extrafs = [ proc.tfMakers[tfMaker].wq for tfMaker in proc.tfMakers ]
+
+    # RUN
+    proc.run(strEvent=pdict['startEvent'], maxEvents=pdict['maxEvents'],
+             chunkSize=pdict['chunkSize'])
+
+    return proc.maxEvents
 
-    # Big data
-    trackingHitList = []
 
-    # Major ECal loop
-    for hit in self.ecalRecHits:
-        
-        if hit.getEnergy() <= 0: continue
+# Process an event
+def event_process(self):
 
-        layer = physTools.ecal_layer(hit)
-        xy_pair = ( hit.getXPos(), hit.getYPos() )
+    # Families of features to compute (the rest keep their defaults)
+    need = self.families
 
-        # Territory selections
-        hitPrime = physTools.pos(hit) - origin
-        if np.dot(hitPrime, gToe) > 0: feats['fullElectronTerritoryHits'] += 1
-        else: feats['fullPhotonTerritoryHits'] += 1
+    # Initialize BDT input variables w/ defaults (flat buffer, written by slot)
+    feats = self.feats
+    feats[:] = layout.defaults
 
-        # Distance to electron trajectory
-        if e_traj != None:
-            xy_e_traj = ( e_traj[layer][0], e_traj[layer][1] )
-            distance_e_traj = physTools.dist(xy_pair, xy_e_traj)
-        else: distance_e_traj = -1.0
-
-        # Distance to photon trajectory
-        if g_traj != None:
-            xy_g_traj = ( g_traj[layer][0], g_traj[layer][1] )
-            distance_g_traj = physTools.dist(xy_pair, xy_g_traj)
-        else: distance_g_traj = -1.0
-
-        # Decide which longitudinal segment the hit is in and add to sums
-        for i in range(1, physTools.nSegments + 1):
-
-            if (physTools.segLayers[i - 1] <= layer)\
-              and (layer <= physTools.segLayers[i] - 1):
-                feats['energy_s{}'.format(i)] += hit.getEnergy()
-                feats['nHits_s{}'.format(i)] += 1
-                feats['xMean_s{}'.format(i)] += xy_pair[0]*hit.getEnergy()
-                feats['yMean_s{}'.format(i)] += xy_pair[1]*hit.getEnergy()
-                feats['layerMean_s{}'.format(i)] += layer*hit.getEnergy()
-
-                # Decide which containment region the hit is in and add to sums
-                for j in range(1, physTools.nRegions + 1):
-
-                    if ((j - 1)*e_radii[layer] <= distance_e_traj)\
-                      and (distance_e_traj < j*e_radii[layer]):
-                        feats['eContEnergy_x{}_s{}'.format(j,i)] += hit.getEnergy()
-                        feats['eContNHits_x{}_s{}'.format(j,i)] += 1
-                        feats['eContXMean_x{}_s{}'.format(j,i)] +=\
-                                                            xy_pair[0]*hit.getEnergy()
-                        feats['eContYMean_x{}_s{}'.format(j,i)] +=\
-                                                            xy_pair[1]*hit.getEnergy()
-                        feats['eContLayerMean_x{}_s{}'.format(j,i)] +=\
-                                                            layer*hit.getEnergy()
-
-                    if ((j - 1)*g_radii[layer] <= distance_g_traj)\
-                      and (distance_g_traj < j*g_radii[layer]):
-                        feats['gContEnergy_x{}_s{}'.format(j,i)] += hit.getEnergy()
-                        feats['gContNHits_x{}_s{}'.format(j,i)] += 1
-                        feats['gContXMean_x{}_s{}'.format(j,i)] +=\
-                                                            xy_pair[0]*hit.getEnergy()
-                        feats['gContYMean_x{}_s{}'.format(j,i)] +=\
-                                                            xy_pair[1]*hit.getEnergy()
-                        feats['gContLayerMean_x{}_s{}'.format(j,i)] +=\
-                                                            layer*hit.getEnergy()
-
-                    if (distance_e_traj > j*e_radii[layer])\
-                      and (distance_g_traj > j*g_radii[layer]):
-                        feats['oContEnergy_x{}_s{}'.format(j,i)] += hit.getEnergy()
-                        feats['oContNHits_x{}_s{}'.format(j,i)] += 1
-                        feats['oContXMean_x{}_s{}'.format(j,i)] +=\
-                                                            xy_pair[0]*hit.getEnergy()
-                        feats['oContYMean_x{}_s{}'.format(j,i)] +=\
-                                                            xy_pair[1]*hit.getEnergy()
-                        feats['oContLayerMean_x{}_s{}'.format(j,i)] +=\
-                                                            layer*hit.getEnergy()
-
-        # Build MIP tracking hit list; (outside electron region or electron missing)
-        if distance_e_traj >= e_radii[layer] or distance_e_traj == -1.0:
-            trackingHitList.append(hit)
-
-    # If possible, quotient out the total energy from the means
-    for i in range(1, physTools.nSegments + 1):
-
-        if feats['energy_s{}'.format(i)] > 0:
-            feats['xMean_s{}'.format(i)] /= feats['energy_s{}'.format(i)]
-            feats['yMean_s{}'.format(i)] /= feats['energy_s{}'.format(i)]
-            feats['layerMean_s{}'.format(i)] /= feats['energy_s{}'.format(i)]
-
-        for j in range(1, physTools.nRegions + 1):
-
-            if feats['eContEnergy_x{}_s{}'.format(j,i)] > 0:
-                feats['eContXMean_x{}_s{}'.format(j,i)] /=\
-                                                    feats['eContEnergy_x{}_s{}'.format(j,i)]
-                feats['eContYMean_x{}_s{}'.format(j,i)] /=\
-                                                    feats['eContEnergy_x{}_s{}'.format(j,i)]
-                feats['eContLayerMean_x{}_s{}'.format(j,i)] /=\
-                                                    feats['eContEnergy_x{}_s{}'.format(j,i)]
-
-            if feats['gContEnergy_x{}_s{}'.format(j,i)] > 0:
-                feats['gContXMean_x{}_s{}'.format(j,i)] /=\
-                                                    feats['gContEnergy_x{}_s{}'.format(j,i)]
-                feats['gContYMean_x{}_s{}'.format(j,i)] /=\
-                                                    feats['gContEnergy_x{}_s{}'.format(j,i)]
-                feats['gContLayerMean_x{}_s{}'.format(j,i)] /=\
-                                                    feats['gContEnergy_x{}_s{}'.format(j,i)]
-
-            if feats['oContEnergy_x{}_s{}'.format(j,i)] > 0:
-                feats['oContXMean_x{}_s{}'.format(j,i)] /=\
-                                                    feats['oContEnergy_x{}_s{}'.format(j,i)]
-                feats['oContYMean_x{}_s{}'.format(j,i)] /=\
-                                                    feats['oContEnergy_x{}_s{}'.format(j,i)]
-                feats['oContLayerMean_x{}_s{}'.format(j,i)] /=\
-                                                    feats['oContEnergy_x{}_s{}'.format(j,i)]
-
-    # Loop over hits again to calculate the standard deviations
-    for hit in self.ecalRecHits:
-
-        if hit.getEnergy <= 0: continue
-
-        layer = physTools.ecal_layer(hit)
-        xy_pair = (hit.getXPos(), hit.getYPos())
-
-        # Distance to electron trajectory
-        if e_traj != None:
-            xy_e_traj = (e_traj[layer][0], e_traj[layer][1])
-            distance_e_traj = physTools.dist(xy_pair, xy_e_traj)
-        else:
-            distance_e_traj = -1.0
+    # Assign pre-computed variables
+    if 'base' in need:
+        feats[slot['nReadoutHits']]     = self.ecalVeto.getNReadoutHits()
+        feats[slot['summedDet']]        = self.ecalVeto.getSummedDet()
+        feats[slot['summedTightIso']]   = self.ecalVeto.getSummedTightIso()
+        feats[slot['maxCellDep']]       = self.ecalVeto.getMaxCellDep()
+        feats[slot['showerRMS']]        = self.ecalVeto.getShowerRMS()
+        feats[slot['xStd']]             = self.ecalVeto.getXStd()
+        feats[slot['yStd']]             = self.ecalVeto.getYStd()
+        feats[slot['avgLayerHit']]      = self.ecalVeto.getAvgLayerHit()
+        feats[slot['stdLayerHit']]      = self.ecalVeto.getStdLayerHit()
+        feats[slot['deepestLayerHit']]  = self.ecalVeto.getDeepestLayerHit()
+        feats[slot['ecalBackEnergy']]   = self.ecalVeto.getEcalBackEnergy()
+
+    # Default RoC binnings (electron binning set from the recoil below)
+    e_radii = g_radii = physTools.radius68_thetalt10_plt500
+
+    if 'trajectories' in need:
+
+        ###################################
+        # Determine event type
+        ###################################
+
+        # Get e position and momentum from EcalSP
+        e_ecalHit = physTools.electronEcalSPHit(self.ecalSPHits)
+        if e_ecalHit != None:
+            e_ecalPos, e_ecalP = e_ecalHit.getPosition(), e_ecalHit.getMomentum()
+
+        # Photon Info from targetSP
+        e_targetHit = physTools.electronTargetSPHit(self.targetSPHits)
+        if e_targetHit != None:
+            g_targPos, g_targP = physTools.gammaTargetInfo(e_targetHit)
+        else:  # Should about never happen -> division by 0 in g_traj
+            print('no e at targ!')
+            g_targPos = g_targP = np.zeros(3)
+
+        # Get electron and photon trajectories
+        e_traj = g_traj = None
+
+        if e_ecalHit != None:
+            e_traj = physTools.layerIntercepts(e_ecalPos, e_ecalP)
+
+        if e_targetHit != None:
+            g_traj = physTools.layerIntercepts(g_targPos, g_targP)
+
+        # Fiducial categories (filtered into different output trees)
+        if self.separate:
+            e_fid = g_fid = False
+
+            if e_traj != None:
+                for cell in cellMap:
+                    if physTools.dist( cell[1:], e_traj[0] ) <= physTools.cell_radius:
+                        e_fid = True
+                        break
+
+            if g_traj != None:
+                for cell in cellMap:
+                    if physTools.dist( cell[1:], g_traj[0] ) <= physTools.cell_radius:
+                        g_fid = True
+                        break
+
+        ###################################
+        # Compute extra BDT input variables
+        ###################################
+
+        # Find epSep and epDot, and prepare electron and photon trajectory vectors
+        if e_traj != None and g_traj != None:
+
+            # Create arrays marking start and end of each trajectory
+            e_traj_ends = [np.array([e_traj[0][0],  e_traj[0][1],  physTools.ecal_layerZs[0]]),
+                           np.array([e_traj[-1][0], e_traj[-1][1], physTools.ecal_layerZs[-1]])
+                          ]
+            g_traj_ends = [np.array([g_traj[0][0],  g_traj[0][1],  physTools.ecal_layerZs[0]]),
+                           np.array([g_traj[-1][0], g_traj[-1][1], physTools.ecal_layerZs[-1]])
+                          ]
+
+            if 'epSepDot' in need:
+                e_norm  = physTools.unit( e_traj_ends[1] - e_traj_ends[0] )
+                g_norm  = physTools.unit( g_traj_ends[1] - g_traj_ends[0] )
+                feats[slot['epSep']] = physTools.dist( e_traj_ends[0], g_traj_ends[0] )
+                feats[slot['epDot']] = physTools.dot(e_norm,g_norm)
 
-        # Distance to photon trajectory
-        if g_traj != None:
-            xy_g_traj = (g_traj[layer][0], g_traj[layer][1])
-            distance_g_traj = physTools.dist(xy_pair, xy_g_traj)
         else:
-            distance_g_traj = -1.0
-
-        # Decide which longitudinal segment the hit is in and add to sums
-        for i in range(1, physTools.nSegments + 1):
-
-            if (physTools.segLayers[i - 1] <= layer) and\
-                    (layer <= physTools.segLayers[i] - 1):
-                feats['xStd_s{}'.format(i)] += ((xy_pair[0] -\
-                        feats['xMean_s{}'.format(i)])**2)*hit.getEnergy()
-                feats['yStd_s{}'.format(i)] += ((xy_pair[1] -\
-                        feats['yMean_s{}'.format(i)])**2)*hit.getEnergy()
-                feats['layerStd_s{}'.format(i)] += ((layer -\
-                        feats['layerMean_s{}'.format(i)])**2)*hit.getEnergy()
-
-                # Decide which containment region the hit is in and add to sums
-                for j in range(1, physTools.nRegions + 1):
-
-                    if ((j - 1)*e_radii[layer] <= distance_e_traj)\
-                      and (distance_e_traj < j*e_radii[layer]):
-                        feats['eContXStd_x{}_s{}'.format(j,i)] += ((xy_pair[0] -\
-                                feats['eContXMean_x{}_s{}'.format(j,i)])**2)*hit.getEnergy()
-                        feats['eContYStd_x{}_s{}'.format(j,i)] += ((xy_pair[1] -\
-                                feats['eContYMean_x{}_s{}'.format(j,i)])**2)*hit.getEnergy()
-                        feats['eContLayerStd_x{}_s{}'.format(j,i)] += ((layer -\
-                            feats['eContLayerMean_x{}_s{}'.format(j,i)])**2)*hit.getEnergy()
-
-                    if ((j - 1)*g_radii[layer] <= distance_g_traj)\
-                      and (distance_g_traj < j*g_radii[layer]):
-                        feats['gContXStd_x{}_s{}'.format(j,i)] += ((xy_pair[0] -\
-                                feats['gContXMean_x{}_s{}'.format(j,i)])**2)*hit.getEnergy()
-                        feats['gContYStd_x{}_s{}'.format(j,i)] += ((xy_pair[1] -\
-                                feats['gContYMean_x{}_s{}'.format(j,i)])**2)*hit.getEnergy()
-                        feats['gContLayerStd_x{}_s{}'.format(j,i)] += ((layer -\
-                            feats['gContLayerMean_x{}_s{}'.format(j,i)])**2)*hit.getEnergy()
-
-                    if (distance_e_traj > j*e_radii[layer])\
-                      and (distance_g_traj > j*g_radii[layer]):
-                        feats['oContXStd_x{}_s{}'.format(j,i)] += ((xy_pair[0] -\
-                                feats['oContXMean_x{}_s{}'.format(j,i)])**2)*hit.getEnergy()
-                        feats['oContYStd_x{}_s{}'.format(j,i)] += ((xy_pair[1] -\
-                                feats['oContYMean_x{}_s{}'.format(j,i)])**2)*hit.getEnergy()
-                        feats['oContLayerStd_x{}_s{}'.format(j,i)] += ((layer -\
-                            feats['oContLayerMean_x{}_s{}'.format(j,i)])**2)*hit.getEnergy()
-
-    # Quotient out the total energies from the standard deviations if possible and take root
-    for i in range(1, physTools.nSegments + 1):
-
-        if feats['energy_s{}'.format(i)] > 0:
-            feats['xStd_s{}'.format(i)] = math.sqrt(feats['xStd_s{}'.format(i)]/\
-                    feats['energy_s{}'.format(i)])
-            feats['yStd_s{}'.format(i)] = math.sqrt(feats['yStd_s{}'.format(i)]/\
-                    feats['energy_s{}'.format(i)])
-            feats['layerStd_s{}'.format(i)] = math.sqrt(feats['layerStd_s{}'.format(i)]/\
-                    feats['energy_s{}'.format(i)])
-
-        for j in range(1, physTools.nRegions + 1):
-
-            if feats['eContEnergy_x{}_s{}'.format(j,i)] > 0:
-                feats['eContXStd_x{}_s{}'.format(j,i)] =\
-                        math.sqrt(feats['eContXStd_x{}_s{}'.format(j,i)]/\
-                        feats['eContEnergy_x{}_s{}'.format(j,i)])
-                feats['eContYStd_x{}_s{}'.format(j,i)] =\
-                        math.sqrt(feats['eContYStd_x{}_s{}'.format(j,i)]/\
-                        feats['eContEnergy_x{}_s{}'.format(j,i)])
-                feats['eContLayerStd_x{}_s{}'.format(j,i)] =\
-                        math.sqrt(feats['eContLayerStd_x{}_s{}'.format(j,i)]/\
-                        feats['eContEnergy_x{}_s{}'.format(j,i)])
-
-            if feats['gContEnergy_x{}_s{}'.format(j,i)] > 0:
-                feats['gContXStd_x{}_s{}'.format(j,i)] =\
-                        math.sqrt(feats['gContXStd_x{}_s{}'.format(j,i)]/\
-                        feats['gContEnergy_x{}_s{}'.format(j,i)])
-                feats['gContYStd_x{}_s{}'.format(j,i)] =\
-                        math.sqrt(feats['gContYStd_x{}_s{}'.format(j,i)]/\
-                        feats['gContEnergy_x{}_s{}'.format(j,i)])
-                feats['gContLayerStd_x{}_s{}'.format(j,i)] =\
-                        math.sqrt(feats['gContLayerStd_x{}_s{}'.format(j,i)]/\
-                        feats['gContEnergy_x{}_s{}'.format(j,i)])
-
-            if feats['oContEnergy_x{}_s{}'.format(j,i)] > 0:
-                feats['oContXStd_x{}_s{}'.format(j,i)] =\
-                        math.sqrt(feats['oContXStd_x{}_s{}'.format(j,i)]/\
-                        feats['oContEnergy_x{}_s{}'.format(j,i)])
-                feats['oContYStd_x{}_s{}'.format(j,i)] =\
-                        math.sqrt(feats['oContYStd_x{}_s{}'.format(j,i)]/\
-                        feats['oContEnergy_x{}_s{}'.format(j,i)])
-                feats['oContLayerStd_x{}_s{}'.format(j,i)] =\
-                        math.sqrt(feats['oContLayerStd_x{}_s{}'.format(j,i)]/\
-                        feats['oContEnergy_x{}_s{}'.format(j,i)])
 
+            # Electron trajectory is missing so all hits in Ecal are okay to use
+            # Pick trajectories so they won'trestrict tracking, far outside the Ecal
+
+            e_traj_ends   = [np.array([999 ,999 ,0   ]), np.array([999 ,999 ,999 ]) ]
+            g_traj_ends   = [np.array([1000,1000,0   ]), np.array([1000,1000,1000]) ]
+
+            if 'epSepDot' in need:
+                feats[slot['epSep']] = 10.0 + 1.0 # Don't cut on these in this case
+                feats[slot['epDot']] = 3.0 + 1.0
+
+        # Territory setup (consider missing case)
+        gToe    = physTools.unit( e_traj_ends[0] - g_traj_ends[0] )
+        origin  = g_traj_ends[0] + 0.5*8.7*gToe
+
+        # Recoil electron momentum magnitude and angle with z-axis
+        recoilPMag  = physTools.mag(  e_ecalP )                 if e_ecalHit != None else -1.0
+        recoilTheta = physTools.angle(e_ecalP, units='radians') if recoilPMag > 0    else -1.0
+
+        # Set electron RoC binnings
+        if recoilTheta < 10 and recoilPMag >= 500:
+            e_radii = physTools.radius68_thetalt10_pgt500
+        elif recoilTheta >= 10 and recoilTheta < 20:
+            e_radii = physTools.radius68_theta10to20
+        elif recoilTheta >= 20:
+            e_radii = physTools.radius68_thetagt20
+
+    if 'hits' in need:
+
+        # Hit information, gathered once (only hits with energy are used)
+        hits = [hit for hit in self.ecalRecHits]
+        e, x, y, z, layer = physTools.ecalHitArrays(hits)
+        keep = np.flatnonzero(e > 0)
+        e, x, y, z, layer = e[keep], x[keep], y[keep], z[keep], layer[keep]
+
+        # Distances to electron and photon trajectories (-1 if missing or not needed)
+        distance_e_traj = np.full(len(keep), -1.0)
+        distance_g_traj = np.full(len(keep), -1.0)
+
+    if 'distances' in need:
+        if e_traj != None: distance_e_traj = physTools.layerDists(x, y, layer, e_traj)
+        if g_traj != None: distance_g_traj = physTools.layerDists(x, y, layer, g_traj)
+
+    # Longitudinal segment and containment region sums, means and standard deviations
+    cont_families = [family for family in containment.families if family in need]
+    if cont_families:
+        sums = containment.eventSums(e, x, y, layer, distance_e_traj, distance_g_traj,
+                                     e_radii, g_radii, cont_families)
+        feats[cont_slots] = np.concatenate([sums[quantity]\
+                                            for quantity in containment.quantities])
+        if 'contTotals' in need:
+            feats[total_slots] = containment.totals(sums)
+
+    # MIP tracking hits; (outside electron region or electron missing)
+    if 'tracking' in need:
+        tracking = np.flatnonzero((distance_e_traj >= np.asarray(e_radii)[layer]) |\
+                                  (distance_e_traj == -1.0))
 
     # Find the first layer of the ECal where a hit near the projected photon trajectory
     # AND the total number of hits around the photon trajectory
-    if g_traj != None: # If no photon trajectory, leave this at the default
+    if 'nearPhoton' in need:
+        if g_traj != None: # If no photon trajectory, leave this at the default
 
-        # First currently unusued; pending further study; performance drop from  v9 and v12
-        #print(trackingHitList, g_traj)
-        feats['firstNearPhLayer'], feats['nNearPhHits'] = mipTracking.nearPhotonInfo(
-                                                            trackingHitList, g_traj )
-    else: feats['nNearPhHits'] = feats['nReadoutHits']
+            # First currently unusued; pending further study; performance drop from  v9 and v12
+            feats[slot['firstNearPhLayer']], feats[slot['nNearPhHits']] =\
+                                mipTracking.nearPhotonInfoArrays(x[tracking], y[tracking],
+                                                                 layer[tracking], g_traj)
+        else: feats[slot['nNearPhHits']] = feats[slot['nReadoutHits']]
 
+    if 'territory' in need:
 
-    # Territories limited to trackingHitList
-    if e_traj != None:
-        for hit in trackingHitList:
-            hitPrime = physTools.pos(hit) - origin
-            if np.dot(hitPrime, gToe) > 0: feats['electronTerritoryHits'] += 1
-            else: feats['photonTerritoryHits'] += 1
-    else:
-        feats['photonTerritoryHits'] = feats['nReadoutHits']
-        feats['TerritoryRatio'] = 10
-        feats['fullTerritoryRatio'] = 10
-    if feats['electronTerritoryHits'] != 0:
-        feats['TerritoryRatio'] = feats['photonTerritoryHits']/feats['electronTerritoryHits']
-    if feats['fullElectronTerritoryHits'] != 0:
-        feats['fullTerritoryRatio'] = feats['fullPhotonTerritoryHits']/\
-                                            feats['fullElectronTerritoryHits']
+        # Territory selections
+        electronSide = np.dot(np.column_stack((x, y, z)) - origin, gToe) > 0
+        feats[slot['fullElectronTerritoryHits']] = int(np.count_nonzero(electronSide))
+        feats[slot['fullPhotonTerritoryHits']] = len(keep) -\
+                                                    feats[slot['fullElectronTerritoryHits']]
 
+        # Territories limited to tracking hits
+        if e_traj != None:
+            feats[slot['electronTerritoryHits']] =\
+                                            int(np.count_nonzero(electronSide[tracking]))
+            feats[slot['photonTerritoryHits']] = len(tracking) -\
+                                                    feats[slot['electronTerritoryHits']]
+        else:
+            feats[slot['photonTerritoryHits']] = feats[slot['nReadoutHits']]
+            feats[slot['TerritoryRatio']] = 10
+            feats[slot['fullTerritoryRatio']] = 10
+        if feats[slot['electronTerritoryHits']] != 0:
+            feats[slot['TerritoryRatio']] = feats[slot['photonTerritoryHits']]/\
+                                                feats[slot['electronTerritoryHits']]
+        if feats[slot['fullElectronTerritoryHits']] != 0:
+            feats[slot['fullTerritoryRatio']] = feats[slot['fullPhotonTerritoryHits']]/\
+                                                feats[slot['fullElectronTerritoryHits']]
 
     # Find MIP tracks
-    feats['straight4'], trackingHitList = mipTracking.findStraightTracks(
-                                trackingHitList, e_traj_ends, g_traj_ends,
-                                mst = 4, returnHitList = True)
+    if 'straight' in need:
+        feats[slot['straight4']], = mipTracking.findStraightTracksArrays(
+                                    x[tracking], y[tracking], z[tracking],
+                                    e_traj_ends, g_traj_ends, mst = 4)
 
     # Fill the tree (according to fiducial category) with values for this event
+    feats = feats[self.out_slots]
     if not self.separate:
         self.tfMakers['unsorted'].fillEvent(feats)
     else:
@@ -519,5 +447,209 @@ def event_process(self):
         elif not e_fid and g_fid: self.tfMakers['gin'].fillEvent(feats)
         else: self.tfMakers['none'].fillEvent(feats)
 
+# RoC radii tables, indexed by the electron binning picked in chunk_process
+radii68 = np.array([physTools.radius68_thetalt10_plt500,
+                    physTools.radius68_thetalt10_pgt500,
+                    physTools.radius68_theta10to20,
+                    physTools.radius68_thetagt20])
+
+# Process a chunk of events at once (same features as event_process)
+def chunk_process(self):
+
+    # Families of features to compute (the rest keep their defaults)
+    need = self.families
+
+    # Events [self.event_count, self.chunk_stop)
+    nEvents = self.chunk_stop - self.event_count
+
+    # Initialize BDT input variables w/ defaults (one row per event)
+    feats = np.tile(layout.defaults, (nEvents, 1))
+
+    # Assign pre-computed variables
+    if 'base' in need:
+        veto = self.chunk['EcalVeto_v12']
+        for name in manager.column_accessors['EcalVetoResult']:
+            feats[:, slot[name]] = veto[name]
+
+    # Default RoC binning (row of radii68; electron binning set from the recoil below)
+    e_binning = np.zeros(nEvents, dtype=int)
+
+    if 'trajectories' in need:
+
+        ###################################
+        # Determine event type
+        ###################################
+
+        # Get e position and momentum from EcalSP
+        ecalSP = self.chunk['EcalScoringPlaneHits_v12']
+        e_ecalHit = physTools.electronEcalSPHits(ecalSP)
+        has_e = e_ecalHit >= 0
+        e_ecalPos, e_ecalP = physTools.spHitVectors(ecalSP, e_ecalHit)
+
+        # Photon Info from targetSP
+        targetSP = self.chunk['TargetScoringPlaneHits_v12']
+        e_targetHit = physTools.electronTargetSPHits(targetSP)
+        has_g = e_targetHit >= 0
+        if not np.all(has_g):
+            print('no e at targ! ({} events)'.format(np.count_nonzero(~has_g)))
+        g_targPos, e_targP = physTools.spHitVectors(targetSP, e_targetHit)
+        g_targP = np.array([0,0,4000]) - e_targP
+
+        # Get electron and photon trajectories (nEvents x 34 layers x (x, y))
+        e_traj = np.zeros((nEvents, len(physTools.ecal_layerZs), 2))
+        g_traj = np.zeros((nEvents, len(physTools.ecal_layerZs), 2))
+        e_traj[has_e] = physTools.layerInterceptsArray(e_ecalPos[has_e], e_ecalP[has_e])
+        g_traj[has_g] = physTools.layerInterceptsArray(g_targPos[has_g], g_targP[has_g])
+
+        # Fiducial categories (filtered into different output trees)
+        if self.separate:
+            e_fid = np.zeros(nEvents, dtype=bool)
+            g_fid = np.zeros(nEvents, dtype=bool)
+            e_fid[has_e] = physTools.inCells(e_traj[has_e, 0], cellMap[:, 1:])
+            g_fid[has_g] = physTools.inCells(g_traj[has_g, 0], cellMap[:, 1:])
+
+        ###################################
+        # Compute extra BDT input variables
+        ###################################
+
+        # Arrays marking start and end of each trajectory (nEvents x 2 x 3)
+        # If either is missing, pick trajectories far outside the Ecal for both
+        e_traj_ends = np.tile(np.array([[999., 999., 0.], [999., 999., 999.]]),
+                              (nEvents, 1, 1))
+        g_traj_ends = np.tile(np.array([[1000., 1000., 0.], [1000., 1000., 1000.]]),
+                              (nEvents, 1, 1))
+        both = has_e & has_g
+        for traj_ends, traj in ((e_traj_ends, e_traj), (g_traj_ends, g_traj)):
+            traj_ends[both, 0, :2] = traj[both, 0]
+            traj_ends[both, 1, :2] = traj[both, -1]
+            traj_ends[both, 0, 2] = physTools.ecal_layerZs[0]
+            traj_ends[both, 1, 2] = physTools.ecal_layerZs[-1]
+
+        # epSep and epDot (fixed values if either trajectory is missing)
+        if 'epSepDot' in need:
+            e_norm, g_norm = [(ends[:, 1] - ends[:, 0])/\
+                              np.linalg.norm(ends[:, 1] - ends[:, 0], axis=1)[:, None]\
+                              for ends in (e_traj_ends, g_traj_ends)]
+            feats[:, slot['epSep']] = np.where(both, np.linalg.norm(e_traj_ends[:, 0] -\
+                                                                    g_traj_ends[:, 0], axis=1),
+                                               10.0 + 1.0)
+            feats[:, slot['epDot']] = np.where(both, np.sum(e_norm*g_norm, axis=1), 3.0 + 1.0)
+
+        # Territory setup (consider missing case)
+        gToe    = e_traj_ends[:, 0] - g_traj_ends[:, 0]
+        gToe    = gToe/np.sqrt( gToe[:, 0]**2 + gToe[:, 1]**2 + gToe[:, 2]**2 )[:, None]
+        origin  = g_traj_ends[:, 0] + 0.5*8.7*gToe
+
+        # Recoil electron momentum magnitude and angle with z-axis
+        recoilPMag  = np.full(nEvents, -1.0)
+        recoilPMag[has_e] = np.sqrt( e_ecalP[has_e, 0]**2 + e_ecalP[has_e, 1]**2 +\
+                                     e_ecalP[has_e, 2]**2 )
+        recoilTheta = np.full(nEvents, -1.0)
+        moving = recoilPMag > 0
+        recoilTheta[moving] = np.arccos(e_ecalP[moving, 2]/recoilPMag[moving])
+
+        # Set electron RoC binnings; always use default binning for photon RoC
+        e_binning[(recoilTheta < 10) & (recoilPMag >= 500)] = 1
+        e_binning[(recoilTheta >= 10) & (recoilTheta < 20)] = 2
+        e_binning[recoilTheta >= 20] = 3
+
+    if 'hits' in need:
+
+        # Hit information (only hits with energy are used); evt is each hit's event
+        recHits = self.chunk['EcalRecHits_v12']
+        keep = recHits['energy'] > 0
+        evt = physTools.eventIndex(recHits['offsets'])[keep]
+        e, x, y, z = recHits['energy'][keep], recHits['x'][keep],\
+                     recHits['y'][keep], recHits['z'][keep]
+        layer = (recHits['id'][keep] >> physTools.ecal_LAYER_SHIFT) &\
+                physTools.ecal_LAYER_MASK
+
+        # RoC radii in each hit's layer
+        e_radii = radii68[e_binning[evt], layer]
+        g_radii = radii68[0, layer]
+
+        # Distances to electron and photon trajectories (-1 if missing or not needed)
+        distance_e_traj = np.full(len(e), -1.0)
+        distance_g_traj = np.full(len(e), -1.0)
+
+    if 'distances' in need:
+        for distance, traj, has in ((distance_e_traj, e_traj, has_e),
+                                    (distance_g_traj, g_traj, has_g)):
+            hit = np.flatnonzero(has[evt])
+            distance[hit] = physTools.layerDists(x[hit], y[hit], layer[hit], traj, evt[hit])
+
+    # Longitudinal segment and containment region sums, means and standard deviations
+    cont_families = [family for family in containment.families if family in need]
+    if cont_families:
+        sums = containment.chunkSums(evt, nEvents, e, x, y, layer,
+                                     distance_e_traj, distance_g_traj, e_radii, g_radii,
+                                     cont_families)
+        feats[:, cont_slots] = np.concatenate([sums[quantity]\
+                                               for quantity in containment.quantities],
+                                              axis=1)
+        if 'contTotals' in need:
+            feats[:, total_slots] = containment.totals(sums)
+
+    # MIP tracking hits; (outside electron region or electron missing)
+    if 'tracking' in need:
+        tracking = (distance_e_traj >= e_radii) | (distance_e_traj == -1.0)
+        nTracking = np.bincount(evt[tracking], minlength=nEvents)
+
+    # Find the first layer of the ECal where a hit near the projected photon trajectory
+    # AND the total number of hits around the photon trajectory
+    if 'nearPhoton' in need:
+        near = tracking & has_g[evt] & (distance_g_traj < physTools.cellWidth)
+        firstNearPhLayer = np.full(nEvents, 33)
+        np.minimum.at(firstNearPhLayer, evt[near], layer[near])
+        feats[has_g, slot['firstNearPhLayer']] = firstNearPhLayer[has_g]
+        feats[has_g, slot['nNearPhHits']] = np.bincount(evt[near], minlength=nEvents)[has_g]
+        feats[~has_g, slot['nNearPhHits']] = feats[~has_g, slot['nReadoutHits']]
+
+    if 'territory' in need:
+
+        # Territory selections
+        electronSide = ( (x - origin[evt, 0])*gToe[evt, 0] +\
+                         (y - origin[evt, 1])*gToe[evt, 1] +\
+                         (z - origin[evt, 2])*gToe[evt, 2] ) > 0
+        feats[:, slot['fullElectronTerritoryHits']] = np.bincount(evt[electronSide],
+                                                                  minlength=nEvents)
+        feats[:, slot['fullPhotonTerritoryHits']] = np.bincount(evt, minlength=nEvents) -\
+                                                    feats[:, slot['fullElectronTerritoryHits']]
+
+        # Territories limited to tracking hits
+        feats[has_e, slot['electronTerritoryHits']] =\
+                    np.bincount(evt[tracking & electronSide], minlength=nEvents)[has_e]
+        feats[has_e, slot['photonTerritoryHits']] = nTracking[has_e] -\
+                                                    feats[has_e, slot['electronTerritoryHits']]
+        feats[~has_e, slot['photonTerritoryHits']] = feats[~has_e, slot['nReadoutHits']]
+        feats[~has_e, slot['TerritoryRatio']] = 10
+        feats[~has_e, slot['fullTerritoryRatio']] = 10
+        ratio = feats[:, slot['electronTerritoryHits']] != 0
+        feats[ratio, slot['TerritoryRatio']] = feats[ratio, slot['photonTerritoryHits']]/\
+                                               feats[ratio, slot['electronTerritoryHits']]
+        ratio = feats[:, slot['fullElectronTerritoryHits']] != 0
+        feats[ratio, slot['fullTerritoryRatio']] =\
+                                    feats[ratio, slot['fullPhotonTerritoryHits']]/\
+                                    feats[ratio, slot['fullElectronTerritoryHits']]
+
+    # Find MIP tracks (one event at a time; events with fewer than 4 hits have none)
+    if 'straight' in need:
+        tracking = np.flatnonzero(tracking)
+        bounds = np.searchsorted(evt[tracking], np.arange(nEvents + 1))
+        for k in np.flatnonzero(nTracking >= 4):
+            hit = tracking[bounds[k]:bounds[k + 1]]
+            feats[k, slot['straight4']], = mipTracking.findStraightTracksArrays(
+                                        x[hit], y[hit], z[hit],
+                                        e_traj_ends[k], g_traj_ends[k], mst = 4)
+
+    # Fill the trees (according to fiducial category) with values for each event
+    feats = feats[:, self.out_slots]
+    if not self.separate:
+        self.tfMakers['unsorted'].fillRows(feats)
+    else:
+        categories = np.array(['none', 'gin', 'ein', 'egin'])[2*e_fid + g_fid]
+        for category in self.tfMakers:
+            self.tfMakers[category].fillRows(feats[categories == category])
+
 if __name__ == "__main__":
     main()